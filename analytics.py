@@ -0,0 +1,258 @@
+#!/usr/bin/env python
+"""
+用NumPy统计缓存中的菜单：每个账号每月花了多少、余额大约能用到哪天、哪些菜最受欢迎
+数据来自cache中的menus和balances，先用bulk、export或scheduler拉取过才有
+所有菜单铺平成一张按列存放的表（每个账号每天每道菜一行），统计都是对整列做向量运算，不逐个遍历Course
+python analytics.py [学号 ...] [--window 天数] [--top 名次] [--json]
+"""
+import datetime
+import json
+import sys
+from operator import itemgetter
+
+import numpy as np
+
+import cache
+import canteen
+from meals import MEAL_NAME
+
+
+class MenuTable(object):
+    """
+    列（都是长度相同的ndarray）：
+        account: 账号在accounts中的序号
+        day: 日期，datetime64[D]
+        meal: 餐次序号
+        course: 菜在这一餐中的序号，同Course.id，即course_amount的键的第二项
+        dish: 菜在dishes中的序号，同一类别、同一名字的菜算同一道
+        price, max, current: 同Course
+        required: 是否为必订菜（在Meal.required_course中）
+        mutable: 这一天的菜单还能否修改
+    """
+    def __init__(self, accounts, dishes, columns):
+        """
+        :type accounts: list[str]
+        :type dishes: list[(str, str)]
+        :type columns: dict
+        :param dishes: [(类别, 菜名)]
+        :param columns: {列名: ndarray}
+        """
+        self.accounts = accounts
+        self.dishes = dishes
+        self.account = columns['account']
+        self.day = columns['day']
+        self.meal = columns['meal']
+        self.course = columns['course']
+        self.dish = columns['dish']
+        self.price = columns['price']
+        self.max = columns['max']
+        self.current = columns['current']
+        self.required = columns['required']
+        self.mutable = columns['mutable']
+        self.spend = self.price * self.current
+
+    def __len__(self):
+        return len(self.account)
+
+    @classmethod
+    def from_menus(cls, menus):
+        """
+        :type menus: dict
+        :param menus: {学号: Menu.to_dict()的结果的列表}
+        :rtype: MenuTable
+        """
+        accounts = sorted(menus)
+        # 账号、日期、能否修改每个菜单一项，餐次每餐一项，最后按行数展开；其余的列每行一项
+        # 不先拼成一行一个tuple再转成结构化数组：几十万行每个格子都经过一次Python对象，比逐个遍历求解还慢
+        menu_account, menu_day, menu_mutable, menu_rows = [], [], [], []
+        meal_id, meal_rows = [], []
+        types, names, price, max_amount, current = [], [], [], [], []
+        required = []
+        get_type, get_name, get_price, get_max, get_current = map(itemgetter, ('type', 'name', 'price', 'max',
+                                                                               'current'))
+        for account_id, username in enumerate(accounts):
+            for menu in menus[username]:
+                rows = len(price)
+                for meal in menu['meals']:
+                    courses = meal['courses']
+                    # Course.id就是它在这一餐中的位置，必订菜的行号可以直接算出来
+                    required.extend([len(price) + course_id for course_id in meal['required_course']])
+                    meal_id.append(meal['id'])
+                    meal_rows.append(len(courses))
+                    types.extend(map(get_type, courses))
+                    names.extend(map(get_name, courses))
+                    price.extend(map(get_price, courses))
+                    max_amount.extend(map(get_max, courses))
+                    current.extend(map(get_current, courses))
+                menu_account.append(account_id)
+                menu_day.append(menu['date'])
+                menu_mutable.append(menu['mutable'])
+                menu_rows.append(len(price) - rows)
+
+        # 按第一次出现的顺序给菜编号
+        dish_ids = {dish: i for i, dish in enumerate(dict.fromkeys(zip(types, names)))}
+        meal_rows = np.array(meal_rows, dtype=np.int64)
+        columns = {
+            'account': np.repeat(np.array(menu_account, dtype=np.int32), menu_rows),
+            'day': np.repeat(np.array(menu_day, dtype='datetime64[D]'), menu_rows),
+            'meal': np.repeat(np.array(meal_id, dtype=np.int8), meal_rows),
+            'course': (np.arange(len(price)) - np.repeat(np.cumsum(meal_rows) - meal_rows, meal_rows)).astype(np.int16),
+            'dish': np.array(list(map(dish_ids.__getitem__, zip(types, names))), dtype=np.int32),
+            'price': np.array(price, dtype=np.float64),
+            'max': np.array(max_amount, dtype=np.int32),
+            'current': np.array(current, dtype=np.int32),
+            'required': np.zeros(len(price), dtype=np.bool_),
+            'mutable': np.repeat(np.array(menu_mutable, dtype=np.bool_), menu_rows)
+        }
+        columns['required'][required] = True
+        return cls(accounts, list(dish_ids), columns)
+
+    @classmethod
+    def from_cache(cls, usernames=None):
+        """
+        :type usernames: list[str]
+        :param usernames: 默认为缓存过菜单的所有账号
+        :rtype: MenuTable
+        """
+        if not usernames:
+            usernames = cache.cached_usernames()
+        return cls.from_menus({username: cache.cached_menus(username) for username in usernames})
+
+    def months(self):
+        """
+        表中出现过的月份（已排序），和每一行所在月份的序号
+        :rtype: (numpy.ndarray, numpy.ndarray)
+        """
+        return np.unique(self.day.astype('datetime64[M]'), return_inverse=True)
+
+    def monthly_spend(self):
+        """
+        每个账号每月的花费，返回(月份, 数组[账号, 月份])
+        :rtype: (numpy.ndarray, numpy.ndarray)
+        """
+        months, month_index = self.months()
+        key = self.account.astype(np.int64) * len(months) + month_index
+        spend = np.bincount(key, weights=self.spend, minlength=len(self.accounts) * len(months))
+        return months, spend.reshape(len(self.accounts), len(months))
+
+    def meal_spend(self):
+        """
+        每个账号每一餐的花费，数组[账号, 餐次]
+        :rtype: numpy.ndarray
+        """
+        key = self.account.astype(np.int64) * len(MEAL_NAME) + self.meal
+        spend = np.bincount(key, weights=self.spend, minlength=len(self.accounts) * len(MEAL_NAME))
+        return spend.reshape(len(self.accounts), len(MEAL_NAME))
+
+    def daily_spend(self):
+        """
+        每个账号每天的花费，返回(日期, 数组[账号, 日期])
+        :rtype: (numpy.ndarray, numpy.ndarray)
+        """
+        days, day_index = np.unique(self.day, return_inverse=True)
+        key = self.account.astype(np.int64) * len(days) + day_index
+        spend = np.bincount(key, weights=self.spend, minlength=len(self.accounts) * len(days))
+        return days, spend.reshape(len(self.accounts), len(days))
+
+    def depletion(self, balances, today=None, window=28):
+        """
+        按最近window天的平均花费，估算每个账号的余额能用到哪天
+        已经订了的以后的餐先从余额里扣掉，再按平均花费往后推
+        :type balances: numpy.ndarray
+        :type today: datetime.date
+        :type window: int
+        :param balances: 每个账号的余额，顺序同accounts，不知道的为nan
+        :return: (每天平均花费, 扣掉已订的之后的余额, 预计用完的日期)，不花钱或不知道余额的为NaT
+        :rtype: (numpy.ndarray, numpy.ndarray, numpy.ndarray)
+        """
+        today = np.datetime64(today or datetime.date.today(), 'D')
+        n = len(self.accounts)
+        recent = (self.day < today) & (self.day >= today - window)
+        rate = np.bincount(self.account[recent], weights=self.spend[recent], minlength=n) / window
+        upcoming = np.bincount(self.account[self.day >= today], weights=self.spend[self.day >= today], minlength=n)
+        remaining = balances - upcoming
+
+        days_left = np.full(n, np.nan)
+        np.divide(remaining, rate, out=days_left, where=rate > 0)
+        dates = np.full(n, np.datetime64('NaT'), dtype='datetime64[D]')
+        known = np.isfinite(days_left)
+        dates[known] = today + np.maximum(days_left[known], 0).astype(np.int64)
+        return rate, remaining, dates
+
+    def popular_dishes(self, top=10):
+        """
+        按总共订出的份数排序的前top道菜，返回[(类别, 菜名, 份数, 供应次数, 有人订的比例, 平均价格)]
+        必订菜人人都有，不算在内
+        :type top: int
+        :rtype: list[tuple]
+        """
+        optional = np.array([dish_type != '必订菜' for dish_type, _ in self.dishes], dtype=np.bool_)
+        n = len(self.dishes)
+        ordered = np.bincount(self.dish, weights=self.current, minlength=n)
+        offered = np.bincount(self.dish, minlength=n)
+        taken = np.bincount(self.dish, weights=self.current > 0, minlength=n)
+        mean_price = np.bincount(self.dish, weights=self.price, minlength=n) / np.maximum(offered, 1)
+
+        candidates = np.flatnonzero(optional & (offered > 0))
+        ranking = candidates[np.argsort(-ordered[candidates], kind='stable')][:top]
+        return [(self.dishes[i][0], self.dishes[i][1], int(ordered[i]), int(offered[i]), taken[i] / offered[i],
+                 mean_price[i]) for i in ranking]
+
+
+def load_balances(accounts):
+    """
+    :type accounts: list[str]
+    :rtype: numpy.ndarray
+    """
+    balances = np.full(len(accounts), np.nan)
+    for i, username in enumerate(accounts):
+        entry = cache.load_balance(username)
+        if entry is not None:
+            balances[i] = entry['balance']
+    return balances
+
+
+def command(args):
+    """
+    canteen.py stats，参数见那里
+    :type args: argparse.Namespace
+    """
+    table = MenuTable.from_cache(args.accounts)
+    if not len(table):
+        print('缓存中没有菜单')
+        return
+    months, spend = table.monthly_spend()
+    rate, remaining, dates = table.depletion(load_balances(table.accounts), window=args.window)
+    popular = table.popular_dishes(args.top)
+
+    if args.json:
+        print(json.dumps({
+            'accounts': [{
+                'student_id': username,
+                'monthly_spend': {str(month): spend[i, j] for j, month in enumerate(months)},
+                'daily_rate': rate[i],
+                'remaining': None if np.isnan(remaining[i]) else remaining[i],
+                'depleted_on': None if np.isnat(dates[i]) else str(dates[i])
+            } for i, username in enumerate(table.accounts)],
+            'popular_dishes': [dict(zip(('type', 'name', 'ordered', 'offered', 'take_rate', 'mean_price'), row))
+                               for row in popular]
+        }, ensure_ascii=False))
+        return
+
+    print('{0:<10}'.format('学号') + ''.join('{0:>10}'.format(str(month)) for month in months) +
+          '{0:>10}{1:>10}{2:>12}'.format('日均', '余额', '用完'))
+    for i, username in enumerate(table.accounts):
+        print('{0:<10}'.format(username) + ''.join('{0:>10.2f}'.format(x) for x in spend[i]) +
+              '{0:>10.2f}{1:>10.2f}{2:>12}'.format(rate[i], remaining[i], '-' if np.isnat(dates[i]) else str(dates[i])))
+    print()
+    for dish_type, name, ordered, offered, take_rate, mean_price in popular:
+        print('{0}\t{1}\t{2}份\t供应{3}次\t{4:.0%}有人订\t{5:.2f}元'.format(
+            dish_type, name, ordered, offered, take_rate, mean_price))
+
+
+def main():
+    canteen.main(['stats'] + sys.argv[1:])
+
+
+if __name__ == '__main__':
+    main()
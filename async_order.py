@@ -0,0 +1,386 @@
+"""
+order.py的asyncio版本，基于aiohttp
+页面的解析、表单的生成都复用order.py里的，这里只管收发请求
+一个event loop上可以同时跑很多个AsyncSession，每个学生一个，互不共享Cookie
+会话过期的处理同order.Session：设置了relogin（见login）的话先重新登录，GET再重试一次，POST则抛出StaleForm
+每个请求同样要经过transport里那个host的Governor（限速、按AIMD调整并发数），和同步的Session共用一份额度
+"""
+import asyncio
+import contextvars
+
+import aiohttp
+from urllib3.exceptions import MaxRetryError
+
+import order
+from order import (
+    LOGIN_URL, CARD_SYSTEM_LOGIN_URL, CARD_SYSTEM_REFERRER,
+    CALENDAR_URL, CALENDAR_REFERRER, MENU_URL,
+    logined_skeleton_form, skeleton_headers, LoginFailed, SessionExpired, StaleForm
+)
+from transport import POOL_SIZES, RETRIES, TIMEOUT, shared as shared_transport
+
+# 正在重新登录的那个task里为True，它发的请求不再检查是否过期，相当于order.Session.recovering
+recovering = contextvars.ContextVar('recovering', default=False)
+
+
+async def acquire(governor):
+    """
+    在线程里等Governor.acquire，不堵住event loop。返回开始的时间，请求完了要调用governor.release
+    :type governor: transport.Governor
+    :rtype: float
+    """
+    future = asyncio.get_running_loop().run_in_executor(None, governor.acquire)
+    try:
+        return await asyncio.shield(future)
+    except asyncio.CancelledError:
+        # 线程里的acquire停不下来，等它拿到了再还回去，不然这个名额就一直占着
+        def give_back(done):
+            if not done.cancelled() and done.exception() is None:
+                governor.release(done.result(), True)
+        future.add_done_callback(give_back)
+        raise
+
+
+class AsyncSession(object):
+    """
+    用法和order.Session差不多，只是s_get/s_post要await，且直接返回页面的文本
+    async with AsyncSession() as session:
+        await login(session, username, password)
+    """
+
+    def __init__(self, connector=None, transport=None):
+        """
+        :type connector: aiohttp.BaseConnector
+        :type transport: transport.Transport
+        :param connector: 多个AsyncSession可以共用一个connector（连接池），此时需自行关闭它
+        :param transport: 用哪个Transport的Governor限流，默认为所有Session共用的那个
+        """
+        self.transport = transport or shared_transport()
+        if connector is None:
+            # 每个host实际同时进行的请求数由Governor管着，连接池不比最大的那个POOL_SIZES小就行
+            connector = aiohttp.TCPConnector(limit_per_host=max(POOL_SIZES.values()))
+            connector_owner = True
+        else:
+            connector_owner = False
+        connect_timeout, read_timeout = TIMEOUT
+        self.session = aiohttp.ClientSession(
+            connector=connector,
+            connector_owner=connector_owner,
+            cookie_jar=aiohttp.CookieJar(),
+            headers=skeleton_headers,
+            timeout=aiohttp.ClientTimeout(sock_connect=connect_timeout, sock_read=read_timeout)
+        )
+        # 以下同order.Session，只是锁换成了asyncio的
+        self.relogin = None
+        self.login_lock = asyncio.Lock()
+        self.logins = 0
+        self.login_failed = False
+        self.in_flight = 0
+        self.in_flight_changed = asyncio.Condition()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+
+    async def close(self):
+        await self.session.close()
+
+    async def s_get(self, url, params=None, referrer=None, logged_in=True):
+        """
+        :type url: str
+        :type params: dict
+        :type referrer: str
+        :type logged_in: bool
+        :rtype: str
+        """
+        return await self.send_checked('GET', url, logged_in, params=params,
+                                       headers=order.Session.make_headers(referrer))
+
+    async def s_post(self, url, data, params=None, referrer=None, logged_in=True):
+        """
+        :type url: str
+        :type data: dict
+        :type params: dict
+        :type referrer: str
+        :type logged_in: bool
+        :rtype: str
+        """
+        if logged_in:
+            real_data = logined_skeleton_form.copy()
+            real_data.update(data)
+        else:
+            real_data = data
+        # aiohttp不像requests那样会把int转成str
+        real_data = {k: str(v) for k, v in real_data.items()}
+        return await self.send_checked('POST', url, logged_in, data=real_data, params=params,
+                                       headers=order.Session.make_headers(referrer))
+
+    async def send_checked(self, method, url, logged_in, **kwargs):
+        """
+        同order.Session.send_checked：被重定向到登录页说明会话过期了
+        设置了relogin的话，先重新登录；GET再重试一次，POST则抛出StaleForm
+        :type method: str
+        :type url: str
+        :type logged_in: bool
+        :rtype: str
+        """
+        if not logged_in or recovering.get():
+            return (await self.request(method, url, **kwargs))[1]
+        logins, (final_url, page) = await self.send_counted(method, url, **kwargs)
+        if LOGIN_URL in final_url:
+            await self.recover(logins)
+            if method != 'GET':
+                raise StaleForm
+            _, (final_url, page) = await self.send_counted(method, url, **kwargs)
+            if LOGIN_URL in final_url:
+                raise SessionExpired
+        return page
+
+    async def send_counted(self, method, url, **kwargs):
+        """
+        同order.Session.send_counted，返回(发出前的self.logins, (最后的URL, 页面))
+        :type method: str
+        :type url: str
+        :rtype: (int, (str, str))
+        """
+        async with self.login_lock:
+            logins = self.logins
+            self.in_flight += 1
+        try:
+            return logins, await self.request(method, url, **kwargs)
+        finally:
+            self.in_flight -= 1
+            async with self.in_flight_changed:
+                self.in_flight_changed.notify_all()
+
+    async def recover(self, logins):
+        """
+        同order.Session.recover
+        :type logins: int
+        :param logins: 发出过期的那个请求之前的self.logins
+        """
+        if self.relogin is None or recovering.get():
+            raise SessionExpired
+        async with self.login_lock:
+            if self.login_failed:
+                raise LoginFailed
+            if self.logins != logins:
+                return
+            async with self.in_flight_changed:
+                await self.in_flight_changed.wait_for(lambda: self.in_flight == 0)
+            token = recovering.set(True)
+            try:
+                await self.relogin(self)
+            except LoginFailed:
+                self.login_failed = True
+                raise
+            finally:
+                recovering.reset(token)
+            self.logins += 1
+
+    async def request(self, method, url, **kwargs):
+        """
+        经过url所在host的Governor发出请求，返回(跟着重定向走到的URL, 页面)
+        5xx的重试、退避同transport.PooledAdapter：只重试GET，每次重试都重新经过Governor
+        :type method: str
+        :type url: str
+        :rtype: (str, str)
+        """
+        governor = self.transport.governor(url)
+        retries = RETRIES
+        while True:
+            started = None if governor is None else await acquire(governor)
+            ok = False
+            try:
+                async with self.session.request(method, url, **kwargs) as response:
+                    page = await response.text()
+                ok = response.status < 500
+            finally:
+                if governor is not None:
+                    governor.release(started, ok)
+            if not retries.is_retry(method, response.status):
+                return str(response.url), page
+            try:
+                retries = retries.increment(method, url)
+            except MaxRetryError:
+                return str(response.url), page
+            await asyncio.sleep(retries.get_backoff_time())
+
+
+async def login_cas(session, username, password, cas_param=None):
+    """
+    同order.login_cas
+    :type session: AsyncSession
+    :type username: str
+    :type password: str
+    :type cas_param: list
+    """
+    if cas_param is None:
+        login_page = await session.s_get(LOGIN_URL, logged_in=False)
+        jsessionid, lt = order.parse_login_page(login_page)
+        login_post_url = LOGIN_URL + ';jsessionid=' + jsessionid
+    else:
+        jsessionid, lt = cas_param[:2]
+        login_post_url = LOGIN_URL
+
+    login_form = order.make_login_form(username, password, lt)
+    auth = await session.s_post(login_post_url, login_form, referrer=LOGIN_URL, logged_in=False)
+    return order.parse_auth_page(auth, jsessionid)
+
+
+async def login_card_system(session):
+    """
+    同order.login_card_system
+    :type session: AsyncSession
+    :rtype: (str, str)
+    """
+    page = await session.s_get(CARD_SYSTEM_LOGIN_URL, referrer=CARD_SYSTEM_REFERRER)
+    return order.parse_welcome_page(page)
+
+
+async def login(session, username, password):
+    """
+    登录中央认证和“一卡通”系统，返回用户的姓名和卡中的余额；之后会话过期时自动重新登录，同cache.login
+    不读写缓存的Cookie：文件IO会堵住event loop，而且一个event loop上的账号一般是一起登录的
+    登录失败时抛出LoginFailed
+    :type session: AsyncSession
+    :type username: str
+    :type password: str
+    :rtype: (str, str)
+    """
+    async def relogin(session):
+        cas_param = await login_cas(session, username, password)
+        if cas_param and not cas_param[2]:
+            # 同cache.login：lt被还在路上的请求换掉了就用新的lt再试一次，密码错了就不要再试
+            cas_param = await login_cas(session, username, password, cas_param)
+        if cas_param:
+            raise LoginFailed
+        return await login_card_system(session)
+
+    session.relogin = relogin
+    return await relogin(session)
+
+
+class AsyncCalendar(order.Calendar):
+    """
+    test、prefetch、refresh和query_calendar都变成了协程，orderable_dates、to_dict等不访问服务器的照旧
+    同一个Calendar的ViewState是串行的，不要对同一个AsyncCalendar并发地调用这些协程
+    """
+
+    @classmethod
+    async def calendar_init(cls, session):
+        """
+        :type session: AsyncSession
+        """
+        page = await session.s_get(CALENDAR_URL, referrer=CALENDAR_REFERRER)
+        return cls.from_page(page, session)
+
+    @classmethod
+    def from_dict(cls, d, session):
+        """
+        用缓存的索引还原，没有ViewState，第一次查询时会先refresh
+        :type d: dict
+        :type session: AsyncSession
+        """
+        return cls(d['selected_year'], None, d['selectable_year'], d['months'], session)
+
+    async def refresh(self):
+        """同Calendar.refresh"""
+        calendar = await self.calendar_init(self.session)
+        self.selected_year = calendar.selected_year
+        self.form_param = calendar.form_param
+        self.selectable_year = calendar.selectable_year
+        self.update(calendar)
+
+    async def prefetch(self, start, end):
+        """
+        同Calendar.prefetch
+        :type start: datetime.date
+        :type end: datetime.date
+        """
+        for year, month in self.months_to_query(start, end):
+            self['{0}-{1:02}'.format(year, month)] = await self.query_calendar(year, month)
+
+    async def test(self, date):
+        """
+        :type date: datetime.date
+        """
+        if date.year not in self.selectable_year:
+            return False
+        query_string = date.strftime('%Y-%m')
+        if query_string not in self:
+            self[query_string] = await self.query_calendar(date.year, date.month)
+        return date.strftime('%Y-%m-%d') in self[query_string]
+
+    async def query_calendar(self, year, month):
+        """
+        同Calendar.query_calendar
+        :type year: int
+        :type month: int
+        :rtype: list[str]
+        """
+        if self.form_param is None:
+            await self.refresh()
+        try:
+            return await self.post_query(year, month)
+        except order.StaleForm:
+            # s_post抛出StaleForm前已经重新登录了，换上新会话的ViewState再查一遍，只是查询，重来无妨
+            await self.refresh()
+            return await self.post_query(year, month)
+
+    async def post_query(self, year, month):
+        """
+        同Calendar.post_query
+        :type year: int
+        :type month: int
+        :rtype: list[str]
+        """
+        page = await self.session.s_post(CALENDAR_URL, self.make_query_form(year, month), referrer=CALENDAR_URL)
+        self.form_param = order.get_web_forms_field(page)
+
+        if not year == self.selected_year:
+            page = await self.session.s_post(CALENDAR_URL, self.make_query_form(year, month), referrer=CALENDAR_URL)
+            self.form_param = order.get_web_forms_field(page)
+            self.selected_year = year
+
+        return order.parse_date_list(page)
+
+
+async def get_menu(session, date):
+    """
+    :type session: AsyncSession
+    :type date: str
+    :rtype: str
+    """
+    return await session.s_get(MENU_URL, params={'Date': date}, referrer=CALENDAR_URL)
+
+
+async def fetch_menu(session, date):
+    """
+    :type session: AsyncSession
+    :type date: str
+    :rtype: order.Menu
+    """
+    return order.Menu(date, await get_menu(session, date))
+
+
+async def submit_menu(session, date, course_amount, do_not_order, form_param, batch=False):
+    """
+    同order.submit_menu
+    :type session: AsyncSession
+    :type date: str
+    :type course_amount: dict
+    :type do_not_order: list
+    :type form_param: list
+    :type batch: bool
+    :rtype: bool
+    """
+    steps = order.plan_submit(course_amount, do_not_order, form_param, batch)
+    referrer = MENU_URL + '?Date=' + date
+    for i, submit_menu_form in enumerate(steps):
+        page = await session.s_post(MENU_URL, submit_menu_form, params={'Date': date}, referrer=referrer)
+        for next_form in steps[i + 1:]:
+            order.update_web_forms_field(next_form, page)
+    return order.parse_submit_result(page)
@@ -0,0 +1,92 @@
+"""
+比较统计花费和受欢迎的菜的两种做法：逐个遍历Course对象，和analytics.MenuTable的向量运算
+python -m benchmarks.bench_analytics [--accounts 账号数] [--months 月数]
+建表（把菜单铺平成数组）只做一次，之后的各种统计都在表上做，所以两者分开计时
+"""
+import argparse
+import datetime
+import random
+import time
+
+import order
+from analytics import MenuTable
+from benchmarks import samples
+
+
+def synthetic_menus(accounts, months):
+    """
+    每个账号每月21天的菜单，已订份数随机
+    :type accounts: int
+    :type months: int
+    :rtype: dict
+    """
+    mutable, cells = next(iter(samples.reference_menus().values()))
+    template = order.Menu('2015-09-01', samples.menu_page(samples.split_meals(cells), mutable)).to_dict()
+    rng = random.Random(0)
+    menus = {}
+    for account in range(accounts):
+        account_menus = []
+        for month in range(months):
+            first = datetime.date(2015 + month // 12, month % 12 + 1, 1)
+            for day in range(21):
+                menu = dict(template, date=(first + datetime.timedelta(day)).isoformat())
+                menu['meals'] = [dict(meal, courses=[dict(course, current=rng.randint(0, course['max']))
+                                                     for course in meal['courses']])
+                                 for meal in template['meals']]
+                account_menus.append(menu)
+        menus[str(1000000 + account)] = account_menus
+    return menus
+
+
+def loop_stats(menus):
+    """
+    以前的写法：还原成Menu，逐道菜累加
+    :type menus: dict
+    """
+    monthly = {}
+    ordered = {}
+    for username, account_menus in menus.items():
+        for d in account_menus:
+            menu = order.Menu.from_dict(d)
+            month = menu.date[:7]
+            for meal in menu:
+                for course in meal:
+                    monthly[username, month] = monthly.get((username, month), 0) + course.price * course.current
+                    ordered[course.type, course.name] = ordered.get((course.type, course.name), 0) + course.current
+    return monthly, sorted(ordered.items(), key=lambda item: -item[1])[:10]
+
+
+def vector_stats(table):
+    """
+    :type table: MenuTable
+    """
+    table.monthly_spend()
+    table.meal_spend()
+    return table.popular_dishes(10)
+
+
+def timed(func, *args):
+    start = time.perf_counter()
+    result = func(*args)
+    return result, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description='比较逐个遍历Course和向量运算的统计速度')
+    parser.add_argument('--accounts', type=int, default=100)
+    parser.add_argument('--months', type=int, default=10)
+    args = parser.parse_args()
+
+    menus = synthetic_menus(args.accounts, args.months)
+    _, loop_time = timed(loop_stats, menus)
+    table, build_time = timed(MenuTable.from_menus, menus)
+    _, vector_time = timed(vector_stats, table)
+
+    print('{0}个账号×{1}个月，{2}行'.format(args.accounts, args.months, len(table)))
+    print('{0:<24}{1:>10.1f} ms'.format('逐个遍历Course', loop_time * 1000))
+    print('{0:<24}{1:>10.1f} ms'.format('建表', build_time * 1000))
+    print('{0:<24}{1:>10.1f} ms'.format('向量统计', vector_time * 1000))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,145 @@
+"""
+用本机的FakeServer跑async_order：多个账号在一个event loop上登录、查日历、并发拉取菜单、提交，和线程池的做法比较
+登录、打开日历之后让所有会话（连同中央登录）过期：日历手上的ViewState成了旧会话的，查询时应重新登录、刷新日历再查；
+每个账号应该只重新登录一次，其余同时发现过期的请求等它登录完再重试
+python -m benchmarks.bench_async [--latency 秒] [--accounts 账号数] [--workers 线程数]
+"""
+import argparse
+import asyncio
+import datetime
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import async_order
+import order
+from benchmarks.bench_e2e import PASSWORD, TODAY, new_session
+from benchmarks.fake_server import FakeServer
+
+# 日历上要查的月份，跨了年，要切换一次年份
+PREFETCH_START = datetime.date(2015, 11, 1)
+PREFETCH_END = datetime.date(2016, 1, 31)
+MONTHS = ['2015-10', '2015-11', '2015-12', '2016-01']
+
+
+async def async_accounts(server, users, dates):
+    """
+    :type server: FakeServer
+    :type users: list[str]
+    :type dates: list[str]
+    :rtype: (float, dict)
+    :return: (查日历、拉取菜单和提交用的秒数, {学号: (提交的结果, 查到的月份)})
+    """
+    connector = server.make_connector()
+    replay_transport = server.make_transport()
+    sessions = [async_order.AsyncSession(connector, replay_transport) for _ in users]
+    try:
+        await asyncio.gather(*(async_order.login(session, username, PASSWORD)
+                               for session, username in zip(sessions, users)))
+        calendars = await asyncio.gather(*(async_order.AsyncCalendar.calendar_init(session) for session in sessions))
+        server.expire(tgt=True)
+
+        async def account(session, calendar):
+            await calendar.prefetch(PREFETCH_START, PREFETCH_END)
+            menus = await asyncio.gather(*(async_order.fetch_menu(session, date) for date in dates))
+            menu = menus[-1]
+            try:
+                result = await async_order.submit_menu(session, menu.date, menu.get_course_amount(),
+                                                       [menu.do_not_order, [], []], menu.form_param)
+            except order.StaleForm:
+                menu = await async_order.fetch_menu(session, menu.date)
+                result = await async_order.submit_menu(session, menu.date, menu.get_course_amount(),
+                                                       [menu.do_not_order, [], []], menu.form_param)
+            return result, sorted(calendar)
+
+        start = time.perf_counter()
+        results = await asyncio.gather(*(account(session, calendar) for session, calendar in zip(sessions, calendars)))
+        return time.perf_counter() - start, dict(zip(users, results))
+    finally:
+        for session in sessions:
+            await session.close()
+        await connector.close()
+        replay_transport.close()
+
+
+def thread_login(session, username):
+    """
+    同async_order.login，不读写缓存的Cookie
+    :type session: order.Session
+    :type username: str
+    """
+    def relogin(session):
+        if order.login_cas(username, PASSWORD, session=session):
+            raise order.LoginFailed
+        return order.login_card_system(session)
+
+    session.relogin = relogin
+    return relogin(session)
+
+
+def thread_accounts(server, users, dates, workers):
+    """
+    同async_accounts，用order.Session和线程池
+    :type server: FakeServer
+    :type users: list[str]
+    :type dates: list[str]
+    :type workers: int
+    :rtype: (float, dict)
+    """
+    replay_transport = server.make_transport()
+    sessions = [new_session(server, replay_transport) for _ in users]
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        list(executor.map(thread_login, sessions, users))
+        calendars = list(executor.map(order.Calendar.calendar_init, sessions))
+        server.expire(tgt=True)
+
+        def account(session, calendar):
+            calendar.prefetch(PREFETCH_START, PREFETCH_END)
+            menus = order.fetch_menus(dates, workers, session)
+            menu = menus[dates[-1]]
+            try:
+                result = order.submit_menu(menu.date, menu.get_course_amount(), [menu.do_not_order, [], []],
+                                           menu.form_param, session)
+            except order.StaleForm:
+                menu = order.Menu(menu.date, session=session)
+                result = order.submit_menu(menu.date, menu.get_course_amount(), [menu.do_not_order, [], []],
+                                           menu.form_param, session)
+            return result, sorted(calendar)
+
+        start = time.perf_counter()
+        results = list(executor.map(account, sessions, calendars))
+    replay_transport.close()
+    return time.perf_counter() - start, dict(zip(users, results))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='比较async_order和线程池的多账号吞吐量')
+    parser.add_argument('--latency', type=float, default=0.02, help='假服务器处理每个请求的时间（秒）')
+    parser.add_argument('--accounts', type=int, default=20)
+    parser.add_argument('--workers', type=int, default=8, help='线程池的线程数')
+    args = parser.parse_args()
+
+    users = [str(1000000 + i) for i in range(args.accounts)]
+    server = FakeServer({username: PASSWORD for username in users}, today=TODAY, latency=args.latency).start()
+    dates = [date for date in server.orderable_dates(2015, 10) if server.is_mutable(date)]
+    try:
+        print('{0}个账号，每个账号{1}个日期'.format(len(users), len(dates)))
+        print('{0:<16}{1:>12}{2:>12}{3:>16}'.format('', '用时(ms)', '请求数', '重新登录(CAS POST)'))
+        for name, run in (('asyncio', lambda: asyncio.run(async_accounts(server, users, dates))),
+                          ('线程x{0}'.format(args.workers),
+                           lambda: thread_accounts(server, users, dates, args.workers))):
+            requests_before = len(server.log)
+            logins_before = server.count('POST', '/cas/login')
+            elapsed, results = run()
+            requests = len(server.log) - requests_before
+            # 登录时一次，过期后每个账号只应再登录一次
+            relogins = server.count('POST', '/cas/login') - logins_before - len(users)
+            assert all(result for result, _ in results.values()), '有账号提交失败'
+            assert all(months == MONTHS for _, months in results.values()), '日历查到的月份不对'
+            assert relogins == len(users), '过期后重新登录了{0}次，应为{1}次'.format(relogins, len(users))
+            print('{0:<16}{1:>12.1f}{2:>12}{3:>16}'.format(name, elapsed * 1000, requests, relogins))
+    finally:
+        server.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,200 @@
+"""
+用本机的FakeServer测端到端的延迟和吞吐量：登录、遍历日历、拉取并解析菜单、提交菜单、多账号并发
+python -m benchmarks.bench_e2e [--latency 秒] [--accounts 账号数] [--workers 线程数] [--json]
+--json时每个场景输出一行JSON，方便和以前的结果比较
+"""
+import argparse
+import datetime
+import json
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import order
+from benchmarks.fake_server import FakeServer
+
+TODAY = datetime.date(2015, 10, 1)
+PASSWORD = 'password'
+
+
+def new_session(server, replay_transport=None):
+    """
+    :type server: FakeServer
+    :type replay_transport: transport.Transport
+    :param replay_transport: 默认为所有session共用的那个
+    :rtype: order.Session
+    """
+    session = order.Session()
+    server.mount(session, replay_transport)
+    return session
+
+
+def login(server, username, replay_transport=None):
+    """
+    :type server: FakeServer
+    :type username: str
+    :type replay_transport: transport.Transport
+    :rtype: order.Session
+    """
+    session = new_session(server, replay_transport)
+    if order.login_cas(username, PASSWORD, session=session):
+        raise order.LoginFailed
+    order.login_card_system(session)
+    return session
+
+
+def timed(func, repeat):
+    """
+    :type repeat: int
+    :rtype: list[float]
+    """
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+def connection_count(transports):
+    """
+    这些Transport一共建立过多少个连接
+    :type transports: list[transport.Transport]
+    :rtype: int
+    """
+    return sum(entry['connections'] for replay_transport in transports
+               for entry in replay_transport.stats().values())
+
+
+def summary(name, timings, ops_per_run=1, server=None, requests_before=0, connections=None):
+    """
+    :type name: str
+    :type timings: list[float]
+    :type ops_per_run: int
+    :type connections: int
+    :param connections: 期间新建的连接数
+    :rtype: dict
+    """
+    timings = sorted(timings)
+    result = {
+        'scenario': name,
+        'runs': len(timings),
+        'mean_ms': statistics.mean(timings) * 1000,
+        'p50_ms': timings[len(timings) // 2] * 1000,
+        'p95_ms': timings[min(len(timings) - 1, int(len(timings) * 0.95))] * 1000,
+        'ops_per_s': ops_per_run * len(timings) / sum(timings)
+    }
+    if server is not None:
+        result['requests_per_run'] = (len(server.log) - requests_before) / len(timings)
+    if connections is not None:
+        result['connections_per_run'] = connections / len(timings)
+    return result
+
+
+def run(args):
+    users = {str(1000000 + i): PASSWORD for i in range(args.accounts)}
+    server = FakeServer(users, today=TODAY, latency=args.latency).start()
+    username = next(iter(users))
+    dates = server.orderable_dates(2015, 10)
+    dates = [date for date in dates if server.is_mutable(date)]
+    results = []
+
+    try:
+        before = len(server.log)
+        results.append(summary('login', timed(lambda: login(server, username), args.repeat), server=server,
+                               requests_before=before))
+
+        session = login(server, username)
+
+        def walk():
+            calendar = order.Calendar.calendar_init(session)
+            calendar.prefetch(datetime.date(2015, 10, 1), datetime.date(2016, 9, 1))
+        before = len(server.log)
+        results.append(summary('calendar walk (12 months)', timed(walk, args.repeat), server=server,
+                               requests_before=before))
+
+        before = len(server.log)
+        results.append(summary('menu fetch+parse', timed(lambda: order.Menu(dates[0], session=session), args.repeat),
+                               server=server, requests_before=before))
+
+        def serial():
+            for date in dates:
+                order.Menu(date, session=session)
+        results.append(summary('menus serial ({0} dates)'.format(len(dates)), timed(serial, 1), len(dates)))
+        results.append(summary('fetch_menus x{0} ({1} dates)'.format(args.workers, len(dates)),
+                               timed(lambda: order.fetch_menus(dates, args.workers, session), 1), len(dates)))
+
+        def submit():
+            menu = order.Menu(dates[1], session=session)
+            course_amount = menu.get_course_amount()
+            course_amount[1, 3] = 1 - course_amount[1, 3]
+            # 来回切换早餐的“不订餐”
+            if 0 in menu.do_not_order:
+                do_not_order = [menu.do_not_order, [], [0]]
+            else:
+                do_not_order = [menu.do_not_order, [0], []]
+            if not order.submit_menu(dates[1], course_amount, do_not_order, menu.form_param, session=session):
+                raise RuntimeError('submit failed')
+        before = len(server.log)
+        results.append(summary('fetch+submit (1 toggle)', timed(submit, args.repeat), server=server,
+                               requests_before=before))
+
+        def account(username, replay_transport=None):
+            session = login(server, username, replay_transport)
+            calendar = order.Calendar.calendar_init(session)
+            date = calendar.orderable_dates()[-1]
+            menu = order.Menu(date, session=session)
+            do_not_order = [menu.do_not_order, [], []]
+            order.submit_menu(date, menu.get_course_amount(), do_not_order, menu.form_param, session=session)
+
+        # 以前每个账号一个Session，也就各有各的连接池
+        separate = [server.make_transport() for _ in users]
+
+        def accounts_separate():
+            with ThreadPoolExecutor(max_workers=args.workers) as executor:
+                list(executor.map(account, users, separate))
+        timings = timed(accounts_separate, 1)
+        results.append(summary('accounts x{0} ({1}, own pools)'.format(args.workers, len(users)), timings,
+                               len(users), connections=connection_count(separate)))
+        for replay_transport in separate:
+            replay_transport.close()
+
+        shared = server.make_transport()
+
+        def accounts_shared():
+            with ThreadPoolExecutor(max_workers=args.workers) as executor:
+                list(executor.map(account, users, [shared] * len(users)))
+        timings = timed(accounts_shared, 1)
+        results.append(summary('accounts x{0} ({1}, shared pool)'.format(args.workers, len(users)), timings,
+                               len(users), connections=connection_count([shared])))
+        shared.close()
+    finally:
+        server.stop()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='用本机的假服务器测端到端的性能')
+    parser.add_argument('--latency', type=float, default=0.02, help='假服务器处理每个请求的时间（秒）')
+    parser.add_argument('--accounts', type=int, default=20)
+    parser.add_argument('--workers', type=int, default=8)
+    parser.add_argument('--repeat', type=int, default=10)
+    parser.add_argument('--json', action='store_true', help='每个场景输出一行JSON')
+    args = parser.parse_args()
+
+    results = run(args)
+    if args.json:
+        for result in results:
+            print(json.dumps(result, ensure_ascii=False))
+        return
+    print('{0:<36}{1:>6}{2:>12}{3:>12}{4:>12}{5:>10}{6:>10}{7:>10}'.format(
+        '场景', '次数', 'mean(ms)', 'p50(ms)', 'p95(ms)', 'ops/s', '请求数', '连接数'))
+    for result in results:
+        print('{0:<36}{1:>6}{2:>12.1f}{3:>12.1f}{4:>12.1f}{5:>10.1f}{6:>10}{7:>10}'.format(
+            result['scenario'], result['runs'], result['mean_ms'], result['p50_ms'], result['p95_ms'],
+            result['ops_per_s'], '{0:.1f}'.format(result['requests_per_run']) if 'requests_per_run' in result else '-',
+            '{0:.1f}'.format(result['connections_per_run']) if 'connections_per_run' in result else '-'))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,92 @@
+"""
+模拟大家都在订餐、服务器快撑不住的时候：FakeServer同时处理的请求超过--capacity个就变慢，超过两倍就返回503
+用很多线程拉取菜单，比较不限流、只按AIMD调整并发、再加上transport.RATES的令牌桶三种情况下
+服务器返回了多少个503、每个请求等了多久、吞吐量，以及结束时的并发上限
+python -m benchmarks.bench_governor [--menus 个数] [--threads 线程数] [--capacity 个数] [--latency 秒]
+"""
+import argparse
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import order
+import transport
+from benchmarks.bench_e2e import PASSWORD, TODAY
+from benchmarks.fake_server import FakeServer
+
+
+def run(server, replay_transport, dates, threads):
+    """
+    登录后用threads个线程拉取dates的菜单页面，返回(秒数, 每个请求的秒数, 503的个数)
+    :type server: FakeServer
+    :type replay_transport: transport.Transport
+    :type dates: list[str]
+    :type threads: int
+    :rtype: (float, list[float], int)
+    """
+    session = order.Session(replay_transport)
+    if order.login_cas('1000000', PASSWORD, session=session):
+        raise order.LoginFailed
+    order.login_card_system(session)
+
+    def fetch(date):
+        start = time.perf_counter()
+        order.get_menu(date, session)
+        return time.perf_counter() - start
+
+    rejected = server.rejected
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        timings = list(executor.map(fetch, dates))
+    return time.perf_counter() - start, timings, server.rejected - rejected
+
+
+def main():
+    parser = argparse.ArgumentParser(description='比较服务器过载时限流与不限流')
+    parser.add_argument('--menus', type=int, default=200)
+    parser.add_argument('--threads', type=int, default=16)
+    parser.add_argument('--capacity', type=int, default=4, help='假服务器同时处理多少个请求不变慢')
+    parser.add_argument('--latency', type=float, default=0.05, help='不过载时处理每个请求的时间（秒）')
+    parser.add_argument('--slow', type=float, default=0.2, help='比这慢（秒）算服务器吃不消了，同SLOW_LATENCY')
+    args = parser.parse_args()
+
+    server = FakeServer({'1000000': PASSWORD}, today=TODAY, latency=args.latency, capacity=args.capacity).start()
+    try:
+        dates = []
+        year, month = TODAY.year, TODAY.month
+        while len(dates) < args.menus:
+            dates.extend(server.orderable_dates(year, month))
+            year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+        dates = dates[:args.menus]
+
+        # (名称, Transport的参数)
+        cases = [
+            ('不限流', {'governed': False}),
+            ('AIMD', {'rates': {}}),
+            ('AIMD + RATES', {'rates': transport.RATES})
+        ]
+        print('{0} 个菜单，{1} 个线程，服务器同时处理{2}个以上变慢，{3}个以上返回503'.format(
+            len(dates), args.threads, args.capacity, 2 * args.capacity))
+        print('{0:<16}{1:>10}{2:>10}{3:>12}{4:>12}{5:>8}{6:>10}'.format(
+            '', '秒数', 'ops/s', 'mean(ms)', 'p95(ms)', '503', '并发上限'))
+        for name, kwargs in cases:
+            replay_transport = server.make_transport(**kwargs)
+            for adapter in replay_transport.adapters.values():
+                if adapter.governor is not None:
+                    adapter.governor.slow = args.slow
+            try:
+                elapsed, timings, rejected = run(server, replay_transport, dates, args.threads)
+                limits = replay_transport.limits().get('http://gzb.szsy.cn')
+            finally:
+                replay_transport.close()
+            timings.sort()
+            print('{0:<16}{1:>10.2f}{2:>10.1f}{3:>12.1f}{4:>12.1f}{5:>8}{6:>10}'.format(
+                name, elapsed, len(dates) / elapsed, statistics.mean(timings) * 1000,
+                timings[min(len(timings) - 1, int(len(timings) * 0.95))] * 1000, rejected,
+                '-' if limits is None else '{0:.1f}'.format(limits['limit'])))
+    finally:
+        server.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,103 @@
+"""
+比较一学期的菜单放在内存里要占多少：以前的Course/Meal/Menu，和现在带__slots__、intern过菜名的
+python -m benchmarks.bench_memory [--students 人数] [--days 天数]
+每种数据结构在单独的子进程里测，tracemalloc只算Python对象，RSS还包括lxml的树
+"""
+import argparse
+import gc
+import json
+import random
+import subprocess
+import sys
+import tracemalloc
+
+import order
+from benchmarks import legacy, samples
+
+
+def rss():
+    """
+    当前进程的RSS（字节），只支持Linux
+    :rtype: int
+    """
+    with open('/proc/self/statm') as f:
+        return int(f.read().split()[1]) * 4096
+
+
+def semester_pages(days):
+    """
+    生成days天的菜单页面，已订份数随机
+    :type days: int
+    :rtype: list[str]
+    """
+    rng = random.Random(days)
+    pages = []
+    for day in range(days):
+        mutable, cells = list(samples.reference_menus().values())[day % 2]
+        meals = samples.split_meals(cells)
+        meals = [([row[:7] + [str(rng.randint(0, int(row[6])))] + row[8:] for row in rows], total)
+                 for rows, total in meals]
+        pages.append(samples.menu_page(meals, mutable, viewstate=str(day), viewstate_size=200))
+    return pages
+
+
+def measure(variant, students, days):
+    """
+    :type variant: str
+    :type students: int
+    :type days: int
+    :rtype: dict
+    """
+    pages = semester_pages(days)
+    gc.collect()
+    tracemalloc.start()
+    rss_before = rss()
+
+    menus = []
+    for student in range(students):
+        for day, page in enumerate(pages):
+            if variant == 'legacy':
+                menu = legacy.Menu(page)
+            else:
+                menu = order.Menu('2015-09-{0:02}'.format(day % 28 + 1), page)
+            # 做报表用不到ViewState，两边都不留
+            menu.form_param = None
+            menus.append(menu)
+
+    gc.collect()
+    python_bytes = tracemalloc.get_traced_memory()[0]
+    rss_bytes = rss() - rss_before
+    tracemalloc.stop()
+    return {'menus': len(menus), 'python': python_bytes, 'rss': rss_bytes}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='比较菜单在内存中的大小')
+    parser.add_argument('--students', type=int, default=20)
+    parser.add_argument('--days', type=int, default=100, help='一学期大约100个上学日')
+    parser.add_argument('--variant', choices=['legacy', 'current'], help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.variant:
+        print(json.dumps(measure(args.variant, args.students, args.days)))
+        return
+
+    results = {}
+    for variant in ('legacy', 'current'):
+        output = subprocess.check_output([
+            sys.executable, '-m', 'benchmarks.bench_memory', '--variant', variant,
+            '--students', str(args.students), '--days', str(args.days)
+        ])
+        results[variant] = json.loads(output)
+
+    print('{0}个菜单'.format(results['current']['menus']))
+    print('{0:<10}{1:>16}{2:>16}'.format('', 'Python对象(MB)', 'RSS(MB)'))
+    for variant, result in results.items():
+        print('{0:<10}{1:>16.1f}{2:>16.1f}'.format(variant, result['python'] / 2 ** 20, result['rss'] / 2 ** 20))
+    print('{0:<10}{1:>15.2f}x{2:>15.2f}x'.format(
+        '节省', results['legacy']['python'] / results['current']['python'],
+        results['legacy']['rss'] / max(results['current']['rss'], 1)))
+
+
+if __name__ == '__main__':
+    main()
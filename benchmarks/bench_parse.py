@@ -0,0 +1,37 @@
+"""
+比较菜单页面的解析速度：以前的正则+逐餐XPath，和现在的parse_menu_page
+python -m benchmarks.bench_parse [-n 次数]
+"""
+import argparse
+import timeit
+
+import order
+from benchmarks import legacy, samples
+
+
+def check(pages):
+    """两种解析方法得到的菜要一样"""
+    for date, page in pages.items():
+        old = [[course.to_dict() for course in meal] for meal in legacy.Menu(page)]
+        current = [[course.to_dict() for course in meal] for meal in order.Menu(date, page)]
+        assert old == current, date
+
+
+def main():
+    parser = argparse.ArgumentParser(description='比较菜单页面的解析速度')
+    parser.add_argument('-n', '--number', type=int, default=200, help='每个页面解析的次数')
+    args = parser.parse_args()
+
+    pages = samples.sample_pages()
+    check(pages)
+
+    print('{0:<12}{1:>10}{2:>14}{3:>14}{4:>10}'.format('页面', '大小', '以前(ms)', '现在(ms)', '加速'))
+    for date, page in pages.items():
+        old = min(timeit.repeat(lambda: legacy.Menu(page), number=args.number, repeat=5)) / args.number
+        current = min(timeit.repeat(lambda: order.Menu(date, page), number=args.number, repeat=5)) / args.number
+        print('{0:<12}{1:>10}{2:>14.3f}{3:>14.3f}{4:>9.2f}x'.format(
+            date, len(page), old * 1000, current * 1000, old / current))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,71 @@
+"""
+比较拉取、解析大量菜单的两种做法：order.fetch_menus（解析在下载线程里，和下载抢GIL），
+和pipeline.iter_menus（线程下载、进程池解析，中间是有界的队列）
+python -m benchmarks.bench_pipeline [--months 月数] [--latency 秒] [--fetchers 线程数] [--processes 进程数]
+只有一个核时进程池帮不上忙，反而多了传页面、起进程的开销
+“共用进程池”是export -p拉取第二个及以后的账号时的情形：进程已经起好、模块已经导入
+"""
+import argparse
+import datetime
+import os
+import time
+
+import order
+import pipeline
+from benchmarks.bench_e2e import PASSWORD, login
+from benchmarks.fake_server import FakeServer
+
+TODAY = datetime.date(2015, 9, 1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='比较线程里解析和进程池解析')
+    parser.add_argument('--months', type=int, default=10, help='一个月大约22个工作日')
+    parser.add_argument('--latency', type=float, default=0.02, help='假服务器处理每个请求的时间（秒）')
+    parser.add_argument('--fetchers', type=int, default=8)
+    parser.add_argument('--processes', type=int, default=os.cpu_count())
+    args = parser.parse_args()
+
+    server = FakeServer({'1000000': PASSWORD}, today=TODAY, latency=args.latency).start()
+    try:
+        session = login(server, '1000000')
+        dates = []
+        for month in range(args.months):
+            dates.extend(server.orderable_dates(TODAY.year + (TODAY.month + month - 1) // 12,
+                                                (TODAY.month + month - 1) % 12 + 1))
+
+        start = time.perf_counter()
+        order.fetch_menus(dates, args.fetchers, session)
+        threads_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        count = sum(1 for _ in pipeline.iter_menus(dates, session, args.fetchers, args.processes))
+        pipeline_time = time.perf_counter() - start
+        assert count == len(dates)
+
+        executor = pipeline.make_executor(args.processes)
+        try:
+            # 第一遍让进程起来、导入order
+            for _ in pipeline.iter_menus(dates, session, args.fetchers, args.processes, executor=executor):
+                pass
+            start = time.perf_counter()
+            count = sum(1 for _ in pipeline.iter_menus(dates, session, args.fetchers, args.processes,
+                                                       executor=executor))
+            shared_time = time.perf_counter() - start
+            assert count == len(dates)
+        finally:
+            executor.shutdown(wait=True)
+    finally:
+        server.stop()
+
+    print('{0}个菜单，{1}个下载线程，{2}个解析进程（{3}核）'.format(
+        len(dates), args.fetchers, args.processes, os.cpu_count()))
+    print('{0:<28}{1:>10.1f} ms{2:>10.1f}个/秒'.format('fetch_menus', threads_time * 1000, len(dates) / threads_time))
+    print('{0:<28}{1:>10.1f} ms{2:>10.1f}个/秒'.format('pipeline.iter_menus', pipeline_time * 1000,
+                                                     len(dates) / pipeline_time))
+    print('{0:<28}{1:>10.1f} ms{2:>10.1f}个/秒'.format('pipeline（共用进程池）', shared_time * 1000,
+                                                     len(dates) / shared_time))
+
+
+if __name__ == '__main__':
+    main()
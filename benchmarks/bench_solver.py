@@ -0,0 +1,155 @@
+"""
+比较自动订餐的两种做法：逐个账号、逐餐、逐道菜地挑，和solver.solve的一次向量运算；两者的结果应完全相同
+python -m benchmarks.bench_solver [--accounts 账号数] [--months 月数] [--repeat 次数]
+建表（把菜单铺平成数组）和求解分开计时，orders()（转换成course_amount）也单独计时，合计要和逐个遍历比
+每项取repeat次中最快的一次
+"""
+import argparse
+import datetime
+import random
+import time
+
+import numpy as np
+
+from analytics import MenuTable
+from benchmarks.bench_analytics import synthetic_menus
+from meals import MEAL_NAME
+from plan import get_meal_id
+from solver import SET_MEAL, solve
+
+
+def synthetic_preferences(menus, rng):
+    """
+    每个账号随机的偏好和预算，约一半的账号会钱不够
+    :type menus: dict
+    :type rng: random.Random
+    :rtype: (dict, dict, dict)
+    :return: ({学号: auto}, {学号: 预算}, {学号: 余额})
+    """
+    courses = [course for meal in next(iter(menus.values()))[0]['meals'] for course in meal['courses']]
+    types = sorted({course['type'] for course in courses})
+    names = sorted({course['name'] for course in courses})
+    preferences, budgets, balances = {}, {}, {}
+    for username, account_menus in menus.items():
+        prefer = {course_type: rng.choice([-1, 0, 1, 2, 3]) for course_type in types}
+        prefer.update({name: rng.randint(-1, 5) for name in rng.sample(names, 4)})
+        preferences[username] = {
+            'meals': rng.sample(MEAL_NAME, rng.randint(1, len(MEAL_NAME))),
+            'prefer': prefer,
+            'pick': {course_type: rng.randint(0, 2) for course_type in rng.sample(types, 3)},
+            'servings': {name: rng.randint(0, 3) for name in rng.sample(names, 2)}
+        }
+        budgets[username] = rng.choice([np.inf, 12.0 * len(account_menus)])
+        balances[username] = rng.choice([np.nan, 20.0 * len(account_menus)])
+    return preferences, budgets, balances
+
+
+def loop_solve(menus, preferences, budgets, balances, today):
+    """
+    同solve，但逐个遍历，返回值同Solution.orders()
+    :type menus: dict
+    :type today: str
+    :rtype: dict
+    """
+    orders = {}
+    for username, account_menus in menus.items():
+        preference = preferences[username]
+        wanted = {get_meal_id(str(meal)) for meal in preference.get('meals', MEAL_NAME)}
+        prefer, amounts, pick = preference['prefer'], preference['servings'], dict(preference['pick'])
+        pick[SET_MEAL] = min(pick.get(SET_MEAL, 1), 1)
+
+        committed = 0
+        for menu in account_menus:
+            for meal in menu['meals']:
+                if menu['date'] >= today and not (menu['mutable'] and meal['id'] in wanted):
+                    committed += sum(course['price'] * course['current'] for course in meal['courses'])
+        limit = budgets[username]
+        if not np.isnan(balances[username]):
+            limit = min(limit, balances[username] - committed)
+
+        spent = 0
+        for menu in sorted(account_menus, key=lambda menu: menu['date']):
+            if not menu['mutable'] or not any(meal['id'] in wanted for meal in menu['meals']):
+                continue
+            course_amount = {(meal['id'], course['id']): course['current']
+                             for meal in menu['meals'] for course in meal['courses']}
+            do_not_order = {}
+            for meal in menu['meals']:
+                if meal['id'] not in wanted:
+                    continue
+                by_type = {}
+                for course in meal['courses']:
+                    weight = prefer.get(course['name'], prefer.get(course['type'], 0))
+                    course_amount[meal['id'], course['id']] = 0
+                    if course['id'] not in meal['required_course'] and weight > 0 and course['max'] > 0:
+                        by_type.setdefault(course['type'], []).append((-weight, course['id'], course))
+                set_meal_selected = False
+                cost = 0
+                for course_type, candidates in by_type.items():
+                    for _, _, course in sorted(candidates)[:pick.get(course_type, len(candidates))]:
+                        if course_type == SET_MEAL:
+                            amount = 1
+                            set_meal_selected = True
+                        else:
+                            amount = min(amounts.get(course['name'], amounts.get(course_type, 1)), course['max'])
+                        course_amount[meal['id'], course['id']] = amount
+                        cost += course['price'] * amount
+                for course_id in meal['required_course']:
+                    course_amount[meal['id'], course_id] = 0 if set_meal_selected else 1
+                    cost += 0 if set_meal_selected else meal['courses'][course_id]['price']
+
+                skipped = spent + cost > limit + 1e-6
+                if skipped:
+                    for course in meal['courses']:
+                        course_amount[meal['id'], course['id']] = 0
+                else:
+                    spent += cost
+                do_not_order[meal['id']] = skipped
+            orders.setdefault(username, {})[menu['date']] = course_amount, do_not_order
+    return orders
+
+
+def timed(repeat, func, *args):
+    best = np.inf
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func(*args)
+        best = min(best, time.perf_counter() - start)
+    return result, best
+
+
+def main():
+    parser = argparse.ArgumentParser(description='比较逐个遍历和向量运算的自动订餐速度')
+    parser.add_argument('--accounts', type=int, default=200)
+    parser.add_argument('--months', type=int, default=1)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    menus = synthetic_menus(args.accounts, args.months)
+    # 前几天的菜单已经不能改了，但余额里要扣掉它们
+    today = menus['1000000'][0]['date']
+    deadline = (datetime.date.fromisoformat(today) + datetime.timedelta(4)).isoformat()
+    for account_menus in menus.values():
+        for menu in account_menus:
+            menu['mutable'] = menu['date'] >= deadline
+    preferences, budgets, balances = synthetic_preferences(menus, random.Random(0))
+
+    expected, loop_time = timed(args.repeat, loop_solve, menus, preferences, budgets, balances, today)
+    table, build_time = timed(args.repeat, MenuTable.from_menus, menus)
+    solution, solve_time = timed(args.repeat, solve, table, preferences, np.array([budgets[u] for u in table.accounts]),
+                                 np.array([balances[u] for u in table.accounts]), datetime.date.fromisoformat(today))
+    orders, orders_time = timed(args.repeat, solution.orders)
+    assert orders == expected, '向量运算的结果和逐个遍历的不同'
+
+    days = sum(len(account_menus) for account_menus in menus.values())
+    print('{0}个账号×{1}个月，{2}个账号日，{3}行，{4}餐订不起'.format(
+        args.accounts, args.months, days, len(table), np.count_nonzero(solution.skipped)))
+    print('{0:<24}{1:>10.1f} ms'.format('逐个遍历', loop_time * 1000))
+    print('{0:<24}{1:>10.1f} ms'.format('建表', build_time * 1000))
+    print('{0:<24}{1:>10.1f} ms'.format('向量求解', solve_time * 1000))
+    print('{0:<24}{1:>10.1f} ms'.format('转换成course_amount', orders_time * 1000))
+    print('{0:<24}{1:>10.1f} ms'.format('向量运算合计', (build_time + solve_time + orders_time) * 1000))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,112 @@
+"""
+测各命令的冷启动时间：每次都起一个新的解释器，减去python -c pass的时间就是导入和参数解析的开销
+python -m benchmarks.bench_startup [--repeat 次数] [--json]
+不访问服务器的命令（--help、validate、cache）要在BUDGET_MS以内，且不能导入HEAVY_MODULES，否则退出码为1
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# 比空解释器多出来的时间（毫秒）
+BUDGET_MS = 40
+HEAVY_MODULES = ('requests', 'lxml', 'numpy', 'aiohttp')
+
+PLAN = {
+    'accounts': [{
+        'student_id': '1234567',
+        'password_env': 'CANTEEN_PW_1234567',
+        'dates': ['2015-10-08', '2015-10-09'],
+        'meals': {'早餐': {'do_not_order': True}, '午餐': {'courses': {'2': 1}}}
+    }]
+}
+
+
+def run(argv, env):
+    """
+    运行一次，返回(秒数, 导入了的HEAVY_MODULES)
+    :type argv: list[str]
+    :type env: dict
+    :rtype: (float, set)
+    """
+    start = time.perf_counter()
+    result = subprocess.run([sys.executable, '-X', 'importtime'] + argv, cwd=ROOT, env=env,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, universal_newlines=True)
+    elapsed = time.perf_counter() - start
+    # -X importtime的每一行最后是模块名，前面的空格表示层级
+    imported = {line.rsplit('|', 1)[-1].strip() for line in result.stderr.splitlines() if line.startswith('import time:')}
+    return elapsed, {module for module in HEAVY_MODULES if module in imported}
+
+
+def measure(argv, env, repeat):
+    """
+    :type argv: list[str]
+    :type env: dict
+    :type repeat: int
+    :rtype: (float, set)
+    :return: (中位数毫秒, 导入了的HEAVY_MODULES)
+    """
+    timings = []
+    heavy = set()
+    for _ in range(repeat):
+        elapsed, imported = run(argv, env)
+        timings.append(elapsed * 1000)
+        heavy |= imported
+    return statistics.median(timings), heavy
+
+
+def main():
+    parser = argparse.ArgumentParser(description='测各命令的冷启动时间')
+    parser.add_argument('--repeat', type=int, default=10)
+    parser.add_argument('--json', action='store_true', help='每个命令输出一行JSON')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as cache_dir:
+        plan_path = os.path.join(cache_dir, 'plan.json')
+        with open(plan_path, 'w', encoding='utf-8') as plan_file:
+            json.dump(PLAN, plan_file, ensure_ascii=False)
+        env = dict(os.environ, CANTEEN_CACHE_DIR=cache_dir)
+
+        # (名称, 参数, 是否要在预算内)
+        cases = [
+            ('canteen.py --help', ['canteen.py', '--help'], True),
+            ('canteen.py bulk --help', ['canteen.py', 'bulk', '--help'], True),
+            ('canteen.py validate', ['canteen.py', 'validate', plan_path], True),
+            ('canteen.py cache', ['canteen.py', 'cache'], True),
+            ('import order', ['-c', 'import order'], False),
+            ('import bulk', ['-c', 'import bulk'], False),
+        ]
+        baseline, _ = measure(['-c', 'pass'], env, args.repeat)
+        results = []
+        for name, argv, budgeted in cases:
+            median, heavy = measure(argv, env, args.repeat)
+            results.append({
+                'command': name,
+                'median_ms': median,
+                'overhead_ms': median - baseline,
+                'heavy_modules': sorted(heavy),
+                'within_budget': None if not budgeted else not heavy and median - baseline <= BUDGET_MS
+            })
+
+    if args.json:
+        for result in results:
+            print(json.dumps(result, ensure_ascii=False))
+    else:
+        print('空解释器 {0:.1f} ms，预算为多出{1} ms以内'.format(baseline, BUDGET_MS))
+        print('{0:<28}{1:>12}{2:>12}  {3:<24}{4}'.format('命令', 'median(ms)', '开销(ms)', '导入的重模块', ''))
+        for result in results:
+            status = {None: '', True: 'OK', False: '超出'}[result['within_budget']]
+            print('{0:<28}{1:>12.1f}{2:>12.1f}  {3:<24}{4}'.format(
+                result['command'], result['median_ms'], result['overhead_ms'],
+                ','.join(result['heavy_modules']) or '-', status))
+    if any(result['within_budget'] is False for result in results):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
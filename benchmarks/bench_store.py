@@ -0,0 +1,84 @@
+"""
+store.py的写入和查询速度：把很多账号、很多天的菜单批量写进SQLite，再测常用查询的延迟，
+并对照不用数据库时遍历所有菜单的时间。这里菜单已经全在内存里了，实际还要读缓存中的JSON，甚至重新拉取页面
+python -m benchmarks.bench_store [--accounts 账号数] [--months 月数]
+"""
+import argparse
+import os
+import statistics
+import tempfile
+import time
+
+from benchmarks.bench_analytics import synthetic_menus
+from meals import MEAL_NAME
+from store import Store
+
+
+def timed(func, repeat=20):
+    """
+    :rtype: float
+    :return: 中位数毫秒
+    """
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        timings.append((time.perf_counter() - start) * 1000)
+    return statistics.median(timings)
+
+
+def scan_missing(menus, date, meal):
+    """
+    不用数据库：遍历每个账号的菜单找那一天
+    :type menus: dict
+    :rtype: list[str]
+    """
+    missing = []
+    for username, account_menus in menus.items():
+        for menu in account_menus:
+            if menu['date'] == date:
+                courses = menu['meals'][meal]['courses']
+                if meal in menu['do_not_order'] or not any(course['current'] for course in courses):
+                    missing.append(username)
+    return missing
+
+
+def main():
+    parser = argparse.ArgumentParser(description='测数据库的写入和查询')
+    parser.add_argument('--accounts', type=int, default=300)
+    parser.add_argument('--months', type=int, default=5)
+    args = parser.parse_args()
+
+    menus = synthetic_menus(args.accounts, args.months)
+    count = sum(len(account_menus) for account_menus in menus.values())
+    date = menus['1000000'][len(menus['1000000']) // 2]['date']
+    lunch = MEAL_NAME.index('午餐')
+
+    with tempfile.TemporaryDirectory() as directory:
+        store = Store(os.path.join(directory, 'orders.sqlite3'))
+        start = time.perf_counter()
+        # 和bulk --store、export --store一样，一个账号一个事务
+        for username, account_menus in menus.items():
+            store.save_menus((username, menu) for menu in account_menus)
+        elapsed = time.perf_counter() - start
+        print('写入{0}个菜单（{1}个账号）：{2:.2f} s，{3:.0f}个/s，数据库{4:.1f} MB'.format(
+            count, len(menus), elapsed, count / elapsed,
+            os.path.getsize(os.path.join(directory, 'orders.sqlite3')) / 1024 / 1024))
+
+        assert sorted(store.missing(date, lunch)[0]) == sorted(scan_missing(menus, date, lunch))
+        cases = [
+            ('missing（{0} 午餐）'.format(date), lambda: store.missing(date, lunch)),
+            ('demand（一周）', lambda: store.demand(date, menus['1000000'][len(menus['1000000']) // 2 + 4]['date'])),
+            ('某道菜按天汇总', lambda: store.query(
+                'SELECT date, SUM(quantity) FROM courses WHERE name = ? GROUP BY date', ('土豆粉蒸肉',))),
+            ('一个账号的所有菜', lambda: store.query('SELECT * FROM courses WHERE student_id = ?', ('1000100',))),
+            ('不用数据库：遍历菜单找missing', lambda: scan_missing(menus, date, lunch)),
+        ]
+        print('{0:<32}{1:>12}'.format('查询', 'median(ms)'))
+        for name, func in cases:
+            print('{0:<32}{1:>12.2f}'.format(name, timed(func)))
+        store.close()
+
+
+if __name__ == '__main__':
+    main()
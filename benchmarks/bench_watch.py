@@ -0,0 +1,45 @@
+"""
+watch.py每轮询一次、页面没变时在本机花的时间：以前要构造Menu（解析整个页面）才知道变没变，
+现在只对菜单那一段算哈希再比较。拉取页面的时间两边一样，不算在内
+python -m benchmarks.bench_watch [-n 次数]
+"""
+import argparse
+import timeit
+
+import order
+import watch
+from benchmarks import samples
+
+
+def main():
+    parser = argparse.ArgumentParser(description='比较没变化时每次轮询的开销')
+    parser.add_argument('-n', '--number', type=int, default=200, help='每个页面重复的次数')
+    args = parser.parse_args()
+
+    pages = samples.sample_pages()
+    print('{0:<12}{1:>10}{2:>14}{3:>14}{4:>10}'.format('页面', '大小', '解析(ms)', '指纹(ms)', '加速'))
+    for date, page in pages.items():
+        known = order.Menu(date, page)
+        fingerprint = watch.menu_fingerprint(page)
+
+        def parse():
+            menu = order.Menu(date, page)
+            return watch.diff_menus(known, menu)
+
+        def compare():
+            return watch.menu_fingerprint(page) == fingerprint
+
+        assert parse() == [] and compare()
+        parsed = min(timeit.repeat(parse, number=args.number, repeat=5)) / args.number
+        hashed = min(timeit.repeat(compare, number=args.number, repeat=5)) / args.number
+        print('{0:<12}{1:>10}{2:>14.3f}{3:>14.4f}{4:>9.0f}x'.format(
+            date, len(page), parsed * 1000, hashed * 1000, parsed / hashed))
+
+    # 指纹要对会变的地方敏感，对__VIEWSTATE不敏感
+    page = pages['2015-10-08']
+    assert watch.menu_fingerprint(page.replace('/wEPDwUK', '/wEPDwUL', 1)) == watch.menu_fingerprint(page)
+    assert watch.menu_fingerprint(page.replace('return subs();', 'return msg();')) != watch.menu_fingerprint(page)
+
+
+if __name__ == '__main__':
+    main()
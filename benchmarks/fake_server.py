@@ -0,0 +1,499 @@
+"""
+在本机模拟学校的服务器：中央登录、“一卡通”欢迎页、选择日期页面的ViewState回发、菜单页、“不订餐”的回发和提交菜单的回调
+菜单用reference.md中2015-10-08的那份，其余页面按order.py解析时依赖的那些特征仿出来
+只用标准库。用法：
+    server = FakeServer(users={'1234567': 'password'})
+    server.start()
+    session = order.Session()
+    server.mount(session)  # 之后这个session对gzb.szsy.cn的请求都会发到本机
+    ...
+    server.stop()
+"""
+import base64
+import calendar
+import datetime
+import functools
+import gzip
+import hmac
+import json
+import os
+import socket
+import threading
+import time
+from hashlib import md5, sha1
+from http.cookies import SimpleCookie
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, quote, urlencode, urlsplit, urlunsplit
+
+import order
+import transport
+from benchmarks import samples
+
+CAS_PATH = '/cas/login'
+CARD_PATH = '/card/'
+WELCOME_PATH = '/card/Default.aspx'
+CALENDAR_PATH = urlsplit(order.CALENDAR_URL).path
+MENU_PATH = urlsplit(order.MENU_URL).path
+VIEWSTATE_PREFIX = '/wEPDwUK'
+
+
+class ReplayAdapter(transport.PooledAdapter):
+    """
+    把对gzb.szsy.cn（任意端口）的请求转发到本机的FakeServer
+    响应的url和request保持原样，这样SessionExpired的判断和Cookie的域名都和连真服务器时一样
+    """
+
+    def __init__(self, address, **kwargs):
+        """
+        :type address: str
+        :param address: FakeServer的host:port
+        """
+        super().__init__(**kwargs)
+        self.address = address
+
+    def send(self, request, **kwargs):
+        original_url = request.url
+        local_request = request.copy()
+        local_request.url = urlunsplit(urlsplit(original_url)._replace(scheme='http', netloc=self.address))
+        response = super().send(local_request, **kwargs)
+        response.url = original_url
+        response.request = request
+        return response
+
+
+class FakeServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, users, today=None, latency=0.0, viewstate_size=20000, port=0, capacity=None):
+        """
+        :type users: dict
+        :type today: datetime.date
+        :type latency: float
+        :type viewstate_size: int
+        :type capacity: int
+        :param users: {学号: 密码}
+        :param today: 服务器上的“今天”，用来判断菜单能否修改，默认为真正的今天
+        :param latency: 每个请求处理前先睡这么久（秒），模拟学校服务器的速度
+        :param viewstate_size: __VIEWSTATE的长度，真实的大约几十KB
+        :param capacity: 模拟会被压垮的服务器：同时处理的请求超过这么多，latency按比例变长，超过两倍就返回503
+        """
+        super().__init__(('127.0.0.1', port), FakeHandler)
+        self.users = users
+        self.today = today or datetime.date.today()
+        self.latency = latency
+        self.capacity = capacity
+        self.active = 0
+        # 返回了多少个503
+        self.rejected = 0
+        self.viewstate_size = viewstate_size
+        self.secret = os.urandom(16)
+        self.lock = threading.Lock()
+        self.thread = None
+        self.shared_transport = None
+
+        mutable, cells = samples.reference_menus()['2015-10-08']
+        self.template = samples.split_meals(cells)
+        # 各种会话：{jsessionid: lt}, {CASTGC: 学号}, {ST: 学号}, {ASP.NET_SessionId: 学号}
+        self.cas_sessions = {}
+        self.tickets_granting = {}
+        self.service_tickets = {}
+        self.card_sessions = {}
+        # {(学号, 日期): {'amount': {(餐次, 编号): 数量}, 'do_not_order': set}}
+        self.orders = {}
+        # [(方法, 路径, 请求体的字节数, 响应体的字节数)]
+        self.log = []
+
+    @property
+    def address(self):
+        return '{0}:{1}'.format(*self.server_address)
+
+    def start(self):
+        self.thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+        if self.shared_transport is not None:
+            self.shared_transport.close()
+
+    def make_transport(self, **kwargs):
+        """
+        和transport.Transport一样，只是请求都转发到这里，参数也相同
+        本机的服务器不按transport.RATES限速，否则测的就是限速了；并发上限照样按AIMD调整
+        :rtype: transport.Transport
+        """
+        kwargs.setdefault('rates', {})
+        return transport.Transport(adapter_class=functools.partial(ReplayAdapter, self.address), **kwargs)
+
+    def mount(self, session, replay_transport=None):
+        """
+        :type session: order.Session
+        :type replay_transport: transport.Transport
+        :param replay_transport: 默认所有session共用一个，就像连真服务器时共用transport.shared()
+        """
+        if replay_transport is None:
+            with self.lock:
+                if self.shared_transport is None:
+                    self.shared_transport = self.make_transport()
+            replay_transport = self.shared_transport
+        replay_transport.mount(session)
+        return replay_transport
+
+    def make_connector(self, **kwargs):
+        """
+        给async_order.AsyncSession用的aiohttp连接器：连gzb.szsy.cn（任意端口）时都连到这里，URL保持原样，同ReplayAdapter
+        只在用到时才导入aiohttp。参数同aiohttp.TCPConnector
+        :rtype: aiohttp.TCPConnector
+        """
+        import aiohttp
+        from aiohttp.abc import AbstractResolver
+
+        address, port = self.server_address
+
+        class ReplayResolver(AbstractResolver):
+            async def resolve(self, host, _port=0, family=socket.AF_INET):
+                return [{'hostname': host, 'host': address, 'port': port, 'family': socket.AF_INET, 'proto': 0,
+                         'flags': socket.AI_NUMERICHOST | socket.AI_NUMERICSERV}]
+
+            async def close(self):
+                pass
+
+        return aiohttp.TCPConnector(resolver=ReplayResolver(), **kwargs)
+
+    def expire(self, tgt=False):
+        """
+        让所有“一卡通”系统的会话过期；tgt为True时连中央登录也一起过期
+        :type tgt: bool
+        """
+        with self.lock:
+            self.card_sessions.clear()
+            if tgt:
+                self.tickets_granting.clear()
+
+    def count(self, method=None, path=None):
+        """
+        :type method: str
+        :type path: str
+        :rtype: int
+        """
+        return sum(1 for m, p, _, _ in self.log if (method is None or m == method) and (path is None or p == path))
+
+    def new_token(self):
+        return base64.b32encode(os.urandom(10)).decode('ascii')
+
+    def make_viewstate(self, state):
+        """
+        把页面的状态编进__VIEWSTATE，带MAC，和ASP.NET一样不依赖服务器端的存储
+        :type state: dict
+        :rtype: str
+        """
+        payload = base64.urlsafe_b64encode(json.dumps(state).encode('utf-8')).decode('ascii')
+        mac = hmac.new(self.secret, payload.encode('ascii'), sha1).hexdigest()
+        return (VIEWSTATE_PREFIX + payload + '.' + mac).ljust(self.viewstate_size, 'A')
+
+    def read_viewstate(self, viewstate):
+        """
+        MAC不对时返回None
+        :type viewstate: str
+        :rtype: dict
+        """
+        if not viewstate.startswith(VIEWSTATE_PREFIX) or '.' not in viewstate:
+            return None
+        payload, mac = viewstate[len(VIEWSTATE_PREFIX):].rsplit('.', 1)
+        mac = mac.rstrip('A')
+        if not hmac.compare_digest(mac, hmac.new(self.secret, payload.encode('ascii'), sha1).hexdigest()):
+            return None
+        return json.loads(base64.urlsafe_b64decode(payload.encode('ascii')))
+
+    def is_mutable(self, date):
+        """
+        说的是“72小时”，实际上是把那一整天排除了
+        :type date: str
+        :rtype: bool
+        """
+        return datetime.datetime.strptime(date, '%Y-%m-%d').date() >= self.today + datetime.timedelta(3 + 1)
+
+    def orderable_dates(self, year, month):
+        """
+        每个月的工作日都有菜单
+        :type year: int
+        :type month: int
+        :rtype: list[str]
+        """
+        return ['{0}-{1:02}-{2:02}'.format(year, month, day)
+                for day in range(1, calendar.monthrange(year, month)[1] + 1)
+                if datetime.date(year, month, day).weekday() < 5]
+
+    def get_order(self, username, date):
+        """
+        调用时要持有self.lock
+        :type username: str
+        :type date: str
+        :rtype: dict
+        """
+        key = (username, date)
+        if key not in self.orders:
+            amount = {}
+            for meal_seq, (rows, total) in enumerate(self.template):
+                for course_seq, row in enumerate(rows):
+                    amount[meal_seq, course_seq] = int(row[7])
+            self.orders[key] = {'amount': amount, 'do_not_order': set()}
+        return self.orders[key]
+
+    def calendar_page(self, year, month, dates):
+        """
+        :type year: int
+        :type month: int
+        :type dates: list[str]
+        :rtype: str
+        """
+        selectable_year = (self.today.year - 1, self.today.year, self.today.year + 1)
+        years = ''.join('<option{0} value="{1}">{1}</option>'.format(
+            ' selected="selected"' if y == year else '', y) for y in selectable_year)
+        months = ''.join('<option{0} value="{1}">{1}月</option>'.format(
+            ' selected="selected"' if m == month else '', m) for m in range(1, 13))
+        links = ''.join('<a href="RestaurantUserMenu.aspx?Date={0}">{0}</a>'.format(date) for date in dates)
+        viewstate = self.make_viewstate({'page': 'calendar', 'year': year, 'month': month})
+        return '\r\n'.join([
+            '<html><body><form name="form1" method="post" action="RestaurantUserSelect.aspx" id="form1">',
+            '<input type="hidden" name="__VIEWSTATE" id="__VIEWSTATE" value="{0}" />'.format(viewstate),
+            '<input type="hidden" name="__VIEWSTATEGENERATOR" id="__VIEWSTATEGENERATOR" value="C2EE9ABB" />',
+            '<input type="hidden" name="__EVENTVALIDATION" id="__EVENTVALIDATION" value="/wEWDgK{0}" />'.format(
+                'C' * 300),
+            '<select name="DrplstYear1$DrplstControl">{0}</select>'.format(years),
+            '<select name="DrplstMonth1$DrplstControl">{0}</select>'.format(months),
+            '<div id="dates">{0}</div>'.format(links),
+            '</form></body></html>'
+        ])
+
+    def menu_page(self, username, date):
+        """
+        调用时要持有self.lock
+        :type username: str
+        :type date: str
+        :rtype: str
+        """
+        state = self.get_order(username, date)
+        meals = []
+        for meal_seq, (rows, total) in enumerate(self.template):
+            meals.append(([row[:7] + [str(state['amount'][meal_seq, course_seq])] +
+                           ['已定' if state['amount'][meal_seq, course_seq] else ' ']
+                           for course_seq, row in enumerate(rows)], total))
+        viewstate = self.make_viewstate({'page': 'menu', 'date': date})
+        return samples.menu_page(meals, self.is_mutable(date), sorted(state['do_not_order']),
+                                 viewstate=viewstate[len(VIEWSTATE_PREFIX):], viewstate_size=self.viewstate_size)
+
+
+class FakeHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # 响应头和响应体是分两次写的，不关掉Nagle算法的话每个请求都要多等一个delayed ACK
+    disable_nagle_algorithm = True
+    server_version = 'Microsoft-IIS/6.0'
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        self.handle_request('GET', {})
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length).decode('utf-8')
+        self.handle_request('POST', {k: v[0] for k, v in parse_qs(body, keep_blank_values=True).items()}, length)
+
+    def handle_request(self, method, form, length=0):
+        server = self.server
+        with server.lock:
+            server.active += 1
+            active = server.active
+        try:
+            if server.capacity is not None and active > 2 * server.capacity:
+                with server.lock:
+                    server.rejected += 1
+                self.set_cookies = []
+                self.respond(503, 'Server Too Busy')
+                return
+            latency = server.latency
+            if server.capacity is not None:
+                latency *= max(1, active / server.capacity)
+            if latency:
+                time.sleep(latency)
+            self.handle_page(method, form, length)
+        finally:
+            with server.lock:
+                server.active -= 1
+
+    def handle_page(self, method, form, length):
+        server = self.server
+        url = urlsplit(self.path)
+        # /cas/login;jsessionid=xxx
+        path = url.path.split(';')[0]
+        self.query = {k: v[0] for k, v in parse_qs(url.query).items()}
+        cookie = SimpleCookie(self.headers.get('Cookie', ''))
+        self.cookies = {k: v.value for k, v in cookie.items()}
+        self.set_cookies = []
+
+        with server.lock:
+            if path == CAS_PATH:
+                status, body = self.cas(method, form)
+            elif path.startswith(CARD_PATH):
+                status, body = self.card(method, path, form)
+            else:
+                status, body = 404, 'Not Found'
+        server.log.append((method, path, length, len(body)))
+        self.respond(status, body)
+
+    def respond(self, status, body):
+        """
+        :type status: int
+        :param body: 状态码为302时是跳转的地址
+        """
+        if status == 302:
+            location, body = body, ''
+        data = body.encode('utf-8')
+        gzipped = 'gzip' in self.headers.get('Accept-Encoding', '') and len(data) > 0
+        if gzipped:
+            data = gzip.compress(data, 1)
+        self.send_response(status)
+        if status == 302:
+            self.send_header('Location', location)
+        for cookie in self.set_cookies:
+            self.send_header('Set-Cookie', cookie)
+        self.send_header('Content-Type', 'text/html; charset=utf-8')
+        if gzipped:
+            self.send_header('Content-Encoding', 'gzip')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def cas(self, method, form):
+        server = self.server
+        tgt_user = server.tickets_granting.get(self.cookies.get('CASTGC'))
+        service = self.query.get('service')
+
+        if method == 'GET':
+            if tgt_user is not None and service:
+                ticket = 'ST-' + server.new_token()
+                server.service_tickets[ticket] = tgt_user
+                return 302, '{0}{1}ticket={2}'.format(service, '&' if '?' in service else '?', ticket)
+            jsessionid = self.cookies.get('JSESSIONID')
+            if jsessionid not in server.cas_sessions:
+                jsessionid = server.new_token()
+                self.set_cookies.append('JSESSIONID={0}; Path=/cas'.format(jsessionid))
+            lt = 'LT-' + server.new_token()
+            server.cas_sessions[jsessionid] = lt
+            return 200, self.login_page(jsessionid, lt, '')
+
+        jsessionid = self.cookies.get('JSESSIONID')
+        expected_lt = server.cas_sessions.get(jsessionid)
+        username = form.get('username', '')
+        password = server.users.get(username)
+        if (expected_lt is not None and form.get('lt') == expected_lt and password is not None and
+                form.get('password') == md5(password.encode('utf-8')).hexdigest()):
+            del server.cas_sessions[jsessionid]
+            tgt = 'TGT-' + server.new_token()
+            server.tickets_granting[tgt] = username
+            self.set_cookies.append('CASTGC={0}; Path=/cas'.format(tgt))
+            return 200, ('<SCRIPT LANGUAGE="JavaScript">\r\n<!--\r\n\twindow.location.href='
+                         '"http://gzb.szsy.cn:4000/lcconsole/";\r\n//-->\r\n</SCRIPT>\r\n'
+                         '<div id="msg" class="success"><h2>登录成功</h2></div>')
+        lt = 'LT-' + server.new_token()
+        if jsessionid is not None:
+            server.cas_sessions[jsessionid] = lt
+        if expected_lt is None or form.get('lt') != expected_lt:
+            # lt过期了：重新给一个登录表单，不说密码错
+            return 200, self.login_page(jsessionid, lt, '')
+        return 200, self.login_page(jsessionid, lt, '您输入的用户名或密码错，请重试。')
+
+    @staticmethod
+    def login_page(jsessionid, lt, status):
+        return '\r\n'.join([
+            '<html><body>',
+            '<div id="status">{0}</div>'.format(status),
+            '<form id="fm1" name="fm1" action="/cas/login;jsessionid={0}" method="post">'.format(jsessionid),
+            '<input id="username" name="username" type="text" value="" />',
+            '<input id="password" name="password" type="password" value="" />',
+            '<input type="hidden" name="lt" value="{0}" />'.format(lt),
+            '<input type="hidden" name="_eventId" value="submit" />',
+            '</form></body></html>'
+        ])
+
+    def card(self, method, path, form):
+        server = self.server
+        ticket = self.query.pop('ticket', None)
+        if ticket is not None and ticket in server.service_tickets:
+            session_id = server.new_token()
+            server.card_sessions[session_id] = server.service_tickets.pop(ticket)
+            self.set_cookies.append('ASP.NET_SessionId={0}; path=/; HttpOnly'.format(session_id))
+            if path == CARD_PATH:
+                return 302, 'http://gzb.szsy.cn' + WELCOME_PATH
+            return 302, 'http://gzb.szsy.cn{0}?{1}'.format(path, urlencode(self.query))
+
+        username = server.card_sessions.get(self.cookies.get('ASP.NET_SessionId'))
+        if username is None:
+            # 没登录或会话过期，交给中央登录
+            service = 'http://gzb.szsy.cn' + (CARD_PATH if path == CARD_PATH else self.path)
+            return 302, 'http://gzb.szsy.cn:3000/cas/login?service=' + quote(service, safe='')
+
+        if path in (CARD_PATH, WELCOME_PATH):
+            if path == CARD_PATH:
+                return 302, 'http://gzb.szsy.cn' + WELCOME_PATH
+            return 200, ('<html><body><span id="LblUserName">当前用户：学生{0}</span>'
+                         '<span id="LblBalance">帐户余额：{1}元</span></body></html>').format(username, '123.45')
+        if path == CALENDAR_PATH:
+            return self.calendar(method, form)
+        if path == MENU_PATH:
+            return self.menu(method, username, form)
+        return 404, 'Not Found'
+
+    def calendar(self, method, form):
+        server = self.server
+        if method == 'GET':
+            year, month = server.today.year, server.today.month
+            return 200, server.calendar_page(year, month, server.orderable_dates(year, month))
+
+        state = server.read_viewstate(form.get('__VIEWSTATE', ''))
+        if state is None or state.get('page') != 'calendar':
+            return 500, 'Validation of viewstate MAC failed.'
+        year = int(form['DrplstYear1$DrplstControl'])
+        month = int(form['DrplstMonth1$DrplstControl'])
+        if year != state['year']:
+            # 切换年份的那次回发只改年份，日期要再回发一次才有
+            return 200, server.calendar_page(year, month, [])
+        return 200, server.calendar_page(year, month, server.orderable_dates(year, month))
+
+    def menu(self, method, username, form):
+        server = self.server
+        date = self.query.get('Date')
+        if method == 'GET':
+            return 200, server.menu_page(username, date)
+
+        state = server.read_viewstate(form.get('__VIEWSTATE', ''))
+        if state is None or state.get('page') != 'menu' or state.get('date') != date:
+            return 500, 'Validation of viewstate MAC failed.'
+        if not server.is_mutable(date):
+            return 200, '0|已过订餐时间'
+        order_state = server.get_order(username, date)
+
+        if form.get('__CALLBACKID') == '__Page':
+            amount = {}
+            for item in form.get('__CALLBACKPARAM', '').split('|'):
+                if not item:
+                    continue
+                # Repeater1_GvReport_0_TxtNum_3@1
+                name, value = item.split('@')
+                meal_seq, course_seq = name[len('Repeater1_GvReport_'):].split('_TxtNum_')
+                meal_seq, course_seq = int(meal_seq), int(course_seq)
+                rows = server.template[meal_seq][0]
+                if not 0 <= int(value) <= int(rows[course_seq][6]):
+                    return 200, '0|订餐数量有误'
+                amount[meal_seq, course_seq] = int(value)
+            order_state['amount'].update(amount)
+            return 200, '0|订餐成功！'
+
+        # “不订餐”的回发：勾选状态以表单为准
+        order_state['do_not_order'] = {meal_seq for meal_seq in range(len(server.template))
+                                       if 'Repeater1$ctl0{0}$CbkMealtimes'.format(meal_seq) in form}
+        return 200, server.menu_page(username, date)
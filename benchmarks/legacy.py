@@ -0,0 +1,75 @@
+"""
+以前的菜单解析方法和数据结构，原样照搬，只用来和现在的做比较
+"""
+import re
+
+from lxml import html
+
+
+def get_web_forms_field(page):
+    vs = re.search(r'id="__VIEWSTATE" value="(.*?)"', page).group(1)
+    vsg = re.search(r'id="__VIEWSTATEGENERATOR" value="(.*?)"', page).group(1)
+    ev = re.search(r'id="__EVENTVALIDATION" value="(.*?)"', page).group(1)
+    return [vs, vsg, ev]
+
+
+def get_course_count(page, menu_sequence):
+    return len(re.findall(r'Repeater1_GvReport_{0}_LblMaxno_\d'.format(menu_sequence), page))
+
+
+class Course(object):
+    def __init__(self, seq, course):
+        self.id = seq
+        self.num = int(course[0])
+        self.type = course[1]
+        self.name = course[2]
+        self.price = float(course[5])
+        self.max = int(course[6])
+        self.current = int(course[7])
+
+    def to_dict(self):
+        return dict(vars(self))
+
+
+class Meal(list):
+    def __init__(self, seq, menu_list, course_count):
+        super().__init__()
+        self.required_course = []
+        self.id = seq
+
+        for course_seq in range(course_count):
+            start = 9 * course_seq
+            end = 9 * (course_seq + 1)
+            l = menu_list[start:end]
+            if l[4] == '必选':
+                self.required_course.append(course_seq)
+            self.append(Course(course_seq, l))
+
+
+class Menu(list):
+    def __init__(self, page):
+        """
+        :param page: 没有清理过的菜单页面，清理也算在里面
+        """
+        super().__init__()
+        page = re.sub(r'\r\n {24}(?: {4})?', '', page)
+        page = page.replace('&nbsp;', ' ')
+
+        self.form_param = get_web_forms_field(page)
+        meal_count = len(re.findall(r'id="Repeater1_GvReport_(\d)"', page))
+        self.do_not_order = [int(x) for x in
+                             re.findall(r'name="Repeater1\$ctl0(\d)\$CbkMealtimes" checked="checked"', page)]
+
+        if '<a onclick="return subs();"' in page:
+            self.mutable = True
+        elif '<a onclick="return msg();"' in page:
+            self.mutable = False
+
+        tree = html.fromstring(page)
+        for meal_seq in range(meal_count):
+            course_count = get_course_count(page, meal_seq)
+            if not self.mutable:
+                course_count -= 1
+            xpath = '//table[@id="Repeater1_GvReport_{0}"]/tr/td//text()'.format(meal_seq)
+            menu_item = tree.xpath(xpath)
+            self.append(Meal(meal_seq, menu_item, course_count))
@@ -0,0 +1,126 @@
+"""
+根据reference.md中记录的菜单，生成和学校服务器差不多的菜单页面，供benchmark使用
+页面的结构是按order.py解析时依赖的那些特征仿出来的，不是真的抓下来的
+"""
+import ast
+import os
+import re
+
+REFERENCE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'reference.md')
+
+# 服务器返回的页面里，单元格之间就是这串东西
+CELL_SEPARATOR = '\r\n' + ' ' * 24
+
+
+def reference_menus():
+    """
+    reference.md中的菜单，{日期: (能否修改, 单元格的列表)}
+    :rtype: dict
+    """
+    with open(REFERENCE, encoding='utf-8') as f:
+        text = f.read()
+    menus = {}
+    for match in re.finditer(r'Menu on (\d{4}-\d{2}-\d{2}) \((\w+)\):\n```\n(.*?)```', text, re.S):
+        menus[match.group(1)] = (match.group(2) == 'Mutable', ast.literal_eval(match.group(3)))
+    return menus
+
+
+def split_meals(cells):
+    """
+    把平铺的单元格分成[(菜的行, 合计那一行), ...]
+    合计那一行在可修改的菜单中只有6个单元格，不可修改时有9个
+    :type cells: list[str]
+    :rtype: list
+    """
+    meals = []
+    rows = []
+    i = 0
+    while i < len(cells):
+        if cells[i] == ' ':
+            # 合计那一行以空白开头
+            width = 6 if cells.index('合计:', i) - i == 3 else 9
+            meals.append((rows, cells[i:i + width]))
+            rows = []
+            i += width
+        else:
+            rows.append(cells[i:i + 9])
+            i += 9
+    return meals
+
+
+def render_cell(text, cell_id=None):
+    """
+    :type text: str
+    :type cell_id: str
+    :rtype: str
+    """
+    if text == ' ':
+        text = '&nbsp;'
+    if cell_id is not None:
+        text = '<span id="{0}">{1}</span>'.format(cell_id, text)
+    return '{0}<td>{1}</td>'.format(CELL_SEPARATOR, text)
+
+
+def menu_page(meals, mutable=True, do_not_order=(), viewstate='', viewstate_size=20000):
+    """
+    生成菜单页面
+    :type meals: list
+    :type mutable: bool
+    :type do_not_order: list
+    :type viewstate: str
+    :type viewstate_size: int
+    :param meals: split_meals的返回值
+    :param viewstate: 会拼在__VIEWSTATE的最前面，用来区分不同的状态
+    :param viewstate_size: 真实的__VIEWSTATE很长，填充到这个长度
+    :rtype: str
+    """
+    viewstate = ('/wEPDwUK' + viewstate).ljust(viewstate_size, 'A')
+    parts = [
+        '<html xmlns="http://www.w3.org/1999/xhtml">',
+        '<head><title>订餐</title></head>',
+        '<body>',
+        '<form name="form1" method="post" action="RestaurantUserMenu.aspx" id="form1">',
+        '<input type="hidden" name="__EVENTTARGET" id="__EVENTTARGET" value="" />',
+        '<input type="hidden" name="__VIEWSTATE" id="__VIEWSTATE" value="{0}" />'.format(viewstate),
+        '<input type="hidden" name="__VIEWSTATEGENERATOR" id="__VIEWSTATEGENERATOR" value="8E5A3A2B" />',
+        '<input type="hidden" name="__EVENTVALIDATION" id="__EVENTVALIDATION" value="/wEWBQL{0}" />'.format(
+            'B' * 400),
+    ]
+    for meal_seq, (rows, total) in enumerate(meals):
+        checked = ' checked="checked"' if meal_seq in do_not_order else ''
+        parts.append('<input id="Repeater1_ctl0{0}_CbkMealtimes" type="checkbox" '
+                     'name="Repeater1$ctl0{0}$CbkMealtimes"{1} onclick="__doPostBack()" />'.format(meal_seq, checked))
+        parts.append('<table cellspacing="0" rules="all" border="1" id="Repeater1_GvReport_{0}">'.format(meal_seq))
+        parts.append('<tr><th>编号</th><th>类别</th><th>菜名</th><th>套餐</th><th>必选</th>'
+                     '<th>单价</th><th>最大份数</th><th>订购份数</th><th>订餐状态</th></tr>')
+        for course_seq, row in enumerate(rows):
+            cells = []
+            for column, text in enumerate(row):
+                if column == 6:
+                    cells.append(render_cell(text, 'Repeater1_GvReport_{0}_LblMaxno_{1}'.format(meal_seq, course_seq)))
+                elif column == 7:
+                    cells.append(render_cell(text, 'Repeater1_GvReport_{0}_TxtNum_{1}'.format(meal_seq, course_seq)))
+                else:
+                    cells.append(render_cell(text))
+            parts.append('<tr>' + ''.join(cells) + '</tr>')
+        # 不可修改时，合计那一行也有LblMaxno
+        cells = []
+        for column, text in enumerate(total):
+            if column == 6 and len(total) == 9:
+                cells.append(render_cell(text, 'Repeater1_GvReport_{0}_LblMaxno_{1}'.format(meal_seq, len(rows))))
+            else:
+                cells.append(render_cell(text))
+        parts.append('<tr>' + ''.join(cells) + '</tr>')
+        parts.append('</table>')
+    parts.append('<a onclick="return {0};" href="#">提交</a>'.format('subs()' if mutable else 'msg()'))
+    parts.extend(['</form>', '</body>', '</html>'])
+    return '\r\n'.join(parts)
+
+
+def sample_pages():
+    """
+    reference.md中每个菜单对应的页面，{日期: 页面}
+    :rtype: dict
+    """
+    return {date: menu_page(split_meals(cells), mutable)
+            for date, (mutable, cells) in reference_menus().items()}
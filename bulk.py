@@ -0,0 +1,247 @@
+#!/usr/bin/env python
+"""
+按计划文件给多个账号批量订餐，不需要交互
+计划文件的格式见plan.py
+python bulk.py plan.json [-j 并发数] [--report 文件] [--dry-run] [--batch-toggles]
+"""
+import datetime
+import json
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+import cache
+import canteen
+import instrument
+import order
+from meals import MEAL_NAME
+from plan import PlanError, load_plan, get_account_orders
+
+
+def make_order(menu, meal_plans):
+    """
+    按计划生成submit_menu需要的course_amount和“不订餐”的变化，规则同main()
+    :type menu: order.Menu
+    :type meal_plans: dict
+    :param meal_plans: {餐次序号: {"do_not_order": bool, "courses": {编号: 份数}}}
+    :rtype: (dict, list, list)
+    """
+    course_amount = menu.get_course_amount()
+    to_select = []
+    to_deselect = []
+
+    for meal in menu:
+        if meal.id not in meal_plans:
+            continue
+        meal_plan = meal_plans[meal.id]
+
+        if meal_plan.get('do_not_order'):
+            if meal.id not in menu.do_not_order:
+                to_select.append(meal.id)
+            # 用来占位，不然服务器不认
+            for course in meal:
+                course_amount[meal.id, course.id] = 0
+            continue
+
+        if meal.id in menu.do_not_order:
+            to_deselect.append(meal.id)
+
+        courses = {int(k): v for k, v in meal_plan.get('courses', {}).items()}
+        set_meal_selected = False
+        for course in meal:
+            if course.type == '必订菜' or course.num not in courses:
+                continue
+            course_num = courses[course.num]
+            if not 0 <= course_num <= course.max:
+                raise PlanError('{0} {1} {2}的份数应在0到{3}之间'.format(
+                    menu.date, MEAL_NAME[meal.id], course.name, course.max))
+            course_amount[meal.id, course.id] = course_num
+            # 订了套餐就不用特意去订必选菜了
+            if course_num == 1 and course.type == '套餐':
+                set_meal_selected = True
+
+        for course in meal.required_course:
+            course_amount[meal.id, course] = 0 if set_meal_selected else 1
+
+    return course_amount, to_select, to_deselect
+
+
+def order_date(session, username, calendar, date, meal_plans, dry_run=False, batch=False):
+    """
+    给一个账号订一天的餐，返回结果的描述
+    :type session: order.Session
+    :type username: str
+    :type calendar: order.Calendar
+    :type date: str
+    :type meal_plans: dict
+    :type dry_run: bool
+    :type batch: bool
+    :param dry_run: 只列出要发的请求，不提交
+    :param batch: 见order.plan_submit
+    :rtype: str
+    """
+    date_object = datetime.datetime.strptime(date, '%Y-%m-%d').date()
+    date = date_object.strftime('%Y-%m-%d')
+    if not calendar.test(date_object):
+        return '不可订餐的日期'
+    try:
+        return order_menu(session, username, date, meal_plans, dry_run, batch)
+    except order.StaleForm:
+        # 提交到一半会话过期，已经重新登录了。重新拉取菜单（新的ViewState、已生效的部分），
+        # 再和计划比一遍，已经改好的不会再提交
+        return order_menu(session, username, date, meal_plans, dry_run, batch)
+
+
+def order_menu(session, username, date, meal_plans, dry_run=False, batch=False):
+    """
+    order_date中拉取菜单、比较、提交的部分，参数同order_date。怎么重来都只会把菜单改成计划的样子
+    :rtype: str
+    """
+    menu = cache.get_menu(username, date, session)
+    if not menu.mutable:
+        return '菜单无法更改'
+
+    course_amount, to_select, to_deselect = make_order(menu, meal_plans)
+    return submit_order(session, username, menu, course_amount, [menu.do_not_order, to_select, to_deselect],
+                        dry_run, batch)
+
+
+def submit_order(session, username, menu, course_amount, do_not_order_list, dry_run=False, batch=False):
+    """
+    和菜单上已有的比较，有变化才提交，返回结果的描述。bulk和solver共用
+    :type session: order.Session
+    :type username: str
+    :type menu: order.Menu
+    :type course_amount: dict
+    :type do_not_order_list: list
+    :param do_not_order_list: 同order.submit_menu的do_not_order
+    :rtype: str
+    """
+    date = menu.date
+    # 大多数日子计划和已订的一样，一个请求都不用发
+    changed, toggles = order.diff_order(menu, course_amount, do_not_order_list)
+    if not changed and not toggles:
+        return '无需更改'
+    if dry_run:
+        steps = order.plan_submit(course_amount, do_not_order_list, menu.form_param, batch)
+        return '演习，未提交（{0}道菜、{1}个“不订餐”有变化）\n'.format(len(changed), len(toggles)) + \
+            '\n'.join('\t\t' + line for line in order.describe_submit(date, steps))
+    if cache.submit_menu(username, date, course_amount, do_not_order_list, menu.form_param, session, batch):
+        return '订餐成功'
+    else:
+        return '订餐失败'
+
+
+def login_account(account, session):
+    """
+    用环境变量中的密码登录，见cache.login。没设置密码时抛出PlanError，登录失败时抛出LoginFailed
+    :type account: dict
+    :type session: order.Session
+    :rtype: (str, str)
+    """
+    password = os.environ.get(account['password_env'])
+    if password is None:
+        raise PlanError('环境变量{0}未设置'.format(account['password_env']))
+    return cache.login(account['student_id'], password, session)
+
+
+def run_account(account, dry_run=False, batch=False, menus=None):
+    """
+    用独立的Session给一个账号订餐，返回{日期: 结果}；登录失败时返回{None: 原因}
+    登录时会优先使用缓存的Cookie，见cache.login
+    :type account: dict
+    :type menus: list
+    :param menus: 不为None时，把订完之后各个日期的菜单以(学号, Menu.to_dict())放进去。
+                  没改的日期用缓存，提交过的要重新拉取一次
+    :rtype: dict
+    """
+    session = order.Session()
+    try:
+        login_account(account, session)
+    except PlanError as e:
+        return {None: str(e)}
+    except order.LoginFailed:
+        return {None: '登录失败'}
+    calendar = cache.get_calendar(account['student_id'], session)
+    orders = get_account_orders(account)
+    if orders:
+        # 一次把计划涉及的月份都查了，切换年份的次数最少
+        date_objects = [datetime.datetime.strptime(date, '%Y-%m-%d').date() for date in orders]
+        calendar.prefetch(min(date_objects), max(date_objects))
+        cache.save_calendar(account['student_id'], calendar)
+
+    result = {}
+    for date, meal_plans in sorted(orders.items()):
+        try:
+            result[date] = order_date(session, account['student_id'], calendar, date, meal_plans, dry_run, batch)
+        except (PlanError, order.SessionExpired) as e:
+            result[date] = str(e)
+    if menus is not None:
+        for date, status in result.items():
+            if status == '不可订餐的日期':
+                continue
+            try:
+                menus.append((account['student_id'], cache.get_menu(account['student_id'], date, session).to_dict()))
+            except (order.SessionExpired, OSError):
+                # 结果已经有了，菜单少一个不要紧
+                pass
+    return result
+
+
+def run_plan(plan, concurrency=None, dry_run=False, batch=False, menus=None):
+    """
+    所有账号并发地订餐，每个账号内部按日期依次进行
+    :type plan: dict
+    :type concurrency: int
+    :type menus: list
+    :param concurrency: 同时进行的账号数，默认为计划文件中的concurrency，再没有则为4
+    :param menus: 见run_account
+    :rtype: dict
+    """
+    if concurrency is None:
+        concurrency = plan.get('concurrency', 4)
+    accounts = plan['accounts']
+
+    def run(account):
+        try:
+            return run_account(account, dry_run, batch, menus)
+        except Exception as e:
+            # 一个账号出错不应影响其他账号
+            return {None: '{0}: {1}'.format(type(e).__name__, e)}
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = executor.map(run, accounts)
+        return {account['student_id']: result for account, result in zip(accounts, results)}
+
+
+def command(args):
+    """
+    canteen.py bulk，参数见那里
+    :type args: argparse.Namespace
+    """
+    instrument.enable_from_env()
+    menus = [] if args.store else None
+    results = run_plan(load_plan(args.plan), args.concurrency, args.dry_run, args.batch_toggles, menus)
+    for student_id, result in results.items():
+        for date, status in result.items():
+            print('{0}\t{1}\t{2}'.format(student_id, date or '-', status))
+    if args.report:
+        with open(args.report, 'w', encoding='utf-8') as report_file:
+            json.dump(results, report_file, ensure_ascii=False, indent=2)
+    if args.store:
+        import store
+        order_store = store.Store()
+        try:
+            order_store.save_menus(menus)
+            if not args.dry_run:
+                order_store.save_results(results)
+        finally:
+            order_store.close()
+
+
+def main():
+    canteen.main(['bulk'] + sys.argv[1:])
+
+
+if __name__ == '__main__':
+    main()
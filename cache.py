@@ -0,0 +1,352 @@
+"""
+本地缓存，存放在CANTEEN_CACHE_DIR（默认为~/.cache/canteen-cli）下
+cookies/<学号>.json: 登录后的Cookie，下次运行时直接用，省掉中央登录
+menus/<学号>/<日期>.json: 解析好的菜单。不可修改的菜单永久保存，可修改的菜单只保存MENU_MAX_AGE秒
+calendars/<学号>.json: 各月份可订餐日期的索引，只在当天有效
+balances/<学号>.json: 最近一次登录时看到的姓名和余额，给analytics用
+order（连带requests、lxml）到要用时才导入，canteen.py cache、stats这些只读缓存的命令就不必等它们
+"""
+import datetime
+import json
+import os
+import tempfile
+import time
+from hashlib import sha1
+
+CACHE_DIR = os.environ.get('CANTEEN_CACHE_DIR', os.path.join(os.path.expanduser('~'), '.cache', 'canteen-cli'))
+
+# Cookie缓存的有效期（秒）。过了这个时间就不用了，直接重新登录。没过期但服务器不认的话，会在第一次请求时重新登录
+COOKIE_MAX_AGE = 2 * 60 * 60
+# 可修改的菜单的缓存有效期（秒）。别人订餐会改变剩余份数，所以不能太长
+MENU_MAX_AGE = 5 * 60
+
+
+def cache_path(*parts):
+    """
+    :type parts: str
+    :rtype: str
+    """
+    return os.path.join(CACHE_DIR, *parts)
+
+
+def list_dir(*parts):
+    """
+    缓存中某个目录下的文件名，目录不存在时为空。只读的命令不要建目录
+    :type parts: str
+    :rtype: list[str]
+    """
+    try:
+        return os.listdir(cache_path(*parts))
+    except FileNotFoundError:
+        return []
+
+
+def write_json(path, obj):
+    """
+    先写临时文件再替换，多个进程、线程同时写也不会读到半个文件。Cookie等同于密码，只有自己能读
+    目录只在写的时候建
+    :type path: str
+    """
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+    # mkstemp的文件名每次都不同，权限为0600
+    fd, temp_path = tempfile.mkstemp(dir=directory, prefix=os.path.basename(path) + '.', suffix='.tmp')
+    try:
+        with open(fd, 'w', encoding='utf-8') as f:
+            json.dump(obj, f, ensure_ascii=False)
+        os.replace(temp_path, path)
+    except BaseException:
+        os.remove(temp_path)
+        raise
+
+
+def read_json(path):
+    """
+    文件不存在或损坏时返回None
+    :type path: str
+    """
+    try:
+        with open(path, encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def save_cookies(session, username, max_age=COOKIE_MAX_AGE):
+    """
+    :type session: order.Session
+    :type username: str
+    :type max_age: int
+    """
+    now = time.time()
+    cookies = [{
+        'name': cookie.name,
+        'value': cookie.value,
+        'domain': cookie.domain,
+        'path': cookie.path,
+        'expires': cookie.expires,
+        'secure': cookie.secure
+    } for cookie in session.cookies]
+    write_json(cache_path('cookies', username + '.json'), {
+        'saved_at': now,
+        'expires_at': now + max_age,
+        'cookies': cookies
+    })
+
+
+def load_cookies(session, username):
+    """
+    把缓存的Cookie放进session。没有缓存或缓存已过期时返回False
+    :type session: order.Session
+    :type username: str
+    :rtype: bool
+    """
+    from requests.cookies import create_cookie
+
+    cache = read_json(cache_path('cookies', username + '.json'))
+    if cache is None or cache['expires_at'] < time.time():
+        return False
+    for cookie in cache['cookies']:
+        session.cookies.set_cookie(create_cookie(**cookie))
+    return True
+
+
+def clear_cookies(username):
+    """
+    :type username: str
+    """
+    try:
+        os.remove(cache_path('cookies', username + '.json'))
+    except FileNotFoundError:
+        pass
+
+
+def login(username, password, session=None, max_age=COOKIE_MAX_AGE):
+    """
+    登录中央认证和“一卡通”系统，返回用户的姓名和卡中的余额
+    有缓存的Cookie就直接用；之后不管什么时候会话过期，都会自动重新登录（见order.Session.recover），
+    GET会重试，POST则抛出order.StaleForm，由调用方重新拉取页面
+    登录失败时抛出LoginFailed
+    :type username: str
+    :type password: str
+    :type session: order.Session
+    :type max_age: int
+    :rtype: (str, str)
+    """
+    import order
+    if session is None:
+        session = order.session
+
+    def relogin(session):
+        cas_param = order.login_cas(username, password, session=session)
+        if cas_param and not cas_param[2]:
+            # 会话过期时还在路上的请求会被重定向到登录页，把lt换掉，所以用新的lt再试一次
+            # 密码错了就不要再试，多试几次账号可能会被锁
+            cas_param = order.login_cas(username, password, cas_param, session)
+        if cas_param:
+            clear_cookies(username)
+            raise order.LoginFailed
+        name_balance = order.login_card_system(session)
+        save_cookies(session, username, max_age)
+        return name_balance
+
+    session.relogin = relogin
+    if load_cookies(session, username):
+        # 用login_card_system验证Cookie是否还有效，它本来就要请求，不多花一次往返
+        # 若已失效，会被重定向到登录页，由session.relogin重新登录
+        name_balance = order.login_card_system(session)
+    else:
+        name_balance = relogin(session)
+    save_balance(username, name_balance)
+    return name_balance
+
+
+def save_balance(username, name_balance):
+    """
+    :type username: str
+    :type name_balance: (str, str)
+    :param name_balance: login_card_system的返回值
+    """
+    name, balance = name_balance
+    write_json(cache_path('balances', username + '.json'), {
+        'saved_at': time.time(),
+        'name': name,
+        'balance': float(balance)
+    })
+
+
+def load_balance(username):
+    """
+    返回{"saved_at": 时间戳, "name": 姓名, "balance": 余额}，没有登录过时返回None
+    :type username: str
+    :rtype: dict
+    """
+    return read_json(cache_path('balances', username + '.json'))
+
+
+def load_menu(username, date, max_age=MENU_MAX_AGE):
+    """
+    读取缓存的菜单，返回(菜单, 缓存项)。没有缓存时返回(None, None)，缓存过期时返回(None, 缓存项)
+    :type username: str
+    :type date: str
+    :type max_age: int
+    :rtype: (order.Menu, dict)
+    """
+    import order
+
+    entry = read_json(cache_path('menus', username, date + '.json'))
+    if entry is None:
+        return None, None
+    # 不可修改的菜单以后也不会变了
+    if not entry['menu']['mutable'] or entry['fetched_at'] + max_age > time.time():
+        return order.Menu.from_dict(entry['menu']), entry
+    return None, entry
+
+
+def save_menu(username, menu, digest):
+    """
+    :type username: str
+    :type menu: order.Menu
+    :type digest: str
+    :param digest: 菜单页面的哈希，用来判断重新拉取的页面有没有变
+    """
+    write_json(cache_path('menus', username, menu.date + '.json'), {
+        'fetched_at': time.time(),
+        'digest': digest,
+        'menu': menu.to_dict()
+    })
+
+
+def invalidate_menu(username, date):
+    """
+    提交菜单后要调用这个，否则下次读到的还是提交前的菜单
+    :type username: str
+    :type date: str
+    """
+    try:
+        os.remove(cache_path('menus', username, date + '.json'))
+    except FileNotFoundError:
+        pass
+
+
+def get_menu(username, date, session=None, max_age=MENU_MAX_AGE):
+    """
+    带缓存的order.Menu(date)
+    服务器不给ETag，所以缓存过期后还是要重新拉取页面，但若页面的哈希与缓存的相同，就不用再解析一遍了
+    :type username: str
+    :type date: str
+    :type session: order.Session
+    :type max_age: int
+    :rtype: order.Menu
+    """
+    import order
+    if session is None:
+        session = order.session
+
+    menu, entry = load_menu(username, date, max_age)
+    if menu is not None:
+        return menu
+
+    page = order.get_menu(date, session)
+    digest = sha1(page.encode('utf-8')).hexdigest()
+    if entry is not None and entry['digest'] == digest:
+        menu = order.Menu.from_dict(entry['menu'])
+    else:
+        menu = order.Menu(date, page)
+    save_menu(username, menu, digest)
+    return menu
+
+
+def cached_usernames():
+    """
+    缓存过菜单的账号
+    :rtype: list[str]
+    """
+    return sorted(list_dir('menus'))
+
+
+def cached_menus(username):
+    """
+    缓存中这个账号的所有菜单（不管是否过期），按日期排序
+    只是Menu.to_dict()的结果，要统计很多菜单时不必构造Menu
+    :type username: str
+    :rtype: collections.Iterable[dict]
+    """
+    directory = cache_path('menus', username)
+    for file_name in sorted(list_dir('menus', username)):
+        if file_name.endswith('.json'):
+            entry = read_json(os.path.join(directory, file_name))
+            if entry is not None:
+                yield entry['menu']
+
+
+def submit_menu(username, date, course_amount, do_not_order, form_param, session=None, batch=False):
+    """
+    order.submit_menu，提交后（不论成功与否）清除这一天的菜单缓存
+    :type username: str
+    :rtype: bool
+    """
+    import order
+    if session is None:
+        session = order.session
+
+    try:
+        return order.submit_menu(date, course_amount, do_not_order, form_param, session=session, batch=batch)
+    finally:
+        invalidate_menu(username, date)
+
+
+def get_calendar(username, session=None):
+    """
+    今天保存过可订餐日期的索引的话，直接用它构造Calendar，不访问服务器；否则同Calendar.calendar_init
+    :type username: str
+    :type session: order.Session
+    :rtype: order.Calendar
+    """
+    import order
+    if session is None:
+        session = order.session
+
+    index = read_json(cache_path('calendars', username + '.json'))
+    # 可订餐的日期每天都会变，所以只用当天的
+    if index is not None and index['day'] == datetime.date.today().isoformat():
+        return order.Calendar.from_dict(index['calendar'], session)
+    return order.Calendar.calendar_init(session)
+
+
+def save_calendar(username, calendar):
+    """
+    :type username: str
+    :type calendar: order.Calendar
+    """
+    write_json(cache_path('calendars', username + '.json'), {
+        'day': datetime.date.today().isoformat(),
+        'calendar': calendar.to_dict()
+    })
+
+
+def command(args):
+    """
+    canteen.py cache：列出缓存的账号、余额、Cookie和菜单，不访问服务器
+    :type args: argparse.Namespace
+    """
+    now = time.time()
+    print('缓存目录：{0}'.format(CACHE_DIR))
+    for username in args.accounts or cached_usernames():
+        balance = load_balance(username)
+        cookies = read_json(cache_path('cookies', username + '.json'))
+        dates = sorted(file_name[:-len('.json')] for file_name in list_dir('menus', username)
+                       if file_name.endswith('.json'))
+
+        print('\n{0}'.format(username))
+        if balance is not None:
+            print('\t{0}，余额{1:.2f}元（{2:%Y-%m-%d %H:%M}）'.format(
+                balance['name'], balance['balance'], datetime.datetime.fromtimestamp(balance['saved_at'])))
+        if cookies is not None and cookies['expires_at'] > now:
+            print('\tCookie还有{0:.0f}分钟过期'.format((cookies['expires_at'] - now) / 60))
+        else:
+            print('\t没有可用的Cookie')
+        if dates:
+            print('\t{0}天的菜单，{1}到{2}'.format(len(dates), dates[0], dates[-1]))
+        else:
+            print('\t没有菜单')
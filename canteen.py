@@ -0,0 +1,152 @@
+#!/usr/bin/env python
+"""
+所有命令的入口：python canteen.py <命令> [参数]，python canteen.py <命令> --help看各命令的参数
+    order     交互式订餐（同python order.py）
+    bulk      按计划文件批量订餐
+    auto      按计划文件中的偏好和预算自动订餐
+    schedule  常驻后台，在截止时间之前按计划自动订餐
+    export    把菜单和订餐记录导出成NDJSON
+    watch     盯着还能修改的菜单，有变化时输出事件
+    stats     统计缓存中的菜单
+    validate  检查计划文件
+    cache     查看缓存的账号、余额和菜单
+    query     查询订餐记录的数据库（见store.py）
+cron里一分钟要调好几次，所以这里只定义参数，各命令的模块等选定了命令才导入
+requests、lxml、numpy都很慢（合起来要二三百毫秒），--help、validate、cache都用不到它们
+bulk.py、scheduler.py等的main()也是转到这里来的
+"""
+import argparse
+import importlib
+import sys
+
+
+def add_plan_commands(subparsers):
+    parser = subparsers.add_parser('bulk', help='按计划文件批量订餐', description='按计划文件给多个账号批量订餐')
+    parser.add_argument('plan', help='计划文件（JSON）的路径')
+    parser.add_argument('-j', '--concurrency', type=int, help='同时进行的账号数')
+    parser.add_argument('--report', help='把结果以JSON写入这个文件')
+    parser.add_argument('--dry-run', action='store_true', help='只列出要发的请求和大小，不提交')
+    parser.add_argument('--batch-toggles', action='store_true', help='把所有“不订餐”的变化放进一次回发')
+    parser.add_argument('--store', action='store_true', help='把菜单和结果写进数据库（见store.py）')
+    parser.set_defaults(module='bulk')
+
+    parser = subparsers.add_parser('auto', help='按偏好和预算自动订餐',
+                                   description='按计划文件中各账号的auto（偏好和预算）自动决定每一餐订什么')
+    parser.add_argument('plan', help='计划文件（JSON）的路径')
+    parser.add_argument('--start', required=True, help='开始日期，如2015-10-08')
+    parser.add_argument('--end', required=True, help='结束日期（含）')
+    parser.add_argument('-j', '--concurrency', type=int, help='同时进行的账号数')
+    parser.add_argument('--dry-run', action='store_true', help='只列出要发的请求和大小，不提交')
+    parser.add_argument('--batch-toggles', action='store_true', help='把所有“不订餐”的变化放进一次回发')
+    parser.set_defaults(module='solver')
+
+    parser = subparsers.add_parser('schedule', help='在截止时间之前按计划自动订餐',
+                                   description='常驻后台，在截止时间之前按计划自动订餐')
+    parser.add_argument('plan', help='计划文件（JSON）的路径')
+    parser.add_argument('-j', '--concurrency', type=int, help='同时进行的任务数')
+    parser.add_argument('--lead', type=float, default=30, help='在截止前多少分钟提交')
+    parser.add_argument('--warmup', type=float, default=2, help='在提交前多少分钟登录并拉取菜单')
+    parser.add_argument('--rescan', type=float, default=6, help='每隔多少小时重新查一次日历')
+    parser.add_argument('--horizon', type=int, default=28, help='长期订单往后看多少天')
+    parser.add_argument('--once', action='store_true', help='只扫描一次，排进队列的都做完就退出')
+    parser.add_argument('--dry-run', action='store_true', help='只列出要发的请求和大小，不提交')
+    parser.add_argument('--batch-toggles', action='store_true', help='把所有“不订餐”的变化放进一次回发')
+    parser.set_defaults(module='scheduler')
+
+    parser = subparsers.add_parser('export', help='导出菜单和订餐记录', description='把菜单和订餐记录导出成NDJSON')
+    parser.add_argument('plan', help='计划文件（JSON）的路径')
+    parser.add_argument('--start', required=True, help='开始日期，如2015-09-01')
+    parser.add_argument('--end', required=True, help='结束日期（含）')
+    parser.add_argument('-o', '--output', help='输出文件，默认为stdout')
+    parser.add_argument('-j', '--workers', type=int, default=4, help='每个账号拉取菜单的线程数')
+    parser.add_argument('-p', '--processes', type=int, help='用这么多个进程解析菜单，适合一次拉取上百个的时候')
+    parser.add_argument('--store', action='store_true', help='把菜单写进数据库（见store.py），而不是输出NDJSON')
+    parser.set_defaults(module='export')
+
+    parser = subparsers.add_parser('watch', help='盯着菜单的变化', description='盯着还能修改的菜单，有变化时输出事件（NDJSON）')
+    parser.add_argument('plan', help='计划文件（JSON）的路径')
+    parser.add_argument('--days', type=int, default=7, help='盯今天起多少天内的日期')
+    parser.add_argument('--interval', type=float, default=60, help='每隔多少秒看一次')
+    parser.add_argument('-j', '--concurrency', type=int, default=4, help='同时拉取的页面数')
+    parser.add_argument('--rounds', type=int, help='每个日期看几次就停，默认一直看下去')
+    parser.add_argument('-o', '--output', help='把事件追加到这个文件，默认为stdout')
+    parser.set_defaults(module='watch')
+
+    parser = subparsers.add_parser('validate', help='检查计划文件', description='检查计划文件的格式，不登录')
+    parser.add_argument('plan', help='计划文件（JSON）的路径')
+    parser.set_defaults(func=validate)
+
+
+def add_cache_commands(subparsers):
+    parser = subparsers.add_parser('stats', help='统计缓存中的菜单',
+                                   description='统计缓存中的菜单：每月花费、余额、受欢迎的菜')
+    parser.add_argument('accounts', nargs='*', help='学号，默认为缓存过菜单的所有账号')
+    parser.add_argument('--window', type=int, default=28, help='按最近多少天的花费估算余额能用多久')
+    parser.add_argument('--top', type=int, default=10, help='列出多少道最受欢迎的菜')
+    parser.add_argument('--json', action='store_true', help='输出JSON')
+    parser.set_defaults(module='analytics')
+
+    parser = subparsers.add_parser('cache', help='查看缓存', description='查看缓存的账号、余额和菜单，不访问服务器')
+    parser.add_argument('accounts', nargs='*', help='学号，默认为缓存过菜单的所有账号')
+    parser.set_defaults(module='cache')
+
+    parser = subparsers.add_parser('query', help='查询订餐记录的数据库', description='查询订餐记录的数据库，不访问服务器')
+    parser.add_argument('--db', help='数据库的路径，默认为缓存目录下的orders.sqlite3')
+    parser.add_argument('--json', action='store_true', help='每行输出一个JSON对象')
+    parser.set_defaults(module='store')
+    actions = parser.add_subparsers(dest='action', metavar='查询')
+    actions.required = True
+    action = actions.add_parser('import', help='把缓存中的菜单和余额导入数据库')
+    action.add_argument('accounts', nargs='*', help='学号，默认为缓存过菜单的所有账号')
+    action = actions.add_parser('missing', help='某一天某一餐没订的账号')
+    action.add_argument('date', help='日期，如2015-10-14')
+    action.add_argument('meal', help='餐次的名字或序号')
+    action = actions.add_parser('demand', help='每天每道菜一共订了几份')
+    action.add_argument('--start', required=True, help='开始日期')
+    action.add_argument('--end', required=True, help='结束日期（含）')
+    action.add_argument('--meal', help='只看这一餐')
+    action = actions.add_parser('results', help='批量订餐的结果')
+    action.add_argument('--date')
+    action.add_argument('--student-id')
+    action = actions.add_parser('sql', help='执行一条只读的SQL')
+    action.add_argument('sql')
+
+
+def make_parser():
+    parser = argparse.ArgumentParser(prog='canteen.py', description='深圳实验学校高中部网上订餐系统CLI客户端')
+    subparsers = parser.add_subparsers(dest='command', metavar='命令')
+    subparsers.required = True
+    parser_order = subparsers.add_parser('order', help='交互式订餐', description='交互式订餐')
+    parser_order.set_defaults(func=lambda args: importlib.import_module('order').main())
+    add_plan_commands(subparsers)
+    add_cache_commands(subparsers)
+    return parser
+
+
+def validate(args):
+    import plan
+    try:
+        plan.load_plan(args.plan)
+    except (OSError, plan.PlanError) as e:
+        print(e)
+        return 1
+    print('没有问题')
+    return 0
+
+
+def main(argv=None):
+    """
+    :type argv: list[str]
+    :param argv: 默认为sys.argv[1:]
+    """
+    args = make_parser().parse_args(argv)
+    if hasattr(args, 'func'):
+        status = args.func(args)
+    else:
+        # 到这时才导入这个命令的模块
+        status = importlib.import_module(args.module).command(args)
+    sys.exit(status or 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,196 @@
+#!/usr/bin/env python
+"""
+把一段日期内的菜单导出成NDJSON（每行一个JSON对象），每道菜一行，例如：
+{"student_id": "1234567", "date": "2015-10-08", "meal": "午餐", "num": 1, "type": "套餐", "name": "……",
+ "price": 12.0, "max": 1, "current": 1, "mutable": true}
+current为已订的份数，所以过去的日期就是订餐记录
+从日历取日期、拉取菜单、展开成记录、写出都是生成器，边拉边写，内存占用与日期数、账号数无关
+账号从计划文件（格式见plan.py）中读，只用到student_id和password_env
+拉取上百个菜单时可以加-p，用进程池解析（见pipeline.py），这时记录按解析完的顺序输出，不一定按日期
+加--store时不输出NDJSON，而是把菜单写进数据库（见store.py）
+python export.py plan.json --start 2015-09-01 --end 2016-07-15 [-o menus.ndjson] [-j 线程数] [-p 进程数] [--store]
+"""
+import collections
+import datetime
+import json
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+import bulk
+import cache
+import canteen
+import instrument
+import order
+import pipeline
+from meals import MEAL_NAME
+from plan import PlanError, load_plan
+
+
+def iter_dates(calendar, start, end):
+    """
+    日历上start到end（含）之间可查询菜单的日期
+    :type calendar: order.Calendar
+    :type start: datetime.date
+    :type end: datetime.date
+    :rtype: collections.Iterable[str]
+    """
+    calendar.prefetch(start, end)
+    start, end = start.strftime('%Y-%m-%d'), end.strftime('%Y-%m-%d')
+    for date in calendar.orderable_dates():
+        if start <= date <= end:
+            yield date
+
+
+def iter_menus(username, dates, session=order.session, workers=4):
+    """
+    按顺序逐个产生dates的菜单（带缓存，见cache.get_menu）
+    用线程池并发地拉取，但最多只提前拉workers个，不会把所有菜单都攒在内存里
+    :type username: str
+    :type dates: collections.Iterable[str]
+    :type session: order.Session
+    :type workers: int
+    :rtype: collections.Iterable[order.Menu]
+    """
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        pending = collections.deque()
+        for date in dates:
+            pending.append(executor.submit(cache.get_menu, username, date, session))
+            if len(pending) >= workers:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+def iter_parsed_menus(username, dates, session=order.session, workers=4, processes=None, executor=None):
+    """
+    同iter_menus，但下载和解析分开，由pipeline在进程池里解析，解析好的菜单也存进缓存
+    按解析完的顺序产生，不一定按日期
+    :type username: str
+    :type dates: collections.Iterable[str]
+    :type session: order.Session
+    :type workers: int
+    :type processes: int
+    :type executor: concurrent.futures.ProcessPoolExecutor
+    :param executor: 见pipeline.iter_menus，多个账号共用一个
+    :rtype: collections.Iterable[order.Menu]
+    """
+    for date, menu, digest in pipeline.iter_menus(dates, session, workers, processes, executor=executor):
+        cache.save_menu(username, menu, digest)
+        yield menu
+
+
+def iter_records(student_id, menus):
+    """
+    把菜单展开成每道菜一条记录
+    :type student_id: str
+    :type menus: collections.Iterable[order.Menu]
+    :rtype: collections.Iterable[dict]
+    """
+    for menu in menus:
+        for meal in menu:
+            for course in meal:
+                yield {
+                    'student_id': student_id,
+                    'date': menu.date,
+                    'meal': MEAL_NAME[meal.id],
+                    'num': course.num,
+                    'type': course.type,
+                    'name': course.name,
+                    'price': course.price,
+                    'max': course.max,
+                    'current': course.current,
+                    'mutable': menu.mutable
+                }
+
+
+def export_menus(account, start, end, workers=4, processes=None, executor=None):
+    """
+    登录一个账号，产生它start到end之间的所有菜单
+    :type account: dict
+    :type start: datetime.date
+    :type end: datetime.date
+    :type workers: int
+    :type processes: int
+    :type executor: concurrent.futures.ProcessPoolExecutor
+    :param processes: 不为None时用iter_parsed_menus
+    :param executor: 见iter_parsed_menus
+    :rtype: collections.Iterable[order.Menu]
+    """
+    session = order.Session()
+    bulk.login_account(account, session)
+    calendar = cache.get_calendar(account['student_id'], session)
+    dates = iter_dates(calendar, start, end)
+    if processes is None:
+        yield from iter_menus(account['student_id'], dates, session, workers)
+    else:
+        yield from iter_parsed_menus(account['student_id'], dates, session, workers, processes, executor)
+    cache.save_calendar(account['student_id'], calendar)
+
+
+def export_account(account, start, end, workers=4, processes=None, executor=None):
+    """
+    登录一个账号，产生它start到end之间的所有记录，参数同export_menus
+    :rtype: collections.Iterable[dict]
+    """
+    return iter_records(account['student_id'], export_menus(account, start, end, workers, processes, executor))
+
+
+def write_records(records, output):
+    """
+    每条记录写一行，返回写了多少行
+    :type records: collections.Iterable[dict]
+    :type output: io.TextIOBase
+    :rtype: int
+    """
+    count = 0
+    for record in records:
+        output.write(json.dumps(record, ensure_ascii=False))
+        output.write('\n')
+        count += 1
+    return count
+
+
+def command(args):
+    """
+    canteen.py export，参数见那里
+    :type args: argparse.Namespace
+    """
+    instrument.enable_from_env()
+    start = datetime.datetime.strptime(args.start, '%Y-%m-%d').date()
+    end = datetime.datetime.strptime(args.end, '%Y-%m-%d').date()
+    if args.store:
+        import store
+        output = store.Store()
+    else:
+        output = open(args.output, 'w', encoding='utf-8') if args.output else sys.stdout
+    # 所有账号共用一个进程池，起进程、导入模块只付一次
+    executor = pipeline.make_executor(args.processes) if args.processes else None
+    try:
+        for account in load_plan(args.plan)['accounts']:
+            try:
+                if args.store:
+                    # 一个账号一个事务，边拉边写
+                    menus = export_menus(account, start, end, args.workers, args.processes, executor)
+                    count = output.save_menus((account['student_id'], menu.to_dict()) for menu in menus)
+                    unit = '个菜单'
+                else:
+                    count = write_records(export_account(account, start, end, args.workers, args.processes, executor),
+                                          output)
+                    unit = '条记录'
+            except (PlanError, order.LoginFailed, order.SessionExpired) as e:
+                print('{0}\t{1}'.format(account['student_id'], e), file=sys.stderr)
+                continue
+            print('{0}\t{1}{2}'.format(account['student_id'], count, unit), file=sys.stderr)
+    finally:
+        if executor is not None:
+            executor.shutdown(wait=True)
+        if args.store or args.output:
+            output.close()
+
+
+def main():
+    canteen.main(['export'] + sys.argv[1:])
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,208 @@
+"""
+记录每个HTTP请求和解析各阶段的耗时，退出时输出汇总表或JSON lines
+默认不开启。开启后会替换order.Session.request、urllib3的connect和order中几个解析函数，关掉之前一直有效
+    instrument.enable()                       # 退出时往stderr打汇总表
+    instrument.enable('json', 'trace.jsonl')  # 退出时把每条记录写成一行JSON
+也可以设置环境变量CANTEEN_TRACE=table或json（以及CANTEEN_TRACE_FILE），再调用enable_from_env()
+只对基于requests的order.Session有效，async_order不在此列
+"""
+import atexit
+import functools
+import json
+import os
+import sys
+import threading
+import time
+from urllib.parse import urlsplit
+
+import urllib3.connection
+import urllib3.response
+
+import order
+import transport
+
+# 要计时的阶段：(对象, 属性名, 显示的名称)。get_menu和Menu.__init__包括了网络请求
+PHASES = (
+    (order, 'get_web_forms_field', 'get_web_forms_field'),
+    (order, 'parse_menu_page', 'parse_menu_page'),
+    (order, 'get_menu', 'get_menu'),
+    (order.Menu, '__init__', 'Menu.__init__'),
+)
+
+records = []
+records_lock = threading.Lock()
+originals = {}
+# 当前线程正在进行的请求中，解压响应体花了多少毫秒。解压发生在requests读响应体的时候，拆不到请求外面去计时
+decoding = threading.local()
+
+
+def record(**event):
+    event['thread'] = threading.current_thread().name
+    with records_lock:
+        records.append(event)
+
+
+def timed_phase(name, func):
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            record(kind='phase', name=name, ms=(time.perf_counter() - start) * 1000)
+    return wrapper
+
+
+def timed_decode(decompress):
+    @functools.wraps(decompress)
+    def wrapper(self, data, *args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return decompress(self, data, *args, **kwargs)
+        finally:
+            decoding.ms = getattr(decoding, 'ms', 0) + (time.perf_counter() - start) * 1000
+    return wrapper
+
+
+def timed_request(request):
+    @functools.wraps(request)
+    def wrapper(self, method, url, *args, **kwargs):
+        name = '{0} {1}'.format(method, urlsplit(url).path.split(';')[0])
+        decoding.ms = 0
+        start = time.perf_counter()
+        try:
+            response = request(self, method, url, *args, **kwargs)
+        except Exception as e:
+            record(kind='request', name=name, ms=(time.perf_counter() - start) * 1000, error=type(e).__name__)
+            raise
+        hops = response.history + [response]
+        record(
+            kind='request',
+            name=name,
+            status=response.status_code,
+            ms=(time.perf_counter() - start) * 1000,
+            # 包括重定向的各跳，已算在ms里
+            decode_ms=decoding.ms,
+            # requests的elapsed是从发出请求到解析完响应头，近似于服务器的处理时间
+            server_ms=sum(hop.elapsed.total_seconds() for hop in hops) * 1000,
+            redirects=len(response.history),
+            bytes=len(response.content),
+            wire_bytes=sum(int(hop.headers.get('Content-Length', 0)) for hop in hops),
+            gzip=response.headers.get('Content-Encoding') == 'gzip'
+        )
+        # 被重定向到登录页，就是会话过期了（login_cas自己访问登录页时不会有重定向）
+        if order.LOGIN_URL in response.url and response.history:
+            record(kind='expired', name=name)
+        return response
+    return wrapper
+
+
+def timed_connect(connect):
+    @functools.wraps(connect)
+    def wrapper(self):
+        start = time.perf_counter()
+        try:
+            return connect(self)
+        finally:
+            # 包括DNS解析
+            record(kind='connect', name='{0}:{1}'.format(self.host, self.port),
+                   ms=(time.perf_counter() - start) * 1000)
+    return wrapper
+
+
+def patch(owner, name, wrapper):
+    original = getattr(owner, name)
+    originals[owner, name] = original
+    setattr(owner, name, wrapper(original))
+
+
+def enable(fmt='table', path=None):
+    """
+    :type fmt: str
+    :type path: str
+    :param fmt: table或json
+    :param path: 输出到这个文件，默认为stderr
+    """
+    if originals:
+        return
+    patch(order.Session, 'request', timed_request)
+    patch(urllib3.connection.HTTPConnection, 'connect', timed_connect)
+    patch(urllib3.response.GzipDecoder, 'decompress', timed_decode)
+    patch(urllib3.response.DeflateDecoder, 'decompress', timed_decode)
+    for owner, name, label in PHASES:
+        patch(owner, name, functools.partial(timed_phase, label))
+    atexit.register(report, fmt, path)
+
+
+def enable_from_env():
+    fmt = os.environ.get('CANTEEN_TRACE')
+    if fmt:
+        enable(fmt, os.environ.get('CANTEEN_TRACE_FILE'))
+
+
+def disable():
+    for (owner, name), original in originals.items():
+        setattr(owner, name, original)
+    originals.clear()
+    atexit.unregister(report)
+
+
+def summarize():
+    """
+    按(类型, 名称)汇总
+    :rtype: list[dict]
+    """
+    groups = {}
+    with records_lock:
+        for event in records:
+            groups.setdefault((event['kind'], event['name']), []).append(event)
+
+    rows = []
+    for (kind, name), events in sorted(groups.items()):
+        timings = sorted(event.get('ms', 0) for event in events)
+        rows.append({
+            'kind': kind,
+            'name': name,
+            'count': len(events),
+            'total_ms': sum(timings),
+            'mean_ms': sum(timings) / len(timings),
+            'p95_ms': timings[min(len(timings) - 1, int(len(timings) * 0.95))],
+            'server_ms': sum(event.get('server_ms', 0) for event in events),
+            'decode_ms': sum(event.get('decode_ms', 0) for event in events),
+            'bytes': sum(event.get('bytes', 0) for event in events),
+            'wire_bytes': sum(event.get('wire_bytes', 0) for event in events),
+            'redirects': sum(event.get('redirects', 0) for event in events),
+            'errors': sum(1 for event in events if 'error' in event)
+        })
+    return rows
+
+
+def report(fmt='table', path=None):
+    """
+    :type fmt: str
+    :type path: str
+    """
+    output = open(path, 'w', encoding='utf-8') if path else sys.stderr
+    try:
+        if fmt == 'json':
+            with records_lock:
+                for event in records:
+                    output.write(json.dumps(event, ensure_ascii=False) + '\n')
+            return
+        output.write('{0:<8}{1:<72}{2:>7}{3:>11}{4:>10}{5:>10}{6:>12}{7:>12}{8:>12}{9:>6}\n'.format(
+            'kind', 'name', 'count', 'total(ms)', 'mean(ms)', 'p95(ms)', 'server(ms)', 'gunzip(ms)', 'bytes', 'hops'))
+        for row in summarize():
+            output.write('{kind:<8}{name:<72}{count:>7}{total_ms:>11.1f}{mean_ms:>10.2f}{p95_ms:>10.2f}'
+                         '{server_ms:>12.1f}{decode_ms:>12.1f}{bytes:>12}{redirects:>6}\n'.format(**row))
+        # 共用的连接池中连接的复用情况，见transport.Transport.stats
+        if transport.shared_transport is not None:
+            for host, entry in sorted(transport.shared_transport.stats().items()):
+                output.write('{0:<8}{1:<72}{requests:>7} requests, {connections} connections, {reused} reused\n'.format(
+                    'pool', host, **entry))
+            # 限流的现状，见transport.Governor.stats
+            for prefix, entry in sorted(transport.shared_transport.limits().items()):
+                output.write('{0:<8}{1:<72}limit {limit:.1f}, {active} active, {waiting} waiting, '
+                             '{decreases} decreases\n'.format('limit', prefix, **entry))
+    finally:
+        if path:
+            output.close()
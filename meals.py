@@ -0,0 +1,19 @@
+"""
+餐次的名字和订餐的期限。不依赖requests和lxml，只看计划文件、缓存的命令也可以用，启动快
+order里也能用这些名字
+"""
+import datetime
+
+MEAL_NAME = ('早餐', '午餐', '晚餐')
+
+# 说的是“72小时”，实际上是把那一整天排除了，故+1：今天能订到今天+ORDER_ADVANCE_DAYS及以后的餐
+ORDER_ADVANCE_DAYS = 3 + 1
+
+
+def order_deadline(date):
+    """
+    date的菜单最晚能在什么时候修改（不含），即date前ORDER_ADVANCE_DAYS天那一天结束的时刻
+    :type date: datetime.date
+    :rtype: datetime.datetime
+    """
+    return datetime.datetime.combine(date - datetime.timedelta(ORDER_ADVANCE_DAYS - 1), datetime.time())
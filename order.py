@@ -1,11 +1,17 @@
 #!/usr/bin/env python
 import datetime
 import re
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from getpass import getpass
 from hashlib import md5
+from urllib.parse import urlencode
 
 import requests
-from lxml import html
+
+from meals import MEAL_NAME, ORDER_ADVANCE_DAYS
+from transport import shared as shared_transport
 
 skeleton_headers = {
     'Accept': 'image/gif, image/jpeg, image/pjpeg, application/x-ms-application, application/xaml+xml, \
@@ -20,13 +26,19 @@ LOGIN_URL = 'http://gzb.szsy.cn:3000/cas/login'
 CARD_SYSTEM_LOGIN_URL = 'http://gzb.szsy.cn/card/'
 CALENDAR_URL = 'http://gzb.szsy.cn/card/Restaurant/RestaurantUserMenu/RestaurantUserSelect.aspx'
 MENU_URL = 'http://gzb.szsy.cn/card/Restaurant/RestaurantUserMenu/RestaurantUserMenu.aspx'
+CALENDAR_REFERRER = 'http://gzb.szsy.cn/card/Default.aspx'
+CARD_SYSTEM_REFERRER = 'http://gzb.szsy.cn:4000/lcconsole/login!getSSOMessage.action'
 
 logined_skeleton_form = {
     '__EVENTARGUMENT': '',
     '__LASTFOCUS': ''
 }
 
-MEAL_NAME = ('早餐', '午餐', '晚餐')
+WEB_FORMS_FIELDS = ('__VIEWSTATE', '__VIEWSTATEGENERATOR', '__EVENTVALIDATION')
+# 登录页上说用户名或密码错。lt过期（被别的请求换掉）时只是重新给一个登录表单，没有这句
+LOGIN_REJECTED = '用户名或密码错'
+
+web_forms_field_pattern = re.compile(r'id="(__VIEWSTATE|__VIEWSTATEGENERATOR|__EVENTVALIDATION)" value="(.*?)"')
 
 
 class SessionExpired(Exception):
@@ -34,7 +46,60 @@ class SessionExpired(Exception):
         return "Your session has expired."
 
 
+class StaleForm(SessionExpired):
+    """
+    POST时会话过期。已经重新登录了，但表单里的ViewState是旧页面的，重放没有意义
+    调用方应重新访问页面，取得新的ViewState后再做一遍，见Calendar.query_calendar、bulk.order_date
+    """
+    def __str__(self):
+        return "Your session has expired, the form has to be refreshed."
+
+
+class LoginFailed(Exception):
+    def __str__(self):
+        return "Wrong username or password."
+
+
 class Session(requests.Session):
+    def __init__(self, transport=None):
+        """
+        :type transport: transport.Transport
+        :param transport: 用哪个Transport的连接池，默认为所有Session共用的那个
+        """
+        super().__init__()
+        # 固定的请求头只在这里合并一次，每个请求只带自己的Referer
+        self.headers.update(skeleton_headers)
+        self.transport = transport or shared_transport()
+        self.transport.mount(self)
+        # 会话过期时调用，参数为这个Session。设置了的话，过期时会先重新登录，GET再重试一次
+        self.relogin = None
+        # 多个线程共用一个Session（即一个账号）时，同时发现过期的线程只有一个去登录，其他的等它登录完直接重试
+        self.login_lock = threading.Lock()
+        # 重新登录过几次。请求前记下，过期时若已经变了，说明别的线程已经登录过了
+        self.logins = 0
+        # 重新登录失败过（密码改了）。之后再过期就直接抛出LoginFailed，不再登录：
+        # 每个等着的线程都去试一遍密码，账号可能会被锁
+        self.login_failed = False
+        self.recovering = threading.local()
+        # 还在路上的请求数。重新登录前要等它们都回来，不然它们被重定向到登录页时会换掉正在用的JSESSIONID和lt
+        self.in_flight = 0
+        self.in_flight_changed = threading.Condition()
+
+    def close(self):
+        # 连接池可能还有别的Session在用，由Transport.close()关闭
+        pass
+
+    @staticmethod
+    def make_headers(referrer=None):
+        """
+        每个请求单独的请求头，而不是改self.headers，这样多个线程共用一个Session时Referer不会串
+        :type referrer: str
+        :rtype: dict
+        """
+        if referrer is None:
+            return None
+        return {'Referer': referrer}
+
     def s_get(self, url, params=None, referrer=None, logged_in=True):
         """
         自制的session.get
@@ -44,14 +109,7 @@ class Session(requests.Session):
         :type logged_in: bool
         :rtype: requests.Response
         """
-        self.headers = skeleton_headers.copy()
-        if referrer is not None:
-            self.headers['Referer'] = referrer
-        request = super().get(url, params=params)
-
-        if LOGIN_URL in request.url and logged_in:
-            raise SessionExpired
-        return request
+        return self.send_checked('GET', url, logged_in, params=params, headers=self.make_headers(referrer))
 
     def s_post(self, url, data, params=None, referrer=None, logged_in=True):
         """
@@ -62,72 +120,170 @@ class Session(requests.Session):
         :type logged_in: bool
         :rtype: requests.Response
         """
-        self.headers = skeleton_headers.copy()
-        if referrer is not None:
-            self.headers['Referer'] = referrer
+        headers = self.make_headers(referrer)
         if logged_in:
             real_data = logined_skeleton_form.copy()
             real_data.update(data)
         else:
             real_data = data
-        request = super().post(url, real_data, params=params)
+        return self.send_checked('POST', url, logged_in, data=real_data, params=params, headers=headers)
 
-        if LOGIN_URL in request.url and logged_in:
-            raise SessionExpired
+    def send_checked(self, method, url, logged_in, **kwargs):
+        """
+        发出请求，若被重定向到登录页，说明会话过期了
+        设置了relogin的话，先重新登录；GET再重试一次，POST则抛出StaleForm
+        :type method: str
+        :type url: str
+        :type logged_in: bool
+        :rtype: requests.Response
+        """
+        if not logged_in or getattr(self.recovering, 'active', False):
+            return self.request(method, url, **kwargs)
+        logins, request = self.send_counted(method, url, **kwargs)
+        if LOGIN_URL in request.url:
+            self.recover(logins)
+            if method != 'GET':
+                raise StaleForm
+            _, request = self.send_counted(method, url, **kwargs)
+            if LOGIN_URL in request.url:
+                raise SessionExpired
         return request
 
+    def send_counted(self, method, url, **kwargs):
+        """
+        别的线程正在重新登录的话，等它登录完再发；发出的请求记在in_flight里。返回(发出前的self.logins, 响应)
+        :type method: str
+        :type url: str
+        :rtype: (int, requests.Response)
+        """
+        with self.login_lock:
+            logins = self.logins
+            with self.in_flight_changed:
+                self.in_flight += 1
+        try:
+            return logins, self.request(method, url, **kwargs)
+        finally:
+            with self.in_flight_changed:
+                self.in_flight -= 1
+                self.in_flight_changed.notify_all()
+
+    def recover(self, logins):
+        """
+        会话过期后重新登录。拿着login_lock，若这期间别的线程已经登录过（self.logins不再是logins）就不用再登录
+        重新登录失败过的话，直接抛出LoginFailed
+        :type logins: int
+        :param logins: 发出过期的那个请求之前的self.logins
+        """
+        # 重新登录的过程中再过期就不要递归了
+        if self.relogin is None or getattr(self.recovering, 'active', False):
+            raise SessionExpired
+        with self.login_lock:
+            if self.login_failed:
+                raise LoginFailed
+            if self.logins != logins:
+                return
+            # 拿着login_lock就不会有新的请求发出，等还在路上的都回来
+            with self.in_flight_changed:
+                self.in_flight_changed.wait_for(lambda: self.in_flight == 0)
+            self.recovering.active = True
+            try:
+                self.relogin(self)
+            except LoginFailed:
+                self.login_failed = True
+                raise
+            finally:
+                self.recovering.active = False
+            self.logins += 1
+
 
 session = Session()
 
 
-def login_cas(username, password, cas_param=None):
+def login_cas(username, password, cas_param=None, session=session):
     """
     教务系统使用CAS中央登陆，以是否存在跳转页面的特征判断登录是否成功，见reference.txt
     若成功，返回None
-    若失败，返回下次登陆需要的JSESSIONID和lt
+    若失败，返回[JSESSIONID, lt, 是否是用户名或密码错]，前两项是下次登录需要的
     :type username: str
     :type password: str
     :type cas_param: list
     :param username: 用户名
     :param password: 密码
-    :param cas_param: 上次登录返回的[jsessionid, lt]
+    :param cas_param: 上次登录返回的[jsessionid, lt, ...]
+    :param session: 默认为模块里那个全局的session。多个账号同时登录时，每个账号要用自己的Session
     """
     if cas_param is None:
         # 据观察，只有在第一次访问，即Cookie中没有JSESSIONID时，页面中的地址才会带上JSESSIONID
         # 说真的，这步没啥必要。不过，尽量模拟得逼真点吧
         # 而lt是会变化的
         login_page = session.s_get(LOGIN_URL, logged_in=False)
-        jsessionid = re.search('jsessionid=(.*?)"', login_page.text).group(1)
-        lt = re.search('name="lt" value="(.*?)"', login_page.text).group(1)
+        jsessionid, lt = parse_login_page(login_page.text)
         login_post_url = LOGIN_URL + ';jsessionid=' + jsessionid
     else:
         jsessionid = cas_param[0]
         lt = cas_param[1]
         login_post_url = LOGIN_URL
 
-    login_form = {
+    login_form = make_login_form(username, password, lt)
+    auth = session.s_post(login_post_url, login_form, referrer=LOGIN_URL, logged_in=False)
+    return parse_auth_page(auth.text, jsessionid)
+
+
+def parse_login_page(page):
+    """
+    从第一次访问的登录页中得到[jsessionid, lt]
+    :type page: str
+    :rtype: list[str]
+    """
+    jsessionid = re.search('jsessionid=(.*?)"', page).group(1)
+    lt = re.search('name="lt" value="(.*?)"', page).group(1)
+    return [jsessionid, lt]
+
+
+def make_login_form(username, password, lt):
+    """
+    :type username: str
+    :type password: str
+    :type lt: str
+    :rtype: dict
+    """
+    return {
         'username': username,
         'password': md5(password.encode('utf-8')).hexdigest(),
         'lt': lt,
         '_eventId': 'submit',
         'submit': '登录'
     }
-    auth = session.s_post(login_post_url, login_form, referrer=LOGIN_URL, logged_in=False)
-    auth_status = '登录成功' in auth.text
 
-    if auth_status:
+
+def parse_auth_page(page, jsessionid):
+    """
+    登录后返回的页面。返回值同login_cas
+    :type page: str
+    :type jsessionid: str
+    :rtype: list
+    """
+    if '登录成功' in page:
         return None
     else:
         # lt是会变化的
-        lt = re.search('name="lt" value="(.*?)"', auth.text).group(1)
-        return [jsessionid, lt]
+        lt = re.search('name="lt" value="(.*?)"', page).group(1)
+        return [jsessionid, lt, LOGIN_REJECTED in page]
 
 
-def login_card_system():
+def login_card_system(session=session):
     """登录“一卡通”系统，返回值为用户的姓名和卡中的余额"""
-    card_login = session.s_get(CARD_SYSTEM_LOGIN_URL,
-                               referrer='http://gzb.szsy.cn:4000/lcconsole/login!getSSOMessage.action')
+    card_login = session.s_get(CARD_SYSTEM_LOGIN_URL, referrer=CARD_SYSTEM_REFERRER)
     order_welcome_page = card_login.text  # 此处会302到欢迎页
+    return parse_welcome_page(order_welcome_page)
+
+
+def parse_welcome_page(order_welcome_page):
+    """
+    从“一卡通”系统的欢迎页中得到用户的姓名和卡中的余额
+    :type order_welcome_page: str
+    :rtype: (str, str)
+    """
     name = re.search(r'<span id="LblUserName">当前用户：(.*?)</span>', order_welcome_page).group(1)
     balance = re.search(r'<span id="LblBalance">帐户余额：(.*?)元</span>', order_welcome_page).group(1)
 
@@ -141,10 +297,9 @@ def get_web_forms_field(page):
     :type page: str
     :rtype: list[str]
     """
-    vs = re.search(r'id="__VIEWSTATE" value="(.*?)"', page).group(1)
-    vsg = re.search(r'id="__VIEWSTATEGENERATOR" value="(.*?)"', page).group(1)
-    ev = re.search(r'id="__EVENTVALIDATION" value="(.*?)"', page).group(1)
-    return [vs, vsg, ev]
+    # 扫一遍就够了，__VIEWSTATE动辄几十KB，别扫三遍
+    fields = dict(web_forms_field_pattern.findall(page))
+    return [fields[name] for name in WEB_FORMS_FIELDS]
 
 
 def parse_date_list(page):
@@ -159,8 +314,9 @@ def parse_date_list(page):
 
 
 class Calendar(dict):
-    def __init__(self, selected_year, form_param, selectable_year, init_dict):
+    def __init__(self, selected_year, form_param, selectable_year, init_dict, session=session):
         super().__init__()
+        self.session = session
         self.selected_year = selected_year
         self.form_param = form_param
 
@@ -169,10 +325,17 @@ class Calendar(dict):
         self.update(init_dict)
 
     @classmethod
-    def calendar_init(cls):
+    def calendar_init(cls, session=session):
         """第一次访问选择日期的页面，返回选择日期的页面，VIEWSTATE，EVENTVALIDATION"""
-        calendar = session.s_get(CALENDAR_URL, referrer='http://gzb.szsy.cn/card/Default.aspx')
-        page = calendar.text
+        calendar = session.s_get(CALENDAR_URL, referrer=CALENDAR_REFERRER)
+        return cls.from_page(calendar.text, session)
+
+    @classmethod
+    def from_page(cls, page, session=session):
+        """
+        用第一次访问得到的选择日期的页面构造Calendar
+        :type page: str
+        """
         form_param = get_web_forms_field(page)
         selectable_year = [int(year) for year in re.findall(r'value="(\d{4})"', page)]
         selectable_year.sort()
@@ -181,7 +344,67 @@ class Calendar(dict):
             1).zfill(2)
         date_string = selected_year + '-' + selected_month
         init_dict = {date_string: parse_date_list(page)}
-        return cls(int(selected_year), form_param, selectable_year, init_dict)
+        return cls(int(selected_year), form_param, selectable_year, init_dict, session)
+
+    def to_dict(self):
+        """
+        可订餐日期的索引。ViewState不保存，从这里还原的Calendar在需要查询时会重新访问页面
+        :rtype: dict
+        """
+        return {
+            'selected_year': self.selected_year,
+            'selectable_year': self.selectable_year,
+            'months': dict(self)
+        }
+
+    @classmethod
+    def from_dict(cls, d, session=session):
+        """
+        :type d: dict
+        """
+        return cls(d['selected_year'], None, d['selectable_year'], d['months'], session)
+
+    def refresh(self):
+        """重新访问选择日期的页面，取得新的ViewState"""
+        calendar = self.calendar_init(self.session)
+        self.selected_year = calendar.selected_year
+        self.form_param = calendar.form_param
+        self.selectable_year = calendar.selectable_year
+        self.update(calendar)
+
+    def months_to_query(self, start, end):
+        """
+        start到end（含）之间所有还没查过的月份，按查询的顺序排好，prefetch和async_order的都用它
+        先查当前选中的年份，再一年一年地查，这样切换年份（要POST两次）的次数最少
+        :type start: datetime.date
+        :type end: datetime.date
+        :rtype: list[(int, int)]
+        """
+        months = []
+        year, month = start.year, start.month
+        while (year, month) <= (end.year, end.month):
+            if year in self.selectable_year and '{0}-{1:02}'.format(year, month) not in self:
+                months.append((year, month))
+            year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+
+        months.sort(key=lambda m: (m[0] != self.selected_year, m))
+        return months
+
+    def prefetch(self, start, end):
+        """
+        一次查完start到end（含）之间所有还没查过的月份，顺序见months_to_query
+        :type start: datetime.date
+        :type end: datetime.date
+        """
+        for year, month in self.months_to_query(start, end):
+            self['{0}-{1:02}'.format(year, month)] = self.query_calendar(year, month)
+
+    def orderable_dates(self):
+        """
+        已查询过的月份中所有可订餐的日期，按日期排序
+        :rtype: list[str]
+        """
+        return sorted(date for month in self.values() for date in month)
 
     def test(self, date):
         """
@@ -206,110 +429,197 @@ class Calendar(dict):
         :param year: 菜单的年份
         :param month: 菜单的月份
         """
-        query_calendar_form = {
-            '__EVENTTARGET': 'DrplstMonth1$DrplstControl',
-            '__VIEWSTATE': self.form_param[0],
-            '__VIEWSTATEGENERATOR': self.form_param[1],
-            '__EVENTVALIDATION': self.form_param[2],
-            'DrplstYear1$DrplstControl': year,
-            'DrplstMonth1$DrplstControl': month
-        }
-        post_calendar = session.s_post(CALENDAR_URL, query_calendar_form, referrer=CALENDAR_URL)
+        if self.form_param is None:
+            self.refresh()
+        try:
+            return self.post_query(year, month)
+        except StaleForm:
+            # 已经重新登录了，换上新会话的ViewState再查一遍，只是查询，重来无妨
+            self.refresh()
+            return self.post_query(year, month)
+
+    def post_query(self, year, month):
+        """
+        用当前的ViewState回发，查询对应月份的菜单
+        :type year: int
+        :type month: int
+        :rtype: list[str]
+        """
+        post_calendar = self.session.s_post(CALENDAR_URL, self.make_query_form(year, month), referrer=CALENDAR_URL)
         page = post_calendar.text
         self.form_param = get_web_forms_field(page)
 
         if not year == self.selected_year:
             # 切换年份时，需要像处理不订餐那么搞
-            query_calendar_form.update({
-                '__VIEWSTATE': self.form_param[0],
-                '__VIEWSTATEGENERATOR': self.form_param[1],
-                '__EVENTVALIDATION': self.form_param[2]
-            })
-            post_calendar = session.s_post(CALENDAR_URL, query_calendar_form, referrer=CALENDAR_URL)
+            post_calendar = self.session.s_post(CALENDAR_URL, self.make_query_form(year, month), referrer=CALENDAR_URL)
             page = post_calendar.text
             self.form_param = get_web_forms_field(page)
             self.selected_year = year
 
         return parse_date_list(page)
 
+    def make_query_form(self, year, month):
+        """
+        用当前的ViewState生成查询月份的表单
+        :type year: int
+        :type month: int
+        :rtype: dict
+        """
+        return {
+            '__EVENTTARGET': 'DrplstMonth1$DrplstControl',
+            '__VIEWSTATE': self.form_param[0],
+            '__VIEWSTATEGENERATOR': self.form_param[1],
+            '__EVENTVALIDATION': self.form_param[2],
+            'DrplstYear1$DrplstControl': year,
+            'DrplstMonth1$DrplstControl': month
+        }
+
 
-def get_menu(date):
+def get_menu(date, session=session):
     """
     获得给定日期的菜单，返回菜单的页面
     :type date: str
     :rtype: str
     """
     menu = session.s_get(MENU_URL, params={'Date': date}, referrer=CALENDAR_URL)
+    return menu.text
 
-    # 我也是被逼的……如果不这么干，lxml提取出的列表里会有那串空白
-    # 且看上去remove_blank_text不是这么用的
-    page = re.sub(r'\r\n {24}(?: {4})?', '', menu.text)
-    page = page.replace('&nbsp;', ' ')  # 避免在Windows下出现编码问题，GBK中没有\xa0
-    return page
 
-
-def get_course_count(page, menu_sequence):
+def parse_menu_page(page):
     """
+    只遍历一遍lxml的树，同时取出View State等字段、“不订餐”的勾选状态、菜单能否修改和各餐的菜
+    每道菜是一行单元格的文本，合计那一行不要
+    返回{'form_param': list, 'do_not_order': list, 'mutable': bool, 'meals': [[[单元格, ...], ...], ...]}
     :type page: str
-    :type menu_sequence: int
-    :param menu_sequence: 这一餐的序号
-    :rtype: int
+    :rtype: dict
     """
-    return len(re.findall(r'Repeater1_GvReport_{0}_LblMaxno_\d'.format(menu_sequence), page))
+    # lxml要二十多毫秒才能导入完，只登录、不看菜单时用不到
+    from lxml import etree
+
+    fields = {}
+    do_not_order = []
+    mutable = False
+    meals = {}
+
+    # 用etree.HTML而不是html.fromstring，省掉lxml.html给每个元素查找HtmlElement子类的开销
+    for element in etree.HTML(page).iter('input', 'table', 'a'):
+        if element.tag == 'input':
+            name = element.get('name', '')
+            if name in WEB_FORMS_FIELDS:
+                fields[name] = element.get('value', '')
+            elif name.endswith('$CbkMealtimes') and element.get('checked') is not None:
+                # Repeater1$ctl00$CbkMealtimes
+                do_not_order.append(int(name[len('Repeater1$ctl'):-len('$CbkMealtimes')]))
+        elif element.tag == 'table':
+            # 只有装着菜单的table是带"id"属性的
+            table_id = element.get('id', '')
+            if table_id.startswith('Repeater1_GvReport_'):
+                rows = []
+                for tr in element.iterfind('tr'):
+                    # 表头用的是th。不用像以前那样先删掉那串空白了，strip一下就好
+                    # 顺便把\xa0换掉，避免在Windows下出现编码问题，GBK中没有\xa0
+                    cells = [etree.tostring(td, method='text', encoding='unicode', with_tail=False)
+                             .replace('\xa0', ' ').strip() for td in tr.iterfind('td')]
+                    if cells and '合计:' not in cells:
+                        rows.append(cells)
+                meals[int(table_id[len('Repeater1_GvReport_'):])] = rows
+        elif element.get('onclick') == 'return subs();':
+            mutable = True
+
+    return {
+        'form_param': [fields[name] for name in WEB_FORMS_FIELDS],
+        'do_not_order': do_not_order,
+        'mutable': mutable,
+        'meals': [meals[meal_seq] for meal_seq in sorted(meals)]
+    }
 
 
 class Course(object):
+    # 一学期、几百个学生的菜单要同时放在内存里，不要每道菜都带一个__dict__
+    __slots__ = ('id', 'num', 'type', 'name', 'price', 'max', 'current')
+
     def __init__(self, seq, course):
         self.id = seq
         self.num = int(course[0])
-        self.type = course[1]
-        self.name = course[2]
+        # 类别和菜名重复得很厉害，intern之后所有菜单共用同一个str
+        self.type = sys.intern(course[1])
+        self.name = sys.intern(course[2])
         self.price = float(course[5])
         self.max = int(course[6])
         self.current = int(course[7])
 
+    def to_dict(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    @classmethod
+    def from_dict(cls, d):
+        """
+        :type d: dict
+        """
+        course = cls.__new__(cls)
+        for name in cls.__slots__:
+            setattr(course, name, d[name])
+        course.type = sys.intern(course.type)
+        course.name = sys.intern(course.name)
+        return course
+
 
 class Meal(list):
-    def __init__(self, seq, menu_list, course_count):
+    __slots__ = ('id', 'required_course')
+
+    def __init__(self, seq, rows):
+        """
+        :type seq: int
+        :type rows: list[list[str]]
+        :param rows: 每道菜一行单元格，见parse_menu_page
+        """
         super().__init__()
         self.required_course = []
         self.id = seq
 
-        for course_seq in range(course_count):
-            start = 9 * course_seq
-            end = 9 * (course_seq + 1)
-            l = menu_list[start:end]
+        for course_seq, cells in enumerate(rows):
             # 用于记录必选菜的编号，以处理必选菜不在最后的特殊情况
-            if l[4] == '必选':
+            if cells[4] == '必选':
                 self.required_course.append(course_seq)
-            self.append(Course(course_seq, l))
+            self.append(Course(course_seq, cells))
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'required_course': self.required_course,
+            'courses': [course.to_dict() for course in self]
+        }
+
+    @classmethod
+    def from_dict(cls, d):
+        """
+        :type d: dict
+        """
+        meal = cls(d['id'], [])
+        meal.required_course = list(d['required_course'])
+        meal.extend(Course.from_dict(course) for course in d['courses'])
+        return meal
 
 
 class Menu(list):
-    def __init__(self, date):
+    __slots__ = ('date', 'form_param', 'do_not_order', 'mutable')
+
+    def __init__(self, date, page=None, session=session):
+        """
+        :type date: str
+        :type page: str
+        :param page: 已经拉取的菜单页面。为None时现拉
+        """
         super().__init__()
-        page = get_menu(date)
-        self.form_param = get_web_forms_field(page)
-        # 只有装着菜单的table是带"id"属性的
-        meal_count = len(re.findall(r'id="Repeater1_GvReport_(\d)"', page))
-        self.do_not_order = [int(x) for x in
-                             re.findall(r'name="Repeater1\$ctl0(\d)\$CbkMealtimes" checked="checked"', page)]
-
-        if '<a onclick="return subs();"' in page:
-            self.mutable = True
-        elif '<a onclick="return msg();"' in page:
-            self.mutable = False
-
-        tree = html.fromstring(page)
-        for meal_seq in range(meal_count):
-            # 尽管没遇到过菜数不是9的情况，但还是别把它写死吧
-            course_count = get_course_count(page, meal_seq)
-            # 若菜单不可修改，总价那一行不会有那个id标签
-            if not self.mutable:
-                course_count -= 1
-            xpath = '//table[@id="Repeater1_GvReport_{0}"]/tr/td//text()'.format(meal_seq)
-            menu_item = tree.xpath(xpath)
-            self.append(Meal(meal_seq, menu_item, course_count))
+        self.date = date
+        if page is None:
+            page = get_menu(date, session)
+        parsed = parse_menu_page(page)
+        self.form_param = parsed['form_param']
+        self.do_not_order = parsed['do_not_order']
+        self.mutable = parsed['mutable']
+        for meal_seq, rows in enumerate(parsed['meals']):
+            self.append(Meal(meal_seq, rows))
 
     def get_course_amount(self):
         """
@@ -324,38 +634,184 @@ class Menu(list):
 
         return course_amount
 
+    def to_dict(self):
+        """
+        转换成可以JSON序列化的dict，用from_dict还原，不需要重新拉取、解析页面
+        :rtype: dict
+        """
+        return {
+            'date': self.date,
+            'form_param': self.form_param,
+            'do_not_order': self.do_not_order,
+            'mutable': self.mutable,
+            'meals': [meal.to_dict() for meal in self]
+        }
+
+    @classmethod
+    def from_dict(cls, d):
+        """
+        :type d: dict
+        """
+        menu = cls.__new__(cls)
+        menu.date = d['date']
+        menu.form_param = list(d['form_param'])
+        menu.do_not_order = list(d['do_not_order'])
+        menu.mutable = d['mutable']
+        menu.extend(Meal.from_dict(meal) for meal in d['meals'])
+        return menu
+
+
+def fetch_menus(dates, workers=4, session=session):
+    """
+    用线程池并发地拉取多个日期的菜单，共用已登录的session（及其Cookie），返回{日期: Menu}
+    Menu的解析也在线程里做，但主要的时间花在等服务器上
+    :type dates: list[str]
+    :type workers: int
+    :param dates: 要拉取的日期，格式同get_menu
+    :param workers: 线程数。每个host的连接池大小见transport.POOL_SIZES，超过了的线程只能等连接，再多也没用
+    :rtype: dict
+    """
+    dates = list(dates)
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        menus = executor.map(lambda date: Menu(date, session=session), dates)
+        return dict(zip(dates, menus))
+
 
 def gen_menu_param(course_amount):
     """
     参数为course_amount这个dict，返回值为CALLBACKPARAM
+    服务器要每道菜都有一项，“不订餐”的那几餐也要有（数量为0）占位，所以不能只放变了的
     :type course_amount: dict
     :rtype: str
     """
-    param_string = ''
-    for k, v in course_amount.items():
-        # {0}用于和自己拼在一起。{1[0]}为key中的第一个数，即meal_order，{1[1]}即course
-        param_string = '{0}Repeater1_GvReport_{1[0]}_TxtNum_{1[1]}@{2}|'.format(
-            param_string, k, v
-        )
+    # Repeater1_GvReport_{餐次}_TxtNum_{序号}@{数量}|，一次join，不要一项一项地拼到越来越长的字符串上
+    return ''.join('Repeater1_GvReport_{0}_TxtNum_{1}@{2}|'.format(meal_order, course, amount)
+                   for (meal_order, course), amount in course_amount.items())
+
+
+def diff_order(menu, course_amount, do_not_order):
+    """
+    比较要提交的和菜单上已有的，返回(变了的菜{(餐次, 序号): (原数量, 新数量)}, “不订餐”的净变化)
+    两个都为空就不用提交了。改完之后“不订餐”的那几餐，菜的数量只是占位，不算变化
+    :type menu: Menu
+    :type course_amount: dict
+    :type do_not_order: list
+    :param do_not_order: 同submit_menu
+    :rtype: (dict, list)
+    """
+    toggles = plan_do_not_order(do_not_order)
+    not_ordered = {meal_order for meal_order, selected in toggles if selected}
+    not_ordered |= set(do_not_order[0]) - {meal_order for meal_order, selected in toggles if not selected}
 
-    return param_string
+    current = menu.get_course_amount()
+    changed = {}
+    for key, amount in course_amount.items():
+        if key[0] not in not_ordered and current.get(key) != amount:
+            changed[key] = (current.get(key), amount)
+    return changed, toggles
 
 
-def submit_menu(date, course_amount, do_not_order, form_param):
+def submit_menu(date, course_amount, do_not_order, form_param, session=session, batch=False):
     """
     返回是否成功的Bool
     :type date: str
     :type course_amount: dict
     :type do_not_order: list
     :type form_param: list
+    :type batch: bool
     :param date: 提交菜单的日期
     :param course_amount: 菜的数量
     :param do_not_order: [原页面已勾选“不订餐”的餐次, 要“不订餐”的餐次, 要取消“不订餐”的餐次]
     :param form_param: 菜单页与ASP.NET Web Forms相关的字段
+    :param batch: 见plan_submit
     :rtype: bool
     """
-    # unpack
+    steps = plan_submit(course_amount, do_not_order, form_param, batch)
+    for i, submit_menu_form in enumerate(steps):
+        post_menu = session.s_post(
+            MENU_URL,
+            submit_menu_form,
+            params={'Date': date},
+            referrer=MENU_URL + '?Date=' + date
+        )
+        # 提交“不订餐”后会返回新页面，后面的表单又要改这些
+        # Evil ASP.NET!
+        for next_form in steps[i + 1:]:
+            update_web_forms_field(next_form, post_menu.text)
+    return parse_submit_result(post_menu.text)
+
+
+def plan_do_not_order(do_not_order):
+    """
+    算出“不订餐”的净变化，返回[(餐次, 是否勾选), ...]。勾了又取消的、本来就是那个状态的都不用提交
+    :type do_not_order: list
+    :param do_not_order: 同submit_menu
+    :rtype: list
+    """
     do_not_order_list, to_select, to_deselect = do_not_order
+    before = set(do_not_order_list)
+    # 与以前先逐个勾选、再逐个取消的结果一致
+    after = (before | set(to_select)) - set(to_deselect)
+    return [(meal_order, meal_order in after) for meal_order in sorted(before ^ after)]
+
+
+def plan_submit(course_amount, do_not_order, form_param, batch=False):
+    """
+    返回提交菜单要依次POST的表单：先是“不订餐”的回发，最后是提交菜单的回调
+    第一个之后的表单中的View State要用上一个请求返回的页面更新
+    :type course_amount: dict
+    :type do_not_order: list
+    :type form_param: list
+    :type batch: bool
+    :param batch: 为False时模拟浏览器，每改一个“不订餐”回发一次（据观察要一个一个加，一个一个减）；
+                  为True时把所有变化放进一次回发，ASP.NET会对每个变了的CheckBox触发CheckedChanged
+    :rtype: list[dict]
+    """
+    submit_menu_form = make_submit_form(do_not_order[0], form_param)
+    changes = plan_do_not_order(do_not_order)
+    groups = [changes] if batch and changes else [[change] for change in changes]
+
+    steps = []
+    for group in groups:
+        for meal_order, selected in group:
+            toggle_do_not_order(submit_menu_form, meal_order, selected)
+        steps.append(submit_menu_form.copy())
+
+    set_callback_param(submit_menu_form, course_amount)
+    steps.append(submit_menu_form)
+    return steps
+
+
+def describe_submit(date, steps):
+    """
+    演习用：描述plan_submit计划发出的请求及其大小，每个请求一行，不真的发
+    后面的请求的View State还不知道，按和第一个一样长估计
+    :type date: str
+    :type steps: list[dict]
+    :rtype: list[str]
+    """
+    lines = []
+    for i, step in enumerate(steps, 1):
+        data = logined_skeleton_form.copy()
+        data.update(step)
+        if step.get('__CALLBACKID'):
+            action = '提交菜单（{0}项）'.format(step['__CALLBACKPARAM'].count('|'))
+        else:
+            action = '回发 {0}'.format(step['__EVENTTARGET'])
+        lines.append('{0}. POST {1}?Date={2} {3} {4:.1f}KB'.format(
+            i, MENU_URL, date, action, len(urlencode(data)) / 1024))
+    return lines
+
+
+def make_submit_form(do_not_order_list, form_param):
+    """
+    生成提交菜单用的表单
+    :type do_not_order_list: list
+    :type form_param: list
+    :param do_not_order_list: 原页面已勾选“不订餐”的餐次
+    :param form_param: 菜单页与ASP.NET Web Forms相关的字段
+    :rtype: dict
+    """
     submit_menu_form = {
         '__VIEWSTATE': form_param[0],
         '__VIEWSTATEGENERATOR': form_param[1],
@@ -369,52 +825,56 @@ def submit_menu(date, course_amount, do_not_order, form_param):
         box_id = 'Repeater1$ctl0{0}$CbkMealtimes'.format(meal_order)
         submit_menu_form[box_id] = 'on'
 
-    # 用来模拟浏览器的做法，提交“不订餐”的变化
-    # 要一个一个加，一个一个减
-    if to_select + to_deselect:
-        for meal_order in to_select + to_deselect:
-            box_id = 'Repeater1$ctl0{0}$CbkMealtimes'.format(meal_order)
-
-            if meal_order in to_select:
-                submit_menu_form[box_id] = 'on'
-            elif meal_order in to_deselect:
-                del submit_menu_form[box_id]
-
-            submit_menu_form['__EVENTTARGET'] = box_id
-            submit_do_not_order = session.s_post(
-                MENU_URL,
-                submit_menu_form,
-                params={'Date': date},
-                referrer=MENU_URL + '?Date=' + date
-            )
-            submit_return_page = submit_do_not_order.text
-
-            # 提交后会返回新页面，又要改这些
-            # Evil ASP.NET!
-            form_param = get_web_forms_field(submit_return_page)
-            submit_menu_form.update({
-                '__VIEWSTATE': form_param[0],
-                '__VIEWSTATEGENERATOR': form_param[1],
-                '__EVENTVALIDATION': form_param[2]
-            })
-
-    # 提交菜单
-    menu_param = gen_menu_param(course_amount)
+    return submit_menu_form
+
+
+def toggle_do_not_order(submit_menu_form, meal_order, selected):
+    """
+    在表单中勾选/取消勾选某一餐的“不订餐”，并把它设为__EVENTTARGET
+    :type submit_menu_form: dict
+    :type meal_order: int
+    :type selected: bool
+    """
+    box_id = 'Repeater1$ctl0{0}$CbkMealtimes'.format(meal_order)
+    if selected:
+        submit_menu_form[box_id] = 'on'
+    else:
+        submit_menu_form.pop(box_id, None)
+    submit_menu_form['__EVENTTARGET'] = box_id
+
+
+def update_web_forms_field(form, page):
+    """
+    用返回的新页面中的View State等更新表单
+    :type form: dict
+    :type page: str
+    """
+    form_param = get_web_forms_field(page)
+    form.update({
+        '__VIEWSTATE': form_param[0],
+        '__VIEWSTATEGENERATOR': form_param[1],
+        '__EVENTVALIDATION': form_param[2]
+    })
+
+
+def set_callback_param(submit_menu_form, course_amount):
+    """
+    :type submit_menu_form: dict
+    :type course_amount: dict
+    """
     submit_menu_form.update({
         '__EVENTTARGET': '',
         '__CALLBACKID': '__Page',
-        '__CALLBACKPARAM': menu_param
+        '__CALLBACKPARAM': gen_menu_param(course_amount)
     })
 
-    post_menu = session.s_post(
-        MENU_URL,
-        submit_menu_form,
-        params={'Date': date},
-        referrer=MENU_URL + '?Date=' + date
-    )
-    status = '订餐成功！' in post_menu.text
 
-    return status
+def parse_submit_result(page):
+    """
+    :type page: str
+    :rtype: bool
+    """
+    return '订餐成功！' in page
 
 
 def main():
@@ -453,8 +913,7 @@ def main():
         for date in month:
             date_object = datetime.datetime.strptime(date, '%Y-%m-%d')
             print('{0} 星期{1}'.format(date, date_object.isoweekday()))
-    # 说的是“72小时”，实际上是把那一整天排除了，故+1
-    print("理论上说，现在能够订到", datetime.timedelta(3 + 1) + datetime.date.today(), "及以后的餐")
+    print("理论上说，现在能够订到", datetime.timedelta(ORDER_ADVANCE_DAYS) + datetime.date.today(), "及以后的餐")
 
     while True:
         # 检查日期
@@ -577,8 +1036,11 @@ def main():
                         course_amount[meal.id, course] = course_num
 
         if menu.mutable:
-            print('正在提交菜单')
             do_not_order_list = [menu.do_not_order, to_select, to_deselect]
+            if diff_order(menu, course_amount, do_not_order_list) == ({}, []):
+                print('\n没有改动，不用提交')
+                continue
+            print('正在提交菜单')
             post_status = submit_menu(
                 date, course_amount,
                 do_not_order_list, menu.form_param)
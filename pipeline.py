@@ -0,0 +1,194 @@
+"""
+拉取大量菜单时，把下载和解析分开：几个线程只管下载，页面放进有界的队列，由进程池解析
+解析（lxml建树、取单元格、构造Course）是CPU活，放在下载线程里会和下载抢GIL，进程池可以用上多个核
+各段之间都有上限：队列满了下载线程就等着，解析中的页面太多就先不取队列，调用方取得慢，两边都会停下来
+    for date, menu, digest in pipeline.iter_menus(dates, session):
+        ...
+子进程只收到页面的文本，返回Menu.to_dict()，在主进程里用Menu.from_dict还原，不用再解析
+起进程、在子进程里导入order（连带lxml、requests）要几百毫秒，拉取多个账号时用make_executor建一个进程池，
+每个账号都传给iter_menus，不要每个账号起一次
+"""
+import multiprocessing
+import os
+import queue
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from hashlib import sha1
+
+import order
+
+# 在队列上等着的线程每隔这么久（秒）看一眼是否该停了
+POLL_INTERVAL = 0.5
+
+
+def make_executor(processes=None):
+    """
+    解析用的进程池，用完要shutdown(wait=True)，不然子进程会留下来
+    :type processes: int
+    :param processes: 默认为CPU核数
+    :rtype: concurrent.futures.ProcessPoolExecutor
+    """
+    # 用spawn而不是fork：fork时别的线程可能正拿着锁（比如正在导入模块），子进程里就永远拿不到了
+    return ProcessPoolExecutor(max_workers=processes or os.cpu_count() or 1,
+                               mp_context=multiprocessing.get_context('spawn'))
+
+
+def parse_page(date, page, keep_form_param=True):
+    """
+    在子进程里解析，返回(Menu.to_dict(), 页面的哈希)
+    :type date: str
+    :type page: str
+    :type keep_form_param: bool
+    :param keep_form_param: 不提交的话用不到View State，它动辄几十KB，不如不传回来
+    :rtype: (dict, str)
+    """
+    menu = order.Menu(date, page).to_dict()
+    if not keep_form_param:
+        menu['form_param'] = None
+    return menu, sha1(page.encode('utf-8')).hexdigest()
+
+
+def put(items, item, stop):
+    """
+    队列满时等着，直到放进去或stop被设置，返回是否放进去了
+    :type items: queue.Queue
+    :type stop: threading.Event
+    :rtype: bool
+    """
+    while not stop.is_set():
+        try:
+            items.put(item, timeout=POLL_INTERVAL)
+            return True
+        except queue.Full:
+            pass
+    return False
+
+
+def fetch_pages(next_date, pages, stop, session):
+    """
+    下载线程：把(日期, 页面或异常)放进pages，日期取完后放一个None
+    :type next_date: () -> str
+    :type pages: queue.Queue
+    :type stop: threading.Event
+    :type session: order.Session
+    """
+    while not stop.is_set():
+        date = next_date()
+        if date is None:
+            put(pages, None, stop)
+            return
+        try:
+            item = date, order.get_menu(date, session)
+        except Exception as e:
+            item = date, e
+        if not put(pages, item, stop):
+            return
+
+
+def dispatch(pages, results, slots, stop, executor, fetchers, keep_form_param, futures):
+    """
+    分派线程：从pages中取页面交给进程池，解析完的Future放进results，也放进futures；
+    所有下载线程都结束后，放进提交了的总数。拿不到slots就等着，这样pages会满，下载线程也就停下来了
+    :type pages: queue.Queue
+    :type results: queue.Queue
+    :type slots: threading.Semaphore
+    :type stop: threading.Event
+    :type executor: concurrent.futures.Executor
+    :type fetchers: int
+    :type keep_form_param: bool
+    """
+    submitted = 0
+    while fetchers and not stop.is_set():
+        try:
+            item = pages.get(timeout=POLL_INTERVAL)
+        except queue.Empty:
+            continue
+        if item is None:
+            fetchers -= 1
+            continue
+        date, page = item
+        if isinstance(page, Exception):
+            results.put(page)
+            return
+        while not slots.acquire(timeout=POLL_INTERVAL):
+            if stop.is_set():
+                return
+        try:
+            future = executor.submit(parse_page, date, page, keep_form_param)
+        except RuntimeError as e:
+            # 调用方不要了，进程池已经关掉；否则是共用的进程池被别人关了或坏了（BrokenProcessPool），
+            # 同下载出错一样交给调用方抛出，不然它会一直等着results
+            if not stop.is_set():
+                results.put(e)
+            return
+        futures.append(future)
+        future.add_done_callback(results.put)
+        submitted += 1
+    results.put(submitted)
+
+
+def iter_menus(dates, session=order.session, fetchers=4, processes=None, queue_size=16, keep_form_param=True,
+               executor=None):
+    """
+    并发地下载、用进程池解析，按解析完的顺序产生(日期, Menu, 页面的哈希)
+    某个日期下载失败时抛出那个异常（如SessionExpired），其余的下载随之停止
+    :type dates: collections.Iterable[str]
+    :type session: order.Session
+    :type fetchers: int
+    :type processes: int
+    :type queue_size: int
+    :type keep_form_param: bool
+    :param fetchers: 下载线程数
+    :param processes: 解析进程数，默认为CPU核数；传了executor时应为它的进程数
+    :param queue_size: 下载好、还没交给进程池的页面最多有多少个
+    :param keep_form_param: 见parse_page
+    :param executor: make_executor建的进程池，由调用方关闭；为None时自己建一个，用完就关
+    :rtype: collections.Iterable[(str, order.Menu, str)]
+    """
+    processes = processes or os.cpu_count() or 1
+    owned = executor is None
+    if owned:
+        executor = make_executor(processes)
+    pages = queue.Queue(maxsize=queue_size)
+    results = queue.Queue()
+    # 正在解析的，加上解析完了还没被取走的，每个进程最多两个
+    slots = threading.Semaphore(processes * 2)
+    stop = threading.Event()
+    futures = []
+
+    dates = iter(list(dates))
+    lock = threading.Lock()
+
+    def next_date():
+        with lock:
+            return next(dates, None)
+
+    threads = [threading.Thread(target=fetch_pages, args=(next_date, pages, stop, session), daemon=True)
+               for _ in range(fetchers)]
+    threads.append(threading.Thread(
+        target=dispatch, args=(pages, results, slots, stop, executor, fetchers, keep_form_param, futures),
+        daemon=True))
+    for thread in threads:
+        thread.start()
+
+    try:
+        submitted = None
+        received = 0
+        while submitted is None or received < submitted:
+            item = results.get()
+            if isinstance(item, int):
+                submitted = item
+                continue
+            if isinstance(item, Exception):
+                raise item
+            received += 1
+            slots.release()
+            menu, digest = item.result()
+            yield menu['date'], order.Menu.from_dict(menu), digest
+    finally:
+        stop.set()
+        # 调用方中途不要了：还没开始解析的取消掉，共用的进程池别替别人白干
+        for future in futures:
+            future.cancel()
+        if owned:
+            executor.shutdown(wait=True, cancel_futures=True)
@@ -0,0 +1,223 @@
+"""
+计划文件的读取和检查，bulk、scheduler和export共用。不依赖requests和lxml
+计划文件是JSON，格式如下：
+{
+    "concurrency": 8,
+    "accounts": [
+        {
+            "student_id": "1234567",
+            "password_env": "CANTEEN_PW_1234567",
+            "dates": ["2015-10-08", "2015-10-09"],
+            "weekdays": [1, 2, 3, 4, 5],
+            "meals": {
+                "早餐": {"do_not_order": true},
+                "午餐": {"courses": {"2": 1, "4": 1}},
+                "2": {"courses": {"0": 1}}
+            },
+            "orders": {
+                "2015-10-09": {"午餐": {"courses": {"0": 1}}}
+            },
+            "auto": {
+                "meals": ["午餐", "晚餐"],
+                "prefer": {"套餐": 1, "荤菜": 2, "素菜": 1, "酱猪手": 5},
+                "pick": {"荤菜": 1, "素菜": 1},
+                "servings": {"学生奶": 2},
+                "budget": 300,
+                "use_balance": true
+            }
+        }
+    ]
+}
+密码不写在计划文件里，而是从password_env指定的环境变量中读
+meals对dates中的每一天都适用，orders可以按日期单独指定（会覆盖meals中同一餐的设置）
+weekdays只有scheduler用：日历上每个是这几个星期几的日期都按meals订
+餐次既可以写MEAL_NAME中的名字，也可以写序号；courses的键为菜的编号（即页面上的“编号”），值为份数
+计划中没提到的餐次保持原样
+auto只有solver用：不列出每道菜，而是按偏好和预算自动决定，各项的含义见solver.py
+"""
+import datetime
+import json
+
+from meals import MEAL_NAME
+
+
+class PlanError(Exception):
+    pass
+
+
+def load_plan(path):
+    """
+    读取并检查计划文件，有问题时抛出PlanError
+    :type path: str
+    :rtype: dict
+    """
+    with open(path, encoding='utf-8') as plan_file:
+        try:
+            plan = json.load(plan_file)
+        except ValueError as e:
+            raise PlanError('不是合法的JSON：{0}'.format(e))
+    problems = check_plan(plan)
+    if problems:
+        raise PlanError('\n'.join(problems))
+    return plan
+
+
+def get_meal_id(key):
+    """
+    :type key: str
+    :rtype: int
+    """
+    if key in MEAL_NAME:
+        return MEAL_NAME.index(key)
+    return int(key)
+
+
+def get_account_orders(account):
+    """
+    把dates+meals和orders合并成{日期: {餐次序号: 这一餐的计划}}
+    :type account: dict
+    :rtype: dict
+    """
+    default_meals = {get_meal_id(k): v for k, v in account.get('meals', {}).items()}
+    orders = {date: default_meals.copy() for date in account.get('dates', [])}
+    for date, meals in account.get('orders', {}).items():
+        orders.setdefault(date, default_meals.copy())
+        orders[date].update({get_meal_id(k): v for k, v in meals.items()})
+    return orders
+
+
+def check_date(date):
+    """
+    :type date: str
+    :rtype: bool
+    """
+    try:
+        datetime.datetime.strptime(date, '%Y-%m-%d')
+    except (TypeError, ValueError):
+        return False
+    return True
+
+
+def is_integer(value):
+    """
+    JSON里的true、false在Python里也是int，不能当份数、权重
+    :rtype: bool
+    """
+    return isinstance(value, int) and not isinstance(value, bool)
+
+
+def is_number(value):
+    """
+    :rtype: bool
+    """
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def check_meals(meals, where):
+    """
+    检查{餐次: 这一餐的计划}，返回问题的列表
+    :type meals: dict
+    :type where: str
+    :param where: 出错时说是哪里
+    :rtype: list[str]
+    """
+    if not isinstance(meals, dict):
+        return ['{0}应为对象'.format(where)]
+    problems = []
+    for key, meal_plan in meals.items():
+        if key not in MEAL_NAME and not (key.isdigit() and int(key) < len(MEAL_NAME)):
+            problems.append('{0}: 不认识的餐次“{1}”'.format(where, key))
+            continue
+        if not isinstance(meal_plan, dict):
+            problems.append('{0}.{1}应为对象'.format(where, key))
+            continue
+        courses = meal_plan.get('courses', {})
+        if not isinstance(courses, dict):
+            problems.append('{0}.{1}.courses应为对象'.format(where, key))
+            continue
+        for course, amount in courses.items():
+            if not course.isdigit():
+                problems.append('{0}.{1}: 菜的编号“{2}”应为整数'.format(where, key, course))
+            if not is_integer(amount) or amount < 0:
+                problems.append('{0}.{1}: 菜{2}的份数应为非负整数'.format(where, key, course))
+    return problems
+
+
+def check_auto(auto, where):
+    """
+    检查账号的auto，返回问题的列表
+    :type auto: dict
+    :type where: str
+    :rtype: list[str]
+    """
+    if not isinstance(auto, dict):
+        return ['{0}应为对象'.format(where)]
+    problems = []
+    meals = auto.get('meals', [])
+    if not isinstance(meals, list) or not all(
+            meal in MEAL_NAME or (str(meal).isdigit() and int(meal) < len(MEAL_NAME)) for meal in meals):
+        problems.append('{0}.meals应为餐次的列表'.format(where))
+    for key, check, description in (('prefer', is_number, '数'),
+                                    ('pick', lambda value: is_integer(value) and value >= 0, '非负整数'),
+                                    ('servings', lambda value: is_integer(value) and value >= 0, '非负整数')):
+        values = auto.get(key, {})
+        if not isinstance(values, dict):
+            problems.append('{0}.{1}应为对象'.format(where, key))
+            continue
+        for name, value in values.items():
+            if not check(value):
+                problems.append('{0}.{1}: “{2}”的值应为{3}'.format(where, key, name, description))
+    budget = auto.get('budget')
+    if budget is not None and (not is_number(budget) or budget < 0):
+        problems.append('{0}.budget应为非负数'.format(where))
+    if not isinstance(auto.get('use_balance', False), bool):
+        problems.append('{0}.use_balance应为true或false'.format(where))
+    return problems
+
+
+def check_plan(plan):
+    """
+    检查计划的格式，返回问题的列表，没问题时为空。不检查菜单上有没有这些菜，那要登录了才知道
+    :type plan: dict
+    :rtype: list[str]
+    """
+    if not isinstance(plan, dict) or not isinstance(plan.get('accounts'), list):
+        return ['计划应为对象，且有accounts列表']
+    problems = []
+    concurrency = plan.get('concurrency', 1)
+    if not is_integer(concurrency) or concurrency < 1:
+        problems.append('concurrency应为正整数')
+
+    for i, account in enumerate(plan['accounts']):
+        if not isinstance(account, dict):
+            problems.append('accounts[{0}]应为对象'.format(i))
+            continue
+        if 'student_id' not in account or 'password_env' not in account:
+            problems.append('每个账号都要有student_id和password_env')
+            continue
+        if not isinstance(account['student_id'], str) or not isinstance(account['password_env'], str):
+            problems.append('accounts[{0}]: student_id和password_env应为字符串'.format(i))
+            continue
+        where = account['student_id']
+        dates = account.get('dates', [])
+        if not isinstance(dates, list):
+            problems.append('{0}: dates应为日期的列表'.format(where))
+        else:
+            for date in dates:
+                if not check_date(date):
+                    problems.append('{0}: 日期“{1}”的格式应为年-月-日'.format(where, date))
+        weekdays = account.get('weekdays', [])
+        if not isinstance(weekdays, list) or not all(is_integer(day) and 1 <= day <= 7 for day in weekdays):
+            problems.append('{0}: weekdays应为1到7的列表'.format(where))
+        problems.extend(check_meals(account.get('meals', {}), where + '.meals'))
+        orders = account.get('orders', {})
+        if not isinstance(orders, dict):
+            problems.append('{0}.orders应为对象'.format(where))
+            orders = {}
+        for date, meals in orders.items():
+            if not check_date(date):
+                problems.append('{0}: 日期“{1}”的格式应为年-月-日'.format(where, date))
+            problems.extend(check_meals(meals, '{0}.orders.{1}'.format(where, date)))
+        if 'auto' in account:
+            problems.extend(check_auto(account['auto'], where + '.auto'))
+    return problems
@@ -0,0 +1,332 @@
+#!/usr/bin/env python
+"""
+常驻后台，按计划文件在每一天的截止时间之前自动订餐
+计划文件的格式见plan.py，每个账号可以写"weekdays": [1, 2, 3, 4, 5]，
+表示日历上每个可订餐、且是这几个星期几的日期都按meals订（长期的订单）
+每个日期的截止时间见meals.order_deadline。所有任务放在一个按时间排序的优先队列里：
+    扫描：登录并查日历，把新出现的可订餐日期排进队列，每隔--rescan小时一次
+    预热：提交前--warmup分钟检查会话、拉取菜单放进缓存
+    提交：截止前--lead分钟提交，这时菜单已在缓存中，只需回发
+同时进行的任务最多-j个，同一个账号的任务依次进行；失败后按指数退避重试，直到截止
+python scheduler.py plan.json [-j 并发数] [--lead 分钟] [--warmup 分钟] [--rescan 小时] [--once]
+"""
+import datetime
+import heapq
+import itertools
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import bulk
+import cache
+import canteen
+import instrument
+import order
+from meals import order_deadline
+from plan import PlanError, load_plan, get_meal_id, get_account_orders
+
+# 失败后第一次重试前等的秒数，之后每次翻倍，最多RETRY_MAX_DELAY秒
+RETRY_BASE_DELAY = 30
+RETRY_MAX_DELAY = 30 * 60
+# 队列空闲时最多睡这么久（秒）再看一眼时钟，防止休眠、调时间之后错过任务
+MAX_IDLE = 60
+
+
+class Scheduler(object):
+    def __init__(self, plan, concurrency=None, lead=datetime.timedelta(minutes=30),
+                 warmup=datetime.timedelta(minutes=2), rescan=datetime.timedelta(hours=6), horizon=28,
+                 dry_run=False, batch=False, once=False, now=datetime.datetime.now):
+        """
+        :type plan: dict
+        :type concurrency: int
+        :type lead: datetime.timedelta
+        :type warmup: datetime.timedelta
+        :type rescan: datetime.timedelta
+        :type horizon: int
+        :type dry_run: bool
+        :type batch: bool
+        :type once: bool
+        :param concurrency: 同时进行的任务数，默认为计划文件中的concurrency，再没有则为4
+        :param lead: 在截止前多久提交
+        :param warmup: 在提交前多久预热，应小于cache.MENU_MAX_AGE，否则菜单缓存到时已过期
+        :param rescan: 每隔多久重新查一次日历
+        :param horizon: 长期订单往后看多少天
+        :param once: 只扫描一次，队列空了就返回
+        :param now: 取当前时间的函数
+        """
+        if concurrency is None:
+            concurrency = plan.get('concurrency', 4)
+        self.accounts = {account['student_id']: account for account in plan['accounts']}
+        self.concurrency = concurrency
+        self.lead = lead
+        self.warmup = warmup
+        self.rescan = rescan
+        self.horizon = horizon
+        self.dry_run = dry_run
+        self.batch = batch
+        self.once = once
+        self.now = now
+
+        # (时间, 序号, 类型, 学号, 日期, 第几次尝试)，序号保证同一时间的任务先进先出
+        self.queue = []
+        self.counter = itertools.count()
+        self.condition = threading.Condition()
+        self.slots = threading.BoundedSemaphore(concurrency)
+        self.running = 0
+        self.stopped = False
+
+        # 同一个账号的任务依次进行：正在进行任务的账号，和它们到了时间、在等着的任务
+        self.busy = set()
+        self.pending = {}
+        self.sessions = {}
+        self.calendars = {}
+        # {(学号, 日期): 这一天的计划}，已经排进队列的
+        self.scheduled = {}
+        # {(学号, 日期): 结果}，已经结束的
+        self.results = {}
+
+    def log(self, student_id, date, message):
+        # 几个线程同时print会把行弄乱
+        with self.condition:
+            print('{0:%Y-%m-%d %H:%M:%S}\t{1}\t{2}\t{3}'.format(self.now(), student_id, date or '-', message),
+                  flush=True)
+
+    def push(self, when, kind, student_id, date=None, attempt=0):
+        """
+        :type when: datetime.datetime
+        :type kind: str
+        :type student_id: str
+        :type date: str
+        :type attempt: int
+        :param kind: scan、warm或submit
+        """
+        with self.condition:
+            heapq.heappush(self.queue, (when, next(self.counter), kind, student_id, date, attempt))
+            self.condition.notify()
+
+    def pop(self):
+        """
+        等到队首的任务到时间就取出它；stop()之后，或once模式下没有任务了，返回None
+        账号正忙的任务先放进pending，不交给线程池，免得一个账号的几个任务占满所有位置，
+        干等着这个账号，别的账号快截止的提交却排不上
+        :rtype: tuple
+        """
+        with self.condition:
+            while not self.stopped:
+                if self.queue:
+                    delay = (self.queue[0][0] - self.now()).total_seconds()
+                    if delay <= 0:
+                        event = heapq.heappop(self.queue)
+                        student_id = event[3]
+                        if student_id in self.busy:
+                            self.pending.setdefault(student_id, []).append(event)
+                            continue
+                        self.busy.add(student_id)
+                        self.running += 1
+                        return event
+                    self.condition.wait(min(delay, MAX_IDLE))
+                elif self.once and not self.running:
+                    return None
+                else:
+                    self.condition.wait(MAX_IDLE)
+            return None
+
+    def stop(self):
+        with self.condition:
+            self.stopped = True
+            self.condition.notify_all()
+
+    def run(self):
+        """
+        扫描所有账号，然后一直按时间顺序执行队列中的任务，直到stop()（once模式下直到队列空了）
+        返回已结束的日期的结果
+        :rtype: dict
+        """
+        now = self.now()
+        for student_id in self.accounts:
+            self.push(now, 'scan', student_id)
+
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            while True:
+                # 先占一个位置再出队，这样在等空位的时候新来的更紧急的任务仍能排到前面
+                self.slots.acquire()
+                event = self.pop()
+                if event is None:
+                    self.slots.release()
+                    break
+                executor.submit(self.dispatch, event)
+        return self.results
+
+    def dispatch(self, event):
+        when, _, kind, student_id, date, attempt = event
+        try:
+            self.handle(kind, student_id, date, attempt)
+        finally:
+            with self.condition:
+                self.running -= 1
+                self.busy.discard(student_id)
+                # 等着这个账号的任务放回队列，仍按原来的时间和先后
+                for pending in self.pending.pop(student_id, ()):
+                    heapq.heappush(self.queue, pending)
+                self.condition.notify_all()
+            self.slots.release()
+
+    def handle(self, kind, student_id, date, attempt):
+        try:
+            if kind == 'scan':
+                self.scan(student_id)
+            elif kind == 'warm':
+                self.warm(student_id, date)
+            elif kind == 'submit':
+                self.submit(student_id, date, attempt)
+        except (PlanError, order.LoginFailed) as e:
+            # 重试也没用
+            message = str(e) or '登录失败'
+            self.log(student_id, date, message)
+            if kind == 'submit':
+                self.finish(student_id, date, message)
+            elif kind == 'scan':
+                for key in [key for key in list(self.scheduled) if key[0] == student_id]:
+                    self.finish(*key, message)
+        except Exception as e:
+            self.log(student_id, date, '{0}: {1}'.format(type(e).__name__, e))
+            # 会话可能已经坏了，下次重新登录
+            self.sessions.pop(student_id, None)
+            # 预热失败不要紧，提交时会重新拉取
+            if kind != 'warm':
+                self.retry(kind, student_id, date, attempt)
+
+    def retry(self, kind, student_id, date, attempt):
+        delay = datetime.timedelta(seconds=min(RETRY_BASE_DELAY * 2 ** attempt, RETRY_MAX_DELAY))
+        when = self.now() + delay
+        if kind == 'submit':
+            deadline = order_deadline(datetime.datetime.strptime(date, '%Y-%m-%d').date())
+            if when >= deadline:
+                self.finish(student_id, date, '重试到截止时间仍未成功')
+                return
+        self.log(student_id, date, '{0}秒后重试'.format(int(delay.total_seconds())))
+        self.push(when, kind, student_id, date, attempt + 1)
+
+    def finish(self, student_id, date, status):
+        self.scheduled.pop((student_id, date), None)
+        self.results[student_id, date] = status
+
+    def get_session(self, student_id):
+        """
+        账号的Session，第一次用的时候登录。会话过期后会自动重新登录，见cache.login
+        :type student_id: str
+        :rtype: order.Session
+        """
+        session = self.sessions.get(student_id)
+        if session is None:
+            session = order.Session()
+            bulk.login_account(self.accounts[student_id], session)
+            self.sessions[student_id] = session
+        return session
+
+    def get_orders(self, account, calendar, today):
+        """
+        这个账号从today开始的所有订单：计划里写明的日期，加上长期订单在日历上对应的日期
+        会顺便把要用到的月份查好
+        :type account: dict
+        :type calendar: order.Calendar
+        :type today: datetime.date
+        :rtype: dict
+        """
+        orders = {date: meal_plans for date, meal_plans in get_account_orders(account).items()
+                  if datetime.datetime.strptime(date, '%Y-%m-%d').date() >= today}
+        weekdays = account.get('weekdays')
+        end = today + datetime.timedelta(self.horizon) if weekdays else today
+        if orders:
+            end = max(end, max(datetime.datetime.strptime(date, '%Y-%m-%d').date() for date in orders))
+        calendar.prefetch(today, end)
+
+        if weekdays:
+            default_meals = {get_meal_id(k): v for k, v in account.get('meals', {}).items()}
+            for date in calendar.orderable_dates():
+                date_object = datetime.datetime.strptime(date, '%Y-%m-%d').date()
+                if today <= date_object <= end and date_object.isoweekday() in weekdays:
+                    orders.setdefault(date, default_meals)
+        return orders
+
+    def scan(self, student_id):
+        session = self.get_session(student_id)
+        calendar = cache.get_calendar(student_id, session)
+        now = self.now()
+        orders = self.get_orders(self.accounts[student_id], calendar, now.date())
+        cache.save_calendar(student_id, calendar)
+        self.calendars[student_id] = calendar
+
+        orderable = set(calendar.orderable_dates())
+        for date, meal_plans in sorted(orders.items()):
+            key = student_id, date
+            if key in self.results:
+                continue
+            if key in self.scheduled:
+                # 计划可能被改过，提交时用最新的
+                self.scheduled[key] = meal_plans
+                continue
+            deadline = order_deadline(datetime.datetime.strptime(date, '%Y-%m-%d').date())
+            if deadline <= now:
+                self.finish(student_id, date, '已过截止时间')
+                continue
+            # 还没开放的日期等下次扫描
+            if date not in orderable:
+                continue
+
+            self.scheduled[key] = meal_plans
+            submit_at = max(now, deadline - self.lead)
+            if submit_at - self.warmup > now:
+                self.push(submit_at - self.warmup, 'warm', student_id, date)
+            self.push(submit_at, 'submit', student_id, date)
+            self.log(student_id, date, '将于{0:%Y-%m-%d %H:%M}提交（截止{1:%Y-%m-%d %H:%M}）'.format(
+                submit_at, deadline))
+
+        if not self.once:
+            self.push(now + self.rescan, 'scan', student_id)
+
+    def warm(self, student_id, date):
+        if (student_id, date) not in self.scheduled:
+            return
+        session = self.get_session(student_id)
+        # 顺便检查会话是否还有效，过期了会在这里重新登录，而不是在提交的时候
+        order.login_card_system(session)
+        cache.get_menu(student_id, date, session)
+
+    def submit(self, student_id, date, attempt):
+        meal_plans = self.scheduled.get((student_id, date))
+        if meal_plans is None:
+            return
+        session = self.get_session(student_id)
+        status = bulk.order_date(session, student_id, self.calendars[student_id], date, meal_plans,
+                                 self.dry_run, self.batch)
+        self.log(student_id, date, status)
+        if status == '订餐失败':
+            self.retry('submit', student_id, date, attempt)
+        else:
+            self.finish(student_id, date, status)
+
+
+def command(args):
+    """
+    canteen.py schedule，参数见那里
+    :type args: argparse.Namespace
+    """
+    instrument.enable_from_env()
+    scheduler = Scheduler(
+        load_plan(args.plan), args.concurrency, datetime.timedelta(minutes=args.lead),
+        datetime.timedelta(minutes=args.warmup), datetime.timedelta(hours=args.rescan), args.horizon,
+        args.dry_run, args.batch_toggles, args.once
+    )
+    try:
+        scheduler.run()
+    except KeyboardInterrupt:
+        scheduler.stop()
+
+
+def main():
+    canteen.main(['schedule'] + sys.argv[1:])
+
+
+if __name__ == '__main__':
+    main()
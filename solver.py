@@ -0,0 +1,332 @@
+#!/usr/bin/env python
+"""
+按偏好和预算自动决定每一餐订什么，不用像order.py那样一道菜一道菜地回答
+规则同order.main()：必订菜不用选；订了套餐就不订必订菜，否则必订菜订1份；每道菜的份数在0到最大份数之间
+偏好写在计划文件（格式见plan.py）每个账号的auto中：
+    meals:       要订的餐次，默认为所有餐次；其余的餐次保持原样
+    prefer:      菜名或类别的权重（菜名优先），大于0的才订，没提到的不订
+    pick:        每一餐每个类别最多订几道，挑权重高的（一样高的挑编号小的）；套餐每餐最多一道，且只订1份
+    servings:    菜名或类别订几份，默认为1，超过最大份数的按最大份数
+    budget:      这次订的这些餐一共最多花多少钱，默认不限
+    use_balance: 为true时，还不能超过卡上的余额减去以后已经订了、这次不改的餐
+钱不够时按日期、餐次的顺序订，订不起的那一餐勾上“不订餐”，钱留给后面订得起的餐
+所有账号所有日期的菜单铺成一张表（analytics.MenuTable），用一次向量运算算完，不逐个遍历Course
+python solver.py plan.json --start 2015-10-08 --end 2015-10-31 [-j 并发数] [--dry-run] [--batch-toggles]
+"""
+import datetime
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+import bulk
+import cache
+import canteen
+import export
+import instrument
+import order
+from analytics import MenuTable
+from meals import MEAL_NAME
+from plan import PlanError, get_meal_id, load_plan
+
+SET_MEAL = '套餐'
+
+
+def preference_arrays(table, preferences):
+    """
+    把各账号的偏好展开成数组
+    :type table: MenuTable
+    :type preferences: dict
+    :param preferences: {学号: 计划文件中的auto}，没有的账号什么都不改
+    :return: (每道菜的类别序号, 权重[账号, 菜], 份数[账号, 菜], 每餐最多几道[账号, 类别], 要订的餐次[账号, 餐次])
+    :rtype: (numpy.ndarray, numpy.ndarray, numpy.ndarray, numpy.ndarray, numpy.ndarray)
+    """
+    types = sorted({dish_type for dish_type, _ in table.dishes})
+    dish_type = np.array([types.index(dish_type) for dish_type, _ in table.dishes], dtype=np.int32)
+    n = len(table.accounts)
+    weights = np.zeros((n, len(table.dishes)))
+    servings = np.ones((n, len(table.dishes)), dtype=np.int32)
+    picks = np.full((n, len(types)), np.iinfo(np.int32).max, dtype=np.int32)
+    meals = np.zeros((n, len(MEAL_NAME)), dtype=np.bool_)
+    # 账号数×菜数，菜来来去去就那么几十道，逐个填也很快
+    for i, username in enumerate(table.accounts):
+        preference = preferences.get(username)
+        if preference is None:
+            continue
+        meals[i, [get_meal_id(str(meal)) for meal in preference.get('meals', MEAL_NAME)]] = True
+        prefer, amounts, pick = preference.get('prefer', {}), preference.get('servings', {}), preference.get('pick', {})
+        # 一次赋值一整行，不逐个元素地写进ndarray
+        weights[i] = [prefer.get(name, prefer.get(course_type, 0)) for course_type, name in table.dishes]
+        servings[i] = [amounts.get(name, amounts.get(course_type, 1)) for course_type, name in table.dishes]
+        picks[i] = [pick.get(course_type, picks[i, k]) for k, course_type in enumerate(types)]
+    if SET_MEAL in types:
+        picks[:, types.index(SET_MEAL)] = np.minimum(picks[:, types.index(SET_MEAL)], 1)
+    return dish_type, weights, servings, picks, meals
+
+
+class Solution(object):
+    """
+    solve的结果
+    按行（同MenuTable）：
+        quantity: 要订的份数，不由这次决定的行为原来的份数
+    按餐（同一账号、同一天、同一餐次为一餐）：
+        start: 这一餐的第一行
+        solved: 是否由这次决定
+        skipped: 是否因为钱不够勾上“不订餐”
+        cost: 这次决定的花费
+    按账号（同MenuTable.accounts）：
+        limit: 最多能花多少，inf为不限
+        spend: 这次决定的那些餐一共花多少
+    """
+    def __init__(self, table, quantity, start, solved, skipped, cost, limit):
+        """
+        :type table: MenuTable
+        """
+        self.table = table
+        self.quantity = quantity
+        self.start = start
+        self.solved = solved
+        self.skipped = skipped
+        self.cost = cost
+        self.limit = limit
+        self.spend = np.bincount(table.account[start], weights=cost, minlength=len(table.accounts))
+
+    def orders(self):
+        """
+        转换成submit_menu要的course_amount，只有要由这次决定的日期
+        course_amount含这一天的所有菜（不改的为原来的份数），服务器要每道菜都有一项
+        :return: {学号: {日期: (course_amount, {餐次: 是否“不订餐”})}}
+        :rtype: dict
+        """
+        table = self.table
+        # 每个账号每一天为一个菜单，菜单中有一餐要决定，整个菜单的行都要放进course_amount
+        menu = np.cumsum(np.r_[True, (table.account[1:] != table.account[:-1]) | (table.day[1:] != table.day[:-1])]) - 1
+        meal_menu = menu[self.start]
+        rows = np.flatnonzero(np.isin(menu, meal_menu[self.solved]))
+        days, day_index = np.unique(table.day[rows], return_inverse=True)
+        dates = np.datetime_as_string(days).tolist()
+
+        # 行已经按菜单连在一起了，切开后每个菜单用一次dict(zip())，不逐行在Python里赋值
+        # 键只有餐次×菜的编号那么几十种，共用同一批tuple
+        pairs = np.empty((len(MEAL_NAME), table.course.max(initial=0) + 1), dtype=object)
+        for index in np.ndindex(pairs.shape):
+            pairs[index] = index
+        keys = pairs[table.meal[rows], table.course[rows]].tolist()
+        quantity = self.quantity[rows].tolist()
+        first = np.flatnonzero(np.diff(menu[rows], prepend=-1))
+        bounds = np.r_[first, len(rows)].tolist()
+        orders = {}
+        for account, date, begin, end in zip(table.account[rows[first]].tolist(), day_index[first].tolist(),
+                                             bounds[:-1], bounds[1:]):
+            orders.setdefault(table.accounts[account], {})[dates[date]] = (
+                dict(zip(keys[begin:end], quantity[begin:end])), {})
+        start = self.start[self.solved]
+        for account, date, meal, skipped in zip(table.account[start].tolist(),
+                                                np.searchsorted(days, table.day[start]).tolist(),
+                                                table.meal[start].tolist(), self.skipped[self.solved].tolist()):
+            orders[table.accounts[account]][dates[date]][1][meal] = skipped
+        return orders
+
+
+def solve(table, preferences, budgets=None, balances=None, today=None):
+    """
+    一次算出所有账号所有还能修改的菜单要订的份数
+    :type table: MenuTable
+    :type preferences: dict
+    :type budgets: numpy.ndarray
+    :type balances: numpy.ndarray
+    :type today: datetime.date
+    :param preferences: 见preference_arrays
+    :param budgets: 每个账号这次最多花多少，顺序同table.accounts，inf为不限
+    :param balances: 每个账号的余额，不用余额限制的为nan
+    :param today: 今天及以后已经订了、这次不改的餐要从余额里扣掉
+    :rtype: Solution
+    """
+    n = len(table.accounts)
+    budgets = np.full(n, np.inf) if budgets is None else budgets
+    balances = np.full(n, np.nan) if balances is None else balances
+    today = np.datetime64(today or datetime.date.today(), 'D')
+    dish_type, weights, servings, picks, meals = preference_arrays(table, preferences)
+
+    # 行本来就是一餐一餐连着的
+    boundary = np.r_[True, (table.account[1:] != table.account[:-1]) | (table.day[1:] != table.day[:-1]) |
+                     (table.meal[1:] != table.meal[:-1])]
+    group = np.cumsum(boundary) - 1
+    start = np.flatnonzero(boundary)
+    active = table.mutable & meals[table.account, table.meal]
+    row_type = dish_type[table.dish]
+    is_set = np.array([course_type == SET_MEAL for course_type, _ in table.dishes], dtype=np.bool_)[table.dish]
+    weight = weights[table.account, table.dish]
+
+    # 每餐每个类别按权重排，取前pick道
+    candidates = np.flatnonzero(active & ~table.required & (weight > 0) & (table.max > 0))
+    key = group[candidates].astype(np.int64) * picks.shape[1] + row_type[candidates]
+    ranked = np.lexsort((table.course[candidates], -weight[candidates], key))
+    candidates, key = candidates[ranked], key[ranked]
+    first = np.ones(len(key), dtype=np.bool_)
+    first[1:] = key[1:] != key[:-1]
+    rank = np.arange(len(key)) - np.maximum.accumulate(np.where(first, np.arange(len(key)), 0))
+    chosen = candidates[rank < picks[table.account[candidates], row_type[candidates]]]
+
+    quantity = np.where(active, 0, table.current).astype(np.int32)
+    quantity[chosen] = np.where(is_set[chosen], 1,
+                                np.minimum(servings[table.account[chosen], table.dish[chosen]], table.max[chosen]))
+    # 订了套餐就不用特意去订必选菜了
+    has_set = np.zeros(len(start), dtype=np.bool_)
+    has_set[group[chosen[is_set[chosen]]]] = True
+    required = np.flatnonzero(active & table.required)
+    quantity[required] = ~has_set[group[required]]
+
+    # 能花的钱：预算，和余额减去以后已订、这次不改的。fmin会忽略nan
+    committed = ~active & (table.day >= today)
+    committed = np.bincount(table.account[committed], weights=table.spend[committed], minlength=n)
+    limit = np.fmin(budgets, balances - committed)
+
+    # 每个账号按日期、餐次的顺序订，订不起的那一餐跳过，不算进花费，后面便宜些的还能订
+    # 每餐要看前面实际花了多少，没法一次算完；餐数比行数少得多，逐餐走一遍也很快
+    cost = np.bincount(group, weights=np.where(active, table.price * quantity, 0), minlength=len(start))
+    solved = active[start]
+    sequence = np.flatnonzero(solved)
+    sequence = sequence[np.lexsort((table.meal[start[sequence]], table.day[start[sequence]].view(np.int64),
+                                    table.account[start[sequence]]))]
+    skipped = np.zeros(len(start), dtype=np.bool_)
+    spent = [0.0] * n
+    remaining = limit.tolist()
+    for meal, account, meal_cost in zip(sequence.tolist(), table.account[start[sequence]].tolist(),
+                                        cost[sequence].tolist()):
+        # 留一点余地，免得几角几分的浮点误差把刚好够的判成不够
+        if spent[account] + meal_cost > remaining[account] + 1e-6:
+            skipped[meal] = True
+        else:
+            spent[account] += meal_cost
+
+    quantity[skipped[group]] = 0
+    cost[skipped] = 0
+    return Solution(table, quantity, start, solved, skipped, cost, limit)
+
+
+def do_not_order_list(menu, do_not_order):
+    """
+    把{餐次: 是否“不订餐”}变成submit_menu要的[原页面已勾选的, 要勾选的, 要取消的]
+    :type menu: order.Menu
+    :type do_not_order: dict
+    :rtype: list
+    """
+    to_select = [meal for meal, selected in sorted(do_not_order.items()) if selected and meal not in menu.do_not_order]
+    to_deselect = [meal for meal, selected in sorted(do_not_order.items())
+                   if not selected and meal in menu.do_not_order]
+    return [menu.do_not_order, to_select, to_deselect]
+
+
+def fetch_account(account, start, end, workers=4):
+    """
+    登录一个账号，拉取start到end之间的菜单
+    :type account: dict
+    :type start: datetime.date
+    :type end: datetime.date
+    :type workers: int
+    :rtype: (order.Session, float, list[order.Menu])
+    :return: (已登录的Session, 余额, 菜单)
+    """
+    session = order.Session()
+    _, balance = bulk.login_account(account, session)
+    calendar = cache.get_calendar(account['student_id'], session)
+    menus = list(export.iter_menus(account['student_id'], export.iter_dates(calendar, start, end), session, workers))
+    cache.save_calendar(account['student_id'], calendar)
+    return session, float(balance), menus
+
+
+def submit_account(session, username, menus, orders, dry_run=False, batch=False):
+    """
+    按solve的结果给一个账号逐日提交，返回{日期: 结果}
+    :type session: order.Session
+    :type username: str
+    :type menus: list[order.Menu]
+    :type orders: dict
+    :param orders: Solution.orders()中这个账号的那一项
+    :rtype: dict
+    """
+    result = {}
+    for menu in menus:
+        if menu.date not in orders:
+            continue
+        course_amount, do_not_order = orders[menu.date]
+        try:
+            try:
+                result[menu.date] = bulk.submit_order(session, username, menu, course_amount,
+                                                      do_not_order_list(menu, do_not_order), dry_run, batch)
+            except order.StaleForm:
+                # 同bulk.order_date：重新拉取菜单再比一遍，course_amount是要改成的样子，不用重算
+                menu = cache.get_menu(username, menu.date, session)
+                result[menu.date] = bulk.submit_order(session, username, menu, course_amount,
+                                                      do_not_order_list(menu, do_not_order), dry_run, batch)
+        except order.SessionExpired as e:
+            result[menu.date] = str(e)
+    return result
+
+
+def command(args):
+    """
+    canteen.py auto，参数见那里
+    :type args: argparse.Namespace
+    """
+    instrument.enable_from_env()
+    start = datetime.datetime.strptime(args.start, '%Y-%m-%d').date()
+    end = datetime.datetime.strptime(args.end, '%Y-%m-%d').date()
+    plan = load_plan(args.plan)
+    accounts = [account for account in plan['accounts'] if 'auto' in account]
+    if not accounts:
+        print('计划中没有账号写了auto', file=sys.stderr)
+        return 1
+    concurrency = args.concurrency or plan.get('concurrency', 4)
+
+    def fetch(account):
+        try:
+            return fetch_account(account, start, end)
+        except (PlanError, order.LoginFailed, order.SessionExpired) as e:
+            print('{0}\t{1}'.format(account['student_id'], e), file=sys.stderr)
+            return None
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        fetched = {account['student_id']: (account, result)
+                   for account, result in zip(accounts, executor.map(fetch, accounts)) if result is not None}
+    if not fetched:
+        return 1
+
+    solve_start = time.perf_counter()
+    table = MenuTable.from_menus({student_id: [menu.to_dict() for menu in result[2]]
+                                  for student_id, (_, result) in fetched.items()})
+    autos = [fetched[student_id][0]['auto'] for student_id in table.accounts]
+    budgets = np.array([auto.get('budget', np.inf) for auto in autos], dtype=np.float64)
+    balances = np.array([fetched[student_id][1][1] if auto.get('use_balance') else np.nan
+                         for student_id, auto in zip(table.accounts, autos)])
+    solution = solve(table, dict(zip(table.accounts, autos)), budgets, balances)
+    orders = solution.orders()
+    print('{0}个账号、{1}行，用了{2:.1f} ms'.format(len(table.accounts), len(table),
+                                             (time.perf_counter() - solve_start) * 1000), file=sys.stderr)
+    for i, student_id in enumerate(table.accounts):
+        print('{0}\t-\t这次花{1:.2f}元，最多{2:.2f}元，{3}餐订不起'.format(
+            student_id, solution.spend[i], solution.limit[i],
+            np.count_nonzero(solution.skipped[table.account[solution.start] == i])))
+
+    def submit(student_id):
+        session, _, menus = fetched[student_id][1]
+        try:
+            return submit_account(session, student_id, menus, orders.get(student_id, {}), args.dry_run,
+                                  args.batch_toggles)
+        except Exception as e:
+            return {None: '{0}: {1}'.format(type(e).__name__, e)}
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        for student_id, result in zip(table.accounts, executor.map(submit, table.accounts)):
+            for date, status in result.items():
+                print('{0}\t{1}\t{2}'.format(student_id, date or '-', status))
+
+
+def main():
+    canteen.main(['auto'] + sys.argv[1:])
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,296 @@
+"""
+订餐记录的SQLite数据库，默认为缓存目录下的orders.sqlite3，可以用环境变量CANTEEN_DB指定
+    accounts: 账号的姓名、余额
+    menus:    每个账号每一天的菜单能否修改、什么时候拉取的
+    meals:    每一餐是否勾了“不订餐”、一共订了几份
+    courses:  每道菜的编号、类别、菜名、单价、最大份数、订购份数
+    submits:  批量订餐（bulk）每一天的结果
+菜单来自bulk --store、export --store（都是一个账号一个事务地写），或者query import（把缓存中的菜单一次导入）
+查询见canteen.py query：
+    query missing 2015-10-14 午餐              这一餐没订的账号
+    query demand --start 2015-10-12 --end 2015-10-16 [--meal 午餐]   每天每道菜一共订了几份
+    query results [--date 2015-10-14]         批量订餐的结果
+    query sql "SELECT ..."                    随便查
+只用标准库的sqlite3，不导入order，查询不用等requests、lxml
+"""
+import datetime
+import json
+import os
+import sqlite3
+import sys
+import time
+
+import cache
+from meals import MEAL_NAME
+from plan import get_meal_id
+
+DB_PATH = os.environ.get('CANTEEN_DB', os.path.join(cache.CACHE_DIR, 'orders.sqlite3'))
+
+# 常用的查询都按(date, meal)、菜名或账号找，各有索引；courses、meals的主键本身就是按账号的索引
+# meals只按主键查，用WITHOUT ROWID省掉一次回表
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS accounts (
+    student_id TEXT PRIMARY KEY,
+    name TEXT,
+    balance REAL,
+    updated_at TEXT
+);
+CREATE TABLE IF NOT EXISTS menus (
+    student_id TEXT NOT NULL,
+    date TEXT NOT NULL,
+    mutable INTEGER NOT NULL,
+    fetched_at TEXT NOT NULL,
+    PRIMARY KEY (student_id, date)
+);
+CREATE TABLE IF NOT EXISTS meals (
+    student_id TEXT NOT NULL,
+    date TEXT NOT NULL,
+    meal INTEGER NOT NULL,
+    do_not_order INTEGER NOT NULL,
+    ordered INTEGER NOT NULL,
+    PRIMARY KEY (student_id, date, meal)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS courses (
+    student_id TEXT NOT NULL,
+    date TEXT NOT NULL,
+    meal INTEGER NOT NULL,
+    seq INTEGER NOT NULL,
+    num INTEGER NOT NULL,
+    type TEXT NOT NULL,
+    name TEXT NOT NULL,
+    price REAL NOT NULL,
+    max INTEGER NOT NULL,
+    quantity INTEGER NOT NULL,
+    PRIMARY KEY (student_id, date, meal, seq)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS submits (
+    id INTEGER PRIMARY KEY,
+    student_id TEXT NOT NULL,
+    date TEXT,
+    status TEXT NOT NULL,
+    submitted_at TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS menus_date ON menus (date);
+CREATE INDEX IF NOT EXISTS meals_date_meal ON meals (date, meal);
+CREATE INDEX IF NOT EXISTS courses_date_meal ON courses (date, meal, name, quantity);
+CREATE INDEX IF NOT EXISTS courses_name ON courses (name, quantity);
+CREATE INDEX IF NOT EXISTS submits_student_date ON submits (student_id, date);
+'''
+
+
+def now_string():
+    return datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+
+
+class Store(object):
+    def __init__(self, path=None):
+        """
+        :type path: str
+        :param path: 默认为DB_PATH
+        """
+        path = path or DB_PATH
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.connection = sqlite3.connect(path)
+        # WAL：写的时候别的进程照样能查
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('PRAGMA synchronous=NORMAL')
+        # 按日期、菜名的索引插入的位置是乱的，页缓存大些（64MB）批量写入快得多
+        self.connection.execute('PRAGMA cache_size=-65536')
+        self.connection.executescript(SCHEMA)
+
+    def close(self):
+        self.connection.close()
+
+    def save_menus(self, menus, fetched_at=None):
+        """
+        在一个事务里写入一批菜单，同一账号同一天原有的记录会被替换，返回写了几个菜单
+        :type menus: collections.Iterable[(str, dict)]
+        :type fetched_at: str
+        :param menus: [(学号, Menu.to_dict()), ...]，用dict而不是Menu，从缓存导入时不用构造Menu
+        :rtype: int
+        """
+        fetched_at = fetched_at or now_string()
+        count = 0
+        with self.connection:
+            for student_id, menu in menus:
+                key = (student_id, menu['date'])
+                self.connection.execute('INSERT OR IGNORE INTO accounts (student_id) VALUES (?)', (student_id,))
+                self.connection.execute('DELETE FROM meals WHERE student_id = ? AND date = ?', key)
+                self.connection.execute('DELETE FROM courses WHERE student_id = ? AND date = ?', key)
+                self.connection.execute('INSERT OR REPLACE INTO menus VALUES (?, ?, ?, ?)',
+                                        key + (menu['mutable'], fetched_at))
+                self.connection.executemany('INSERT INTO meals VALUES (?, ?, ?, ?, ?)', [
+                    key + (meal['id'], meal['id'] in menu['do_not_order'],
+                           sum(course['current'] for course in meal['courses']))
+                    for meal in menu['meals']])
+                self.connection.executemany('INSERT INTO courses VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)', [
+                    key + (meal['id'], course['id'], course['num'], course['type'], course['name'], course['price'],
+                           course['max'], course['current'])
+                    for meal in menu['meals'] for course in meal['courses']])
+                count += 1
+        return count
+
+    def save_balances(self, balances):
+        """
+        :type balances: collections.Iterable[(str, dict)]
+        :param balances: [(学号, cache.load_balance的返回值), ...]
+        """
+        with self.connection:
+            self.connection.executemany('INSERT OR REPLACE INTO accounts VALUES (?, ?, ?, ?)', [
+                (student_id, balance['name'], balance['balance'],
+                 datetime.datetime.fromtimestamp(balance['saved_at']).strftime('%Y-%m-%d %H:%M:%S'))
+                for student_id, balance in balances])
+
+    def save_results(self, results, submitted_at=None):
+        """
+        在一个事务里写入bulk.run_plan的结果
+        :type results: dict
+        :type submitted_at: str
+        :param results: {学号: {日期: 结果}}，日期为None表示登录失败等
+        """
+        submitted_at = submitted_at or now_string()
+        with self.connection:
+            self.connection.executemany('INSERT INTO submits (student_id, date, status, submitted_at) '
+                                        'VALUES (?, ?, ?, ?)', [
+                                            (student_id, date, status, submitted_at)
+                                            for student_id, result in results.items()
+                                            for date, status in result.items()])
+
+    def missing(self, date, meal):
+        """
+        这一天这一餐没有订的账号：勾了“不订餐”，或者一份菜也没订。另外返回库里有、但没有这一天菜单的账号
+        :type date: str
+        :type meal: int
+        :rtype: (list[str], list[str])
+        """
+        missing = [row[0] for row in self.connection.execute(
+            'SELECT student_id FROM meals WHERE date = ? AND meal = ? AND (do_not_order OR ordered = 0) '
+            'ORDER BY student_id', (date, meal))]
+        unknown = [row[0] for row in self.connection.execute(
+            'SELECT student_id FROM accounts WHERE student_id NOT IN '
+            '(SELECT student_id FROM menus WHERE date = ?) ORDER BY student_id', (date,))]
+        return missing, unknown
+
+    def demand(self, start, end, meal=None):
+        """
+        start到end（含）每天每餐每道菜一共订了几份，勾了“不订餐”的那几餐不算
+        :type start: str
+        :type end: str
+        :type meal: int
+        :rtype: list[(str, int, str, int, int)]
+        :return: [(日期, 餐次, 菜名, 份数, 订了的人次), ...]
+        """
+        # courses_date_meal包含了要用的所有列，不用回表；不用COUNT(DISTINCT)，又省一棵临时的B树
+        sql = ('SELECT c.date, c.meal, c.name, SUM(c.quantity), COUNT(*) FROM courses c '
+               'JOIN meals m ON m.student_id = c.student_id AND m.date = c.date AND m.meal = c.meal '
+               'WHERE c.date BETWEEN ? AND ? AND c.quantity > 0 AND NOT m.do_not_order')
+        params = [start, end]
+        if meal is not None:
+            sql += ' AND c.meal = ?'
+            params.append(meal)
+        sql += ' GROUP BY c.date, c.meal, c.name ORDER BY c.date, c.meal, SUM(c.quantity) DESC'
+        return self.connection.execute(sql, params).fetchall()
+
+    def results(self, date=None, student_id=None):
+        """
+        批量订餐的结果，最近的在前
+        :type date: str
+        :type student_id: str
+        :rtype: list[(str, str, str, str)]
+        :return: [(提交时间, 学号, 日期, 结果), ...]
+        """
+        sql = 'SELECT submitted_at, student_id, date, status FROM submits WHERE 1'
+        params = []
+        if date is not None:
+            sql += ' AND date = ?'
+            params.append(date)
+        if student_id is not None:
+            sql += ' AND student_id = ?'
+            params.append(student_id)
+        return self.connection.execute(sql + ' ORDER BY submitted_at DESC, student_id, date', params).fetchall()
+
+    def query(self, sql, params=()):
+        """
+        :type sql: str
+        :rtype: (list[str], list[tuple])
+        :return: (列名, 行)
+        """
+        cursor = self.connection.execute(sql, params)
+        columns = [column[0] for column in cursor.description or ()]
+        return columns, cursor.fetchall()
+
+
+def import_cache(store, usernames=None):
+    """
+    把缓存中的菜单和余额导入数据库，不访问服务器，返回导入了几个菜单
+    :type store: Store
+    :type usernames: list[str]
+    :param usernames: 默认为缓存过菜单的所有账号
+    :rtype: int
+    """
+    usernames = usernames or cache.cached_usernames()
+    balances = [(username, cache.load_balance(username)) for username in usernames]
+    store.save_balances([(username, balance) for username, balance in balances if balance is not None])
+    return store.save_menus((username, menu) for username in usernames for menu in cache.cached_menus(username))
+
+
+def print_rows(columns, rows, as_json=False):
+    """
+    :type columns: list[str]
+    :type rows: list[tuple]
+    :type as_json: bool
+    :param as_json: 每行输出一个JSON对象，否则用制表符分隔
+    """
+    if as_json:
+        for row in rows:
+            print(json.dumps(dict(zip(columns, row)), ensure_ascii=False))
+        return
+    print('\t'.join(columns))
+    for row in rows:
+        print('\t'.join('' if value is None else str(value) for value in row))
+
+
+def command(args):
+    """
+    canteen.py query，参数见那里
+    :type args: argparse.Namespace
+    """
+    meal = getattr(args, 'meal', None)
+    if meal is not None:
+        try:
+            meal = get_meal_id(meal)
+        except ValueError:
+            meal = None
+        if meal not in range(len(MEAL_NAME)):
+            print('未知的餐次：{0}，可以是{1}或0~{2}'.format(args.meal, '、'.join(MEAL_NAME), len(MEAL_NAME) - 1),
+                  file=sys.stderr)
+            return 1
+
+    store = Store(args.db)
+    try:
+        start = time.perf_counter()
+        if args.action == 'import':
+            count = import_cache(store, args.accounts)
+            print('导入了{0}个菜单'.format(count))
+        elif args.action == 'missing':
+            missing, unknown = store.missing(args.date, meal)
+            print_rows(['student_id'], [(student_id,) for student_id in missing], args.json)
+            if unknown:
+                print('没有{0}的菜单：{1}'.format(args.date, ' '.join(unknown)), file=sys.stderr)
+        elif args.action == 'demand':
+            rows = [(date, MEAL_NAME[meal_id], name, quantity, orders)
+                    for date, meal_id, name, quantity, orders in store.demand(args.start, args.end, meal)]
+            print_rows(['date', 'meal', 'name', 'quantity', 'orders'], rows, args.json)
+        elif args.action == 'results':
+            print_rows(['submitted_at', 'student_id', 'date', 'status'],
+                       store.results(args.date, args.student_id), args.json)
+        else:
+            # 只能查，不能改
+            store.connection.execute('PRAGMA query_only = ON')
+            print_rows(*store.query(args.sql), as_json=args.json)
+        print('{0:.1f} ms'.format((time.perf_counter() - start) * 1000), file=sys.stderr)
+    except sqlite3.Error as e:
+        print(e, file=sys.stderr)
+        return 1
+    finally:
+        store.close()
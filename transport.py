@@ -0,0 +1,277 @@
+"""
+order.Session底下的连接池：每个host单独设连接池大小，超时和重试放在适配器这一层，还能查连接的复用情况
+默认所有order.Session共用同一个Transport，也就是共用连接池，而Cookie仍是各自的
+    transport.shared().stats()  # {'gzb.szsy.cn:80': {'connections': 3, 'requests': 120, 'reused': 117}, ...}
+每个host的请求还要经过一个Governor：令牌桶限制每秒的请求数，同时进行的请求数按AIMD调整，
+一切正常就慢慢加，出现5xx、超时或响应太慢就减半，这样大家都在订餐、服务器快撑不住的时候不会被我们压垮
+    transport.shared().limits()  # {'http://gzb.szsy.cn': {'limit': 8.0, 'active': 8, 'waiting': 3, ...}, ...}
+"""
+import threading
+import time
+
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import MaxRetryError
+from urllib3.util.retry import Retry
+
+# {URL前缀: 连接池大小}，requests按最长的前缀选适配器
+# 3000端口是中央登录，只有登录时用；“一卡通”系统都在80端口，多账号并发时连接数要跟得上线程数
+POOL_SIZES = {
+    'http://gzb.szsy.cn:3000': 4,
+    'http://gzb.szsy.cn': 16
+}
+# {URL前缀: (每秒请求数, 令牌桶的容量)}，没列出的不限速
+# 中央登录只在登录时用，多个账号同时登录也用不了多少；“一卡通”系统是ASP.NET，很容易被压垮
+RATES = {
+    'http://gzb.szsy.cn:3000': (5, 10),
+    'http://gzb.szsy.cn': (30, 30)
+}
+# 响应比这慢（秒）就算服务器吃不消了，和出错一样减少同时进行的请求数
+SLOW_LATENCY = 2.0
+# 减少时乘以这个数
+DECREASE_FACTOR = 0.5
+# (连接超时, 读取超时)，秒。学校的服务器有时很慢，读取超时放宽些
+TIMEOUT = (5, 30)
+# 连接失败时请求还没发出去，什么方法都可以重试；读取失败和502/503/504只重试GET，提交菜单的POST不能重发
+RETRIES = Retry(total=3, connect=3, read=2, status=2, backoff_factor=0.5, status_forcelist=(502, 503, 504),
+                allowed_methods=frozenset(['GET', 'HEAD']), raise_on_status=False)
+
+
+class Governor(object):
+    def __init__(self, max_limit, rate=None, burst=1, min_limit=1, slow=SLOW_LATENCY, clock=time.monotonic):
+        """
+        一个host的限流：令牌桶加上按AIMD调整的并发上限
+        :type max_limit: int
+        :type rate: float
+        :type burst: int
+        :type min_limit: int
+        :type slow: float
+        :param max_limit: 同时进行的请求数最多加到这么多，一般就是连接池的大小
+        :param rate: 每秒的请求数，None为不限
+        :param burst: 令牌桶的容量，即闲了一阵之后最多能一下子发多少个
+        :param slow: 见SLOW_LATENCY
+        """
+        self.max_limit = max_limit
+        self.min_limit = min_limit
+        # 从一半开始，没问题再往上加
+        self.limit = float(max(min_limit, max_limit // 2))
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.slow = slow
+        self.clock = clock
+        self.refilled_at = clock()
+        self.decreased_at = float('-inf')
+        self.active = 0
+        self.waiting = 0
+        self.decreases = 0
+        self.condition = threading.Condition()
+
+    def refill(self, now):
+        if self.rate is not None:
+            self.tokens = min(self.burst, self.tokens + (now - self.refilled_at) * self.rate)
+        self.refilled_at = now
+
+    def acquire(self):
+        """
+        等到同时进行的请求数低于上限、且有令牌，返回开始的时间，请求完了要调用release
+        :rtype: float
+        """
+        with self.condition:
+            self.waiting += 1
+            try:
+                while True:
+                    now = self.clock()
+                    self.refill(now)
+                    if self.active >= int(self.limit):
+                        # release时会叫醒
+                        self.condition.wait()
+                    elif self.rate is not None and self.tokens < 1:
+                        self.condition.wait((1 - self.tokens) / self.rate)
+                    else:
+                        if self.rate is not None:
+                            self.tokens -= 1
+                        self.active += 1
+                        return now
+            finally:
+                self.waiting -= 1
+
+    def release(self, started, ok):
+        """
+        :type started: float
+        :type ok: bool
+        :param started: acquire的返回值
+        :param ok: 是否成功，即没有超时、没有连接失败、状态码不是5xx
+        """
+        now = self.clock()
+        with self.condition:
+            self.active -= 1
+            if ok and now - started <= self.slow:
+                # 每过大约一轮（limit个请求）加一
+                self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+            elif started >= self.decreased_at:
+                # 上次减少之前就发出的请求不再算，不然同一批请求一起出错，一下子就减到底了
+                self.limit = max(self.min_limit, self.limit * DECREASE_FACTOR)
+                self.decreased_at = now
+                self.decreases += 1
+            self.condition.notify_all()
+
+    def stats(self):
+        """
+        当前的并发上限、正在进行的和排队等着的请求数、令牌数、减少过几次
+        :rtype: dict
+        """
+        with self.condition:
+            self.refill(self.clock())
+            return {
+                'limit': self.limit,
+                'active': self.active,
+                'waiting': self.waiting,
+                'rate': self.rate,
+                'tokens': self.tokens if self.rate is not None else None,
+                'decreases': self.decreases
+            }
+
+
+class PooledAdapter(HTTPAdapter):
+    def __init__(self, pool_maxsize=10, timeout=TIMEOUT, max_retries=RETRIES, governor=None, **kwargs):
+        """
+        :type pool_maxsize: int
+        :type timeout: (float, float)
+        :type max_retries: Retry
+        :type governor: Governor
+        :param timeout: 请求没有指定timeout时用这个
+        :param governor: 每个请求都要先经过它，None为不限
+        """
+        self.timeout = timeout
+        self.governor = governor
+        self.status_retries = max_retries
+        if governor is not None:
+            # 503之类的重试不交给urllib3，而是在send里做，这样每次都经过governor：
+            # 服务器一出错马上就减少并发，退避的时候也不占着名额
+            max_retries = max_retries.new(status=0)
+        super().__init__(pool_maxsize=pool_maxsize, max_retries=max_retries, **kwargs)
+
+    def send(self, request, timeout=None, **kwargs):
+        timeout = self.timeout if timeout is None else timeout
+        if self.governor is None:
+            return super().send(request, timeout=timeout, **kwargs)
+        retries = self.status_retries
+        while True:
+            started = self.governor.acquire()
+            ok = False
+            try:
+                response = super().send(request, timeout=timeout, **kwargs)
+                ok = response.status_code < 500
+            finally:
+                self.governor.release(started, ok)
+            if not retries.is_retry(request.method, response.status_code):
+                return response
+            try:
+                retries = retries.increment(request.method, request.url, response=response.raw)
+            except MaxRetryError:
+                return response
+            # 和urllib3自己重试时一样，读完响应把连接还回去，不要关掉
+            response.raw.drain_conn()
+            retries.sleep(response.raw)
+
+    def stats(self):
+        """
+        这个适配器中各个连接池建立过的连接数和发出的请求数，{host:port: (连接数, 请求数)}
+        :rtype: dict
+        """
+        stats = {}
+        pools = self.poolmanager.pools
+        for key in pools.keys():
+            pool = pools.get(key)
+            if pool is not None:
+                stats['{0}:{1}'.format(pool.host, pool.port)] = (pool.num_connections, pool.num_requests)
+        return stats
+
+
+class Transport(object):
+    def __init__(self, pool_sizes=None, timeout=TIMEOUT, retries=RETRIES, adapter_class=PooledAdapter, rates=None,
+                 governed=True):
+        """
+        :type pool_sizes: dict
+        :type timeout: (float, float)
+        :type retries: Retry
+        :type rates: dict
+        :type governed: bool
+        :param pool_sizes: 默认为POOL_SIZES
+        :param adapter_class: 用来创建适配器，参数同PooledAdapter
+        :param rates: 默认为RATES
+        :param governed: 为False时不限流
+        """
+        if pool_sizes is None:
+            pool_sizes = POOL_SIZES
+        if rates is None:
+            rates = RATES
+        self.adapters = {}
+        for prefix, size in pool_sizes.items():
+            governor = None
+            if governed:
+                rate, burst = rates.get(prefix, (None, 1))
+                governor = Governor(size, rate, burst)
+            self.adapters[prefix] = adapter_class(pool_maxsize=size, timeout=timeout, max_retries=retries,
+                                                  governor=governor)
+
+    def mount(self, session):
+        """
+        :type session: requests.Session
+        """
+        for prefix, adapter in self.adapters.items():
+            session.mount(prefix, adapter)
+
+    def governor(self, url):
+        """
+        url所用的Governor，同requests选适配器一样按最长的前缀选；没有的话为None
+        :type url: str
+        :rtype: Governor
+        """
+        prefixes = [prefix for prefix in self.adapters if url.lower().startswith(prefix.lower())]
+        if not prefixes:
+            return None
+        return self.adapters[max(prefixes, key=len)].governor
+
+    def close(self):
+        for adapter in self.adapters.values():
+            adapter.close()
+
+    def stats(self):
+        """
+        每个host建立过多少个连接、发出过多少个请求，reused为复用已有连接的请求数
+        :rtype: dict
+        """
+        stats = {}
+        for adapter in self.adapters.values():
+            for host, (connections, requests) in adapter.stats().items():
+                entry = stats.setdefault(host, {'connections': 0, 'requests': 0})
+                entry['connections'] += connections
+                entry['requests'] += requests
+        for entry in stats.values():
+            entry['reused'] = max(entry['requests'] - entry['connections'], 0)
+        return stats
+
+    def limits(self):
+        """
+        各个URL前缀的限流情况，见Governor.stats
+        :rtype: dict
+        """
+        return {prefix: adapter.governor.stats() for prefix, adapter in self.adapters.items()
+                if adapter.governor is not None}
+
+
+shared_transport = None
+shared_transport_lock = threading.Lock()
+
+
+def shared():
+    """
+    所有order.Session默认共用的Transport，第一次用时创建
+    :rtype: Transport
+    """
+    global shared_transport
+    with shared_transport_lock:
+        if shared_transport is None:
+            shared_transport = Transport()
+        return shared_transport
@@ -0,0 +1,270 @@
+#!/usr/bin/env python
+"""
+盯着还能修改的菜单，有变化时输出事件（NDJSON，每行一个），例如：
+{"time": "2015-10-05 12:00:00", "student_id": "1234567", "date": "2015-10-08", "event": "course", "meal": "午餐",
+ "num": 2, "name": "……", "current": [0, 1], "max": [1, 1], "full": true}
+event有这几种：course（某道菜的订购份数或最大份数变了，full表示订满了最大份数）、
+do_not_order（某一餐的“不订餐”被勾上或取消）、immutable（菜单不能再改了，之后不再盯这一天）；
+拉取失败时为error，下一轮照常再试
+所有账号、所有日期共用一个时间表，每隔--interval秒轮一遍，各个日期的时间错开，不会一下子全发出去
+每次轮询仍要拉取页面，但只对装着菜单的那一段算哈希（见menu_fingerprint），和上次一样就不解析了
+账号从计划文件（格式见plan.py）中读，只用到student_id和password_env，日期为日历上今天起--days天内的
+python watch.py plan.json [--days 7] [--interval 60] [-j 并发数] [--rounds 轮数] [-o events.ndjson]
+"""
+import datetime
+import heapq
+import itertools
+import json
+import sys
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from hashlib import sha1
+
+import bulk
+import cache
+import canteen
+import instrument
+import order
+from meals import MEAL_NAME
+from plan import PlanError, load_plan
+
+# 菜单所在的那一段：从第一个“不订餐”的勾选框（或第一张菜单的表）开始，到提交按钮的onclick为止
+# 前面是几十KB的__VIEWSTATE等，对是否变化没有意义；提交按钮是subs()还是msg()表示能否修改，要算进去
+MENU_REGION_START = 'Repeater1_'
+MENU_REGION_END = ('return subs();', 'return msg();')
+# 等着的时候每隔这么久（秒）看一眼是否该停了
+STOP_CHECK_INTERVAL = 1.0
+
+
+def menu_fingerprint(page):
+    """
+    菜单页面中会变化的那一段的哈希，不用解析。页面结构对不上时就对整个页面算
+    :type page: str
+    :rtype: str
+    """
+    start = page.find(MENU_REGION_START)
+    end = -1
+    for marker in MENU_REGION_END:
+        position = page.rfind(marker)
+        if position >= 0:
+            end = max(end, position + len(marker))
+    if start < 0 or end < start:
+        start, end = 0, len(page)
+    return sha1(page[start:end].encode('utf-8')).hexdigest()
+
+
+def diff_menus(old, new):
+    """
+    比较同一天的两个菜单，返回事件的列表（不带时间、学号、日期）
+    :type old: order.Menu
+    :type new: order.Menu
+    :rtype: list[dict]
+    """
+    events = []
+    for old_meal, new_meal in zip(old, new):
+        meal_name = MEAL_NAME[new_meal.id]
+        if (old_meal.id in old.do_not_order) != (new_meal.id in new.do_not_order):
+            events.append({'event': 'do_not_order', 'meal': meal_name, 'selected': new_meal.id in new.do_not_order})
+        for old_course, new_course in zip(old_meal, new_meal):
+            if (old_course.current, old_course.max) != (new_course.current, new_course.max):
+                events.append({
+                    'event': 'course',
+                    'meal': meal_name,
+                    'num': new_course.num,
+                    'name': new_course.name,
+                    'current': [old_course.current, new_course.current],
+                    'max': [old_course.max, new_course.max],
+                    'full': new_course.current >= new_course.max
+                })
+    if old.mutable and not new.mutable:
+        events.append({'event': 'immutable'})
+    return events
+
+
+def write_event(event, output=sys.stdout):
+    """
+    :type event: dict
+    :type output: io.TextIOBase
+    """
+    output.write(json.dumps(event, ensure_ascii=False))
+    output.write('\n')
+    output.flush()
+
+
+class Watcher(object):
+    def __init__(self, sessions, targets, interval=60, concurrency=4, rounds=None, emit=write_event,
+                 clock=time.monotonic):
+        """
+        :type sessions: dict
+        :type targets: list
+        :type interval: float
+        :type concurrency: int
+        :type rounds: int
+        :param sessions: {学号: 已登录的order.Session}
+        :param targets: [(学号, 日期), ...]
+        :param interval: 每个日期每隔多少秒看一次
+        :param rounds: 每个日期最多看几次，None为一直看下去
+        :param emit: 每个事件调用一次
+        :param clock: 取当前时间（秒）的函数
+        """
+        self.sessions = sessions
+        self.interval = interval
+        self.concurrency = concurrency
+        self.rounds = rounds
+        self.emit = emit
+        self.clock = clock
+        self.stopped = threading.Event()
+
+        # {(学号, 日期): 上次页面的指纹}、{(学号, 日期): 上次解析出的Menu}
+        self.fingerprints = {}
+        self.menus = {}
+        # 轮询了几次、其中解析了几次
+        self.polls = 0
+        self.parses = 0
+
+        # (时间, 序号, 学号, 日期, 第几次)。第一轮的时间在一个interval内均匀错开
+        self.queue = []
+        self.counter = itertools.count()
+        start = clock()
+        for i, (student_id, date) in enumerate(targets):
+            heapq.heappush(self.queue, (start + interval * i / len(targets), next(self.counter), student_id, date, 0))
+
+    def poll(self, student_id, date):
+        """
+        拉取一次页面，返回事件的列表和菜单能否修改。指纹和上次一样就直接返回，不解析
+        :type student_id: str
+        :type date: str
+        :rtype: (list[dict], bool)
+        """
+        key = student_id, date
+        page = order.get_menu(date, self.sessions[student_id])
+        fingerprint = menu_fingerprint(page)
+        if self.fingerprints.get(key) == fingerprint:
+            return [], self.menus[key].mutable
+
+        menu = order.Menu(date, page)
+        # 顺便更新缓存，别的命令就不用再解析了
+        cache.save_menu(student_id, menu, sha1(page.encode('utf-8')).hexdigest())
+        old = self.menus.get(key)
+        self.fingerprints[key] = fingerprint
+        self.menus[key] = menu
+        self.parses += 1
+        return ([] if old is None else diff_menus(old, menu)), menu.mutable
+
+    def poll_safely(self, entry):
+        """
+        :type entry: tuple
+        :rtype: (list[dict], bool)
+        """
+        _, _, student_id, date, _ = entry
+        try:
+            return self.poll(student_id, date)
+        except Exception as e:
+            # 网络、会话的问题下一轮再试
+            return [{'event': 'error', 'error': '{0}: {1}'.format(type(e).__name__, e)}], True
+
+    def run(self):
+        """
+        一直轮询下去，直到stop()、所有日期都不能修改了，或者都看够了rounds次
+        每个日期拉取完就按它自己的时间排下一次，不用等同一批的别的日期：一个卡在超时上的请求不会拖住整个时间表
+        """
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            # {Future: 队列中的那一项}
+            running = {}
+            while (self.queue or running) and not self.stopped.is_set():
+                # 到时间的都发出去
+                now = self.clock()
+                while self.queue and self.queue[0][0] <= now:
+                    entry = heapq.heappop(self.queue)
+                    running[executor.submit(self.poll_safely, entry)] = entry
+                delay = self.queue[0][0] - now if self.queue else STOP_CHECK_INTERVAL
+                delay = min(delay, STOP_CHECK_INTERVAL)
+                if not running:
+                    self.stopped.wait(delay)
+                    continue
+                done, _ = wait(running, timeout=delay, return_when=FIRST_COMPLETED)
+                for future in done:
+                    self.finish(running.pop(future), *future.result())
+
+    def finish(self, entry, events, mutable):
+        """
+        一次轮询结束：输出事件，排下一次
+        :type entry: tuple
+        :type events: list[dict]
+        :type mutable: bool
+        """
+        when, _, student_id, date, polls = entry
+        self.polls += 1
+        timestamp = datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        for event in events:
+            self.emit(dict({'time': timestamp, 'student_id': student_id, 'date': date}, **event))
+        if not mutable or (self.rounds is not None and polls + 1 >= self.rounds):
+            return
+        # 按原来的节奏排下一次；落后太多就从现在算，不要一下子补好几轮
+        heapq.heappush(self.queue, (max(when + self.interval, self.clock()), next(self.counter), student_id, date,
+                                    polls + 1))
+
+    def stop(self):
+        self.stopped.set()
+
+
+def watch_targets(account, session, days):
+    """
+    登录一个账号，返回日历上今天起days天内可查询的日期
+    :type account: dict
+    :type session: order.Session
+    :type days: int
+    :rtype: list[str]
+    """
+    bulk.login_account(account, session)
+    calendar = cache.get_calendar(account['student_id'], session)
+    today = datetime.date.today()
+    end = today + datetime.timedelta(days)
+    calendar.prefetch(today, end)
+    cache.save_calendar(account['student_id'], calendar)
+    today, end = today.strftime('%Y-%m-%d'), end.strftime('%Y-%m-%d')
+    return [date for date in calendar.orderable_dates() if today <= date <= end]
+
+
+def command(args):
+    """
+    canteen.py watch，参数见那里
+    :type args: argparse.Namespace
+    """
+    instrument.enable_from_env()
+    sessions = {}
+    targets = []
+    for account in load_plan(args.plan)['accounts']:
+        session = order.Session()
+        try:
+            dates = watch_targets(account, session, args.days)
+        except (PlanError, order.LoginFailed, order.SessionExpired) as e:
+            print('{0}\t{1}'.format(account['student_id'], e), file=sys.stderr)
+            continue
+        sessions[account['student_id']] = session
+        targets.extend((account['student_id'], date) for date in dates)
+    if not targets:
+        print('没有要盯的日期', file=sys.stderr)
+        return 1
+
+    output = open(args.output, 'a', encoding='utf-8') if args.output else sys.stdout
+    watcher = Watcher(sessions, targets, args.interval, args.concurrency, args.rounds,
+                      lambda event: write_event(event, output))
+    print('盯着{0}个账号的{1}个日期，每{2}秒一轮'.format(len(sessions), len(targets), args.interval), file=sys.stderr)
+    try:
+        watcher.run()
+    except KeyboardInterrupt:
+        watcher.stop()
+    finally:
+        if args.output:
+            output.close()
+    print('轮询{0}次，解析{1}次'.format(watcher.polls, watcher.parses), file=sys.stderr)
+
+
+def main():
+    canteen.main(['watch'] + sys.argv[1:])
+
+
+if __name__ == '__main__':
+    main()